@@ -11,6 +11,22 @@ PROJECT_PATH = os.path.abspath(os.path.dirname(__file__))
 HOST = 'localhost'
 PORT = 9337
 
+#Number of idle engine processes kept running for each engine type, so
+#new notebooks do not wait for an interpreter to start. 0 disables the pool.
+ENGINE_POOL_SIZE = 1
+
+#Engines not used for this many seconds are stopped. 0 disables.
+ENGINE_IDLE_TIMEOUT = 12 * 60 * 60
+
+#Resident memory (in MB) idle notebook engines together may use before the least
+#recently used ones are stopped. 0 disables.
+ENGINE_MEMORY_BUDGET = 0
+
+#Directory engines write plot images to. Only set this when the frontend
+#shares the filesystem: point it at the frontend's data/plot_images
+#directory and image data no longer travels with evaluation results.
+IMAGE_STORE = None
+
 #ENGINES_PATH = os.path.join(os.path.abspath('.'), 'data')
 
 try:
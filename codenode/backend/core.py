@@ -6,10 +6,12 @@
 # of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
 #########################################################################
 
+import os
 import re
 import sys
 import time
 import uuid
+from collections import deque
 
 import simplejson as json
 
@@ -20,6 +22,7 @@ from twisted.runner import procmon
 from twisted.internet import defer
 from twisted.internet import reactor
 from twisted.internet import protocol
+from twisted.internet import task
 from twisted.application import service
 from twisted.application import internet
 from twisted.plugin import getPlugins
@@ -31,6 +34,37 @@ from zope.interface import Interface, implements
 from codenode.backend.engine import EngineInstanceClient
 from codenode.backend.engine import IEngineConfiguration
 
+def cpu_load():
+    """One minute load average per cpu, or None if unknown.
+    """
+    try:
+        import multiprocessing
+        cpus = multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        cpus = 1
+    try:
+        return os.getloadavg()[0] / cpus
+    except (AttributeError, OSError):
+        return None
+
+def free_memory():
+    """Memory available for new processes in MB, read from /proc/meminfo;
+    None if unknown.
+    """
+    try:
+        f = open('/proc/meminfo')
+        try:
+            info = dict([(line.split(':')[0], int(line.split()[1])) for line in f])
+        finally:
+            f.close()
+    except (IOError, ValueError, IndexError):
+        return None
+    if 'MemAvailable' in info:
+        available = info['MemAvailable']
+    else:
+        available = sum([info.get(k, 0) for k in ('MemFree', 'Buffers', 'Cached')])
+    return available / 1024
+
 class BackendError(Exception):
     """Invalid backend operation...
     """
@@ -66,16 +100,45 @@ class EngineProcessProtocol(protocol.ProcessProtocol):
         """ """
         log.msg("Engine info/warning/error: ", data)
 
+    def processEnded(self, reason):
+        """Let the manager forget about engines that died on their own.
+        """
+        self.service.engineEnded(self.name)
+
     def interrupt(self):
         self.transport.signalProcess(SIGINT)
 
 class EngineProcessManager(procmon.ProcessMonitor):
+    """
+    Starts and stops engine processes.
+
+    Keeps a pool of pool_size idle, already running engine processes for
+    each engine type so that a new notebook does not have to wait for an
+    interpreter to boot. The pool is topped up in the background every
+    time an engine is claimed from it.
+
+    If image_store is set, engines write the images they produce to that
+    directory (see codenode.engine.display).
+
+    pool_types dict engine_type: config_object
+    pool dict engine_type: deque of (engine_id, port,)
+    pool_starting dict engine_type: number of pool engines booting
+    """
 
     engineProtocol = EngineProcessProtocol
     START_TIMEOUT = 60 #seconds
 
-    def __init__(self):
+    def __init__(self, pool_size=0, image_store=None):
         procmon.ProcessMonitor.__init__(self)
+        self.pool_size = pool_size
+        self.image_store = image_store
+        self.pool_types = {}
+        self.pool = {}
+        self.pool_starting = {}
+
+    def startService(self):
+        procmon.ProcessMonitor.startService(self)
+        self.fillPools()
 
     def addProcess(self, name, proc_config):
         """
@@ -97,11 +160,16 @@ class EngineProcessManager(procmon.ProcessMonitor):
         """
         if self.protocols.has_key(name):
             return
+        if not self.processes.has_key(name):
+            return
         p_conf = self.processes[name]
         p = self.protocols[name] = p_conf.processProtocol
         bin = p_conf.bin
         args = [bin] + p_conf.args
         env = p_conf.env
+        if self.image_store:
+            env = dict(env)
+            env['CODENODE_IMAGE_STORE'] = self.image_store
         path = p_conf.path
         self.timeStarted[name] = time.time()
         p.deferred.setTimeout(self.START_TIMEOUT)
@@ -114,6 +182,97 @@ class EngineProcessManager(procmon.ProcessMonitor):
             raise KeyError("No process named %s" % name)
         self.protocols[name].interrupt()
 
+    def engineEnded(self, name):
+        """The engine process exited.
+        """
+        self.protocols.pop(name, None)
+        murder = self.murder.pop(name, None)
+        if murder is not None and murder.active():
+            murder.cancel()
+        for idle in self.pool.values():
+            for entry in idle:
+                if entry[0] == name:
+                    idle.remove(entry)
+                    break
+
+    def setPoolTypes(self, engine_types):
+        """Set the engine types to keep idle engines for.
+        engine_types dict name: config_object
+        """
+        self.pool_types = engine_types
+        self.fillPools()
+
+    def fillPools(self):
+        for engine_type in self.pool_types.keys():
+            self.fillPool(engine_type)
+
+    def fillPool(self, engine_type):
+        """Start as many engines of engine_type as needed to fill its pool.
+        Nothing is started until the service is running.
+        """
+        if not self.active or engine_type not in self.pool_types:
+            return
+        idle = self.pool.setdefault(engine_type, deque())
+        starting = self.pool_starting.get(engine_type, 0)
+        engine_config = self.pool_types[engine_type]
+        for i in range(self.pool_size - len(idle) - starting):
+            engine_id = uuid.uuid4().hex
+            self.pool_starting[engine_type] = self.pool_starting.get(engine_type, 0) + 1
+            d = self.addProcess(engine_id, engine_config)
+            d.addCallback(self._poolEngineReady, engine_type, engine_id)
+            d.addErrback(self._poolEngineFailed, engine_type, engine_id)
+
+    def _poolEngineReady(self, port, engine_type, engine_id):
+        self.pool_starting[engine_type] -= 1
+        self.pool[engine_type].append((engine_id, port,))
+        log.msg('Pool engine %s of type %s ready' % (engine_id, engine_type))
+
+    def _poolEngineFailed(self, reason, engine_type, engine_id):
+        """Do not retry right away; a broken engine type would otherwise
+        keep spawning processes. The pool is refilled on the next claim.
+        """
+        self.pool_starting[engine_type] -= 1
+        log.err('Pool engine %s of type %s failed to start: %s' % (engine_id, engine_type, reason))
+        self.removeProcess(engine_id)
+
+    def claimProcess(self, engine_type):
+        """Take a running, idle engine of engine_type out of the pool.
+        return (engine_id, port,) or None when the pool is empty
+        """
+        idle = self.pool.get(engine_type)
+        if idle:
+            claimed = idle.popleft()
+        else:
+            claimed = None
+        reactor.callLater(0, self.fillPool, engine_type)
+        return claimed
+
+    def processMemory(self, name):
+        """Resident memory (RSS) of a running engine process in bytes.
+        Read from /proc, so this only works on Linux; return None when it
+        can not be found out.
+        """
+        try:
+            pid = self.protocols[name].transport.pid
+            f = open('/proc/%d/status' % pid)
+            try:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+            finally:
+                f.close()
+        except (KeyError, AttributeError, TypeError, IOError, ValueError):
+            pass
+        return None
+
+    def removeProcess(self, name):
+        """Stop process and forget about it for good.
+        """
+        if not self.processes.has_key(name):
+            return
+        self.stopProcess(name)
+        del self.processes[name]
+
 
 class EngineClientManager(service.Service):
     """
@@ -132,10 +291,10 @@ class EngineClientManager(service.Service):
         except KeyError:
             return None#raise?
 
-    def newSession(self, engine_id, port, backend):
+    def newSession(self, engine_id, port, backend, transport='xmlrpc'):
         """
         """
-        sess = self.sessionFactory(port)
+        sess = self.sessionFactory(port, transport)
         sess.engine_id = engine_id
         sess.backend = backend
         self.sessions[engine_id] = sess
@@ -144,6 +303,7 @@ class EngineClientManager(service.Service):
     def removeSession(self, engine_id):
         """
         """
+        self.sessions.pop(engine_id, None)
 
 
 class Backend(service.Service):
@@ -171,16 +331,21 @@ class Backend(service.Service):
         engine_types dict name: config_object
         engine_allocations dict access_id:engine_type
         engine_instances dict access_id:engine_id
+        engine_activity dict engine_id:time of last request
+        engine_requests dict engine_id:number of requests in progress
         """
         self.processManager = processManager
         self.clientManager = clientManager
         self.engine_types = {}
         self.engine_allocations = {}
         self.engine_instances = {}
+        self.engine_activity = {}
+        self.engine_requests = {}
 
     def updateEngineTypes(self):
         engines = getPlugins(IEngineConfiguration)
         self.engine_types = dict([(repr(e), e) for e in engines])
+        self.processManager.setPoolTypes(self.engine_types)
 
     def listEngineTypes(self):
         self.updateEngineTypes() # change this to a periodic update?
@@ -191,6 +356,19 @@ class Backend(service.Service):
     def listEngineInstances(self):
         return self.processManager.processes.keys()
 
+    def getLoad(self):
+        """Report how busy this backend host is, for placing new engines.
+        Unknown values are left out (xml-rpc has no None).
+        """
+        load = {'engines':len(self.engine_instances)}
+        cpu = cpu_load()
+        if cpu is not None:
+            load['cpu'] = cpu
+        memory = free_memory()
+        if memory is not None:
+            load['free_memory'] = memory
+        return load
+
     def allocateEngine(self, engine_type):
         """Create a new access id for running engines of given type.
         return access_id
@@ -202,6 +380,13 @@ class Backend(service.Service):
         log.msg('Allocated engine access id: %s for type: %s' % (access_id, engine_type,))
         return access_id
 
+    def allocateEngines(self, engine_type, count):
+        """Allocate count access ids in one go, so frontends can hand them
+        out without a round trip per notebook.
+        return list of access_id
+        """
+        return [self.allocateEngine(engine_type) for i in range(count)]
+
     def getEngine(self, access_id):
         """Get an engine client
         return deferred
@@ -228,24 +413,32 @@ class Backend(service.Service):
             log.msg('engine config for type: %s  %s' % (engine_type, str(engine_config)))
         except KeyError:
             log.err("Engine Type %s not in engine_types (was the engine plugin moved?)" % engine_type)
+        pooled = self.processManager.claimProcess(engine_type)
+        if pooled is not None:
+            engine_id, port = pooled
+            log.msg('Using pooled engine %s for access id: %s' % (engine_id, access_id))
+            self.engine_instances[access_id] = engine_id
+            return defer.succeed(self._newClientSession(port, engine_id,
+                                                engine_config.transport))
         engine_id = uuid.uuid4().hex
         self.engine_instances[access_id] = engine_id
         d = self.processManager.addProcess(engine_id, engine_config)
-        d.addCallback(self._newClientSession, engine_id)
-        d.addErrback(self._engineFailed, engine_id)
+        d.addCallback(self._newClientSession, engine_id, engine_config.transport)
+        d.addErrback(self._engineFailed, access_id)
         return d
 
-    def _newClientSession(self, port, engine_id):
+    def _newClientSession(self, port, engine_id, transport='xmlrpc'):
         """
         XXX added hack reference to processManager. Improve this next
         iteration.
         """
-        return self.clientManager.newSession(engine_id, port, self)
+        self.engine_activity[engine_id] = time.time()
+        return self.clientManager.newSession(engine_id, port, self, transport)
 
-    def _engineFailed(self, reason, engine_id):
+    def _engineFailed(self, reason, access_id):
         """
         """
-        del self.engine_instances[engine_id]
+        del self.engine_instances[access_id]
         return reason
 
     def interruptEngine(self, engine_id):
@@ -253,12 +446,110 @@ class Backend(service.Service):
 
     def stopEngine(self, engine_id):
         """XXX hacky. improve next iteration.
+
+        The access id stays allocated, so the next getEngine for it starts
+        a fresh engine.
         """
         for access_id, v in self.engine_instances.iteritems():
             if engine_id == v:
-                self.processManager.stopProcess(engine_id)
+                self.processManager.removeProcess(engine_id)
+                self.clientManager.removeSession(engine_id)
                 del self.engine_instances[access_id]
                 break
+        self.engine_activity.pop(engine_id, None)
+        self.engine_requests.pop(engine_id, None)
+
+    def engineRequestStarted(self, engine_id):
+        self.engine_activity[engine_id] = time.time()
+        self.engine_requests[engine_id] = self.engine_requests.get(engine_id, 0) + 1
+
+    def engineRequestFinished(self, engine_id):
+        self.engine_activity[engine_id] = time.time()
+        if self.engine_requests.get(engine_id, 0) > 1:
+            self.engine_requests[engine_id] -= 1
+        else:
+            self.engine_requests.pop(engine_id, None)
+
+    def engineBusy(self, engine_id):
+        """Whether engine_id has a request in progress or is still running
+        a streaming evaluation.
+        """
+        if engine_id in self.engine_requests:
+            return True
+        session = self.clientManager.getSession(engine_id)
+        return session is not None and session.streaming()
+
+    def runningEngines(self):
+        """Engines attached to an access id that are not busy.
+        return list of (last activity time, engine_id,), least recently
+        used first
+        """
+        engines = [(self.engine_activity.get(engine_id, 0), engine_id)
+                    for engine_id in self.engine_instances.values()
+                    if not self.engineBusy(engine_id)]
+        engines.sort()
+        return engines
+
+
+class EngineReaper(service.Service):
+    """
+    Periodically stops engines that are not being used.
+
+    Engines idle for more than idle_timeout seconds are stopped. When the
+    idle engines of notebooks together use more than memory_budget bytes of
+    resident memory, the least recently used ones are stopped until the
+    rest fit.
+    Either check is off when set to 0.
+
+    Engines keep their access id, so Backend.getEngine transparently
+    starts a new one (with a fresh namespace) the next time the notebook
+    sends a request.
+    """
+
+    interval = 60 #seconds
+
+    def __init__(self, backend, idle_timeout=0, memory_budget=0):
+        self.backend = backend
+        self.idle_timeout = idle_timeout
+        self.memory_budget = memory_budget
+        self.loop = None
+
+    def startService(self):
+        service.Service.startService(self)
+        self.loop = task.LoopingCall(self.reap)
+        self.loop.start(self.interval, now=False)
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+
+    def reap(self):
+        engines = self.backend.runningEngines()
+        if self.idle_timeout:
+            oldest = time.time() - self.idle_timeout
+            while engines and engines[0][0] < oldest:
+                last_active, engine_id = engines.pop(0)
+                log.msg('Stopping idle engine %s' % engine_id)
+                self.backend.stopEngine(engine_id)
+        if self.memory_budget:
+            self.evict(engines)
+
+    def evict(self, engines):
+        """Stop least recently used engines until the memory of engines
+        (see Backend.runningEngines) is within budget. Busy engines and the
+        idle ones of the pool can not be stopped here, so they do not count.
+        """
+        processManager = self.backend.processManager
+        memory = {}
+        for last_active, engine_id in engines:
+            memory[engine_id] = processManager.processMemory(engine_id) or 0
+        total = sum(memory.values())
+        while engines and total > self.memory_budget:
+            last_active, engine_id = engines.pop(0)
+            log.msg('Evicting engine %s, engines use %d bytes' % (engine_id, total))
+            total -= memory.get(engine_id, 0)
+            self.backend.stopEngine(engine_id)
 
 class EngineBus(object):
     """
@@ -288,7 +579,12 @@ class EngineBus(object):
             log.err('InvalidAccessId %s' % access_id)
             defer.returnValue(err)
 
-        result = yield engine_client.send(msg)
+        engine_id = engine_client.engine_id
+        self.backend.engineRequestStarted(engine_id)
+        try:
+            result = yield engine_client.send(msg)
+        finally:
+            self.backend.engineRequestFinished(engine_id)
         sucs = {'status':'OK', 'response':result}
         defer.returnValue(sucs)
 
@@ -6,12 +6,17 @@
 # of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
 #########################################################################
 
+import simplejson as json
+
 from zope.interface import Interface, implements
 
 from twisted.web import xmlrpc
 from twisted.plugin import IPlugin
 from twisted.python import log
 from twisted.internet import defer
+from twisted.internet import protocol
+from twisted.internet import reactor
+from twisted.protocols import basic
 
 
 class IEngineConfiguration(Interface):
@@ -32,6 +37,8 @@ class EngineConfigurationBase(object):
     @param args List of command line arguments passed to the bin
     @param env Environment variables.
     @param path Full path of directory to run the process in
+    @param transport How the backend talks to the engine: 'xmlrpc' for an
+    EngineRPCServer, 'frame' for an EngineFrameServer.
     """
 
     implements(IPlugin, IEngineConfiguration)
@@ -40,6 +47,7 @@ class EngineConfigurationBase(object):
     args = [] #List of command line args to pass
     env = {} #Dictionary of environment variables
     path = '' #Directory to run process in
+    transport = 'xmlrpc' #Protocol the engine server speaks
 
     def __init__(self):
         self.name = self.__class__.__name__
@@ -83,6 +91,260 @@ class IEngine(Interface):
 
 
 
+class EngineRemoteError(Exception):
+    """The engine answered a request with an error.
+    """
+
+
+class EngineFrameProtocol(basic.Int32StringReceiver):
+    """
+    Client side of the framed engine transport (see
+    codenode.engine.server.FrameRequestHandler).
+
+    Requests are tagged with an id so any number of them can be in flight
+    on the one connection.
+
+    Output frames of a streaming request go to its OutputStream. Each
+    time the stream is drained the engine is told how many bytes of the
+    request's output were taken ({"id": 1, "drained": n}); the engine only
+    sends so much output ahead of that (see
+    codenode.engine.server.FrameRequestHandler.stream_window), so a
+    chatty cell blocks instead of filling up memory here. The connection
+    itself is always read, so other requests are not held up by a stream
+    nobody polls.
+    """
+
+    MAX_LENGTH = 64 * 1024 * 1024
+
+    def __init__(self):
+        self.requests = {}
+        self.streams = {}
+        self.received = {}
+        self.next_id = 0
+
+    def callRemote(self, method, *args):
+        self.next_id += 1
+        request_id = self.next_id
+        d = self.requests[request_id] = defer.Deferred()
+        self.sendString(json.dumps({'id':request_id, 'method':method, 'params':args}))
+        return d
+
+    def callStreaming(self, stream, method, *args):
+        """Like callRemote, passing output that arrives ahead of the result
+        to stream.
+        """
+        d = self.callRemote(method, *args)
+        request_id = self.next_id
+        self.streams[request_id] = stream
+        self.received[request_id] = 0
+        stream.onDrained(lambda: self.acknowledge(request_id))
+        def done(result):
+            self.streams.pop(request_id, None)
+            self.received.pop(request_id, None)
+            return result
+        return d.addBoth(done)
+
+    def acknowledge(self, request_id):
+        """Tell the engine the output of request_id received so far was
+        drained, so it may send more.
+        """
+        size = self.received.get(request_id)
+        if not size or not self.connected:
+            return
+        self.received[request_id] = 0
+        self.sendString(json.dumps({'id':request_id, 'drained':size}))
+
+    def stringReceived(self, data):
+        msg = json.loads(data)
+        if 'stream' in msg:
+            self.streamReceived(msg, len(data))
+            return
+        d = self.requests.pop(msg.get('id'), None)
+        if d is None:
+            log.err('Engine response for unknown request: %s' % data[:200])
+            return
+        if 'error' in msg:
+            d.errback(EngineRemoteError(msg['error']))
+        else:
+            d.callback(msg['result'])
+
+    def streamReceived(self, msg, size):
+        request_id = msg.get('id')
+        stream = self.streams.get(request_id)
+        if stream is None:
+            return
+        self.received[request_id] += size
+        stream.write(msg['stream'], msg['data'])
+
+    def connectionLost(self, reason):
+        self.streams = {}
+        self.received = {}
+        requests, self.requests = self.requests, {}
+        for d in requests.values():
+            d.errback(reason)
+
+
+class EngineFrameProxy(object):
+    """
+    Same callRemote interface as xmlrpc.Proxy, but keeps one connection
+    open to the engine and reconnects if it drops.
+    """
+
+    protocolFactory = EngineFrameProtocol
+
+    def __init__(self, port, host='localhost'):
+        self.host = host
+        self.port = int(port)
+        self.protocol = None
+        self.waiting = None
+
+    def callRemote(self, method, *args):
+        d = self.getProtocol()
+        d.addCallback(lambda proto: proto.callRemote(method, *args))
+        return d
+
+    def callStreaming(self, stream, method, *args):
+        d = self.getProtocol()
+        d.addCallback(lambda proto: proto.callStreaming(stream, method, *args))
+        return d
+
+    def getProtocol(self):
+        if self.protocol is not None and self.protocol.connected:
+            return defer.succeed(self.protocol)
+        d = defer.Deferred()
+        if self.waiting is None:
+            self.waiting = []
+            creator = protocol.ClientCreator(reactor, self.protocolFactory)
+            connecting = creator.connectTCP(self.host, self.port)
+            connecting.addCallbacks(self._connected, self._connectFailed)
+        self.waiting.append(d)
+        return d
+
+    def _connected(self, proto):
+        self.protocol = proto
+        waiting, self.waiting = self.waiting, None
+        for d in waiting:
+            d.callback(proto)
+
+    def _connectFailed(self, reason):
+        waiting, self.waiting = self.waiting, None
+        for d in waiting:
+            d.errback(reason)
+
+
+class OutputStream(object):
+    """
+    Output of one streaming evaluation, held until the frontend polls
+    for it.
+
+    The onDrained callback is called whenever output was taken out of the
+    stream, so the engine can be asked for more. A stream not polled for
+    expire_polls poll timeouts is discarded: whoever started it is gone,
+    and its output must not hold up the engine.
+    """
+
+    poll_timeout = 25 #seconds
+    expire_polls = 4
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.result = None
+        self.waiting = None
+        self.drained = None
+        self.expired = None
+        self.discarded = False
+        self.expiry = None
+        self._watch()
+
+    def write(self, name, data):
+        """data is text ('out' and 'err') or, for name 'result', the
+        result of one cell of a batch (see engine_evaluate_batch).
+        """
+        if name != 'result' and self.chunks and self.chunks[-1][0] == name:
+            self.chunks[-1][1] += data
+        else:
+            self.chunks.append([name, data])
+        if self.discarded:
+            self._drain()
+            return
+        self._wake()
+
+    def onDrained(self, callback):
+        self.drained = callback
+
+    def onExpired(self, callback):
+        self.expired = callback
+
+    def discard(self):
+        """Nobody is going to poll this stream anymore; drop its output
+        and let the engine carry on.
+        """
+        self.discarded = True
+        self._unwatch()
+        self._drain()
+
+    def finish(self, result):
+        self.done = True
+        self.result = result
+        self._wake()
+
+    def fail(self, reason):
+        log.err('Streaming evaluation failed: %s' % reason)
+        self.finish({'out':'', 'err':reason.getErrorMessage()})
+
+    def poll(self):
+        """
+        return a Deferred firing with the output written since the last
+        poll. If there is none yet, wait for some, or at most poll_timeout
+        seconds.
+        """
+        if self.chunks or self.done:
+            self._watch()
+            return defer.succeed(self._drain())
+        self._wake()
+        self._unwatch()
+        d = self.waiting = defer.Deferred()
+        timeout = reactor.callLater(self.poll_timeout, self._wake)
+        def cancel(result):
+            if timeout.active():
+                timeout.cancel()
+            self._watch()
+            return result
+        return d.addBoth(cancel)
+
+    def _wake(self):
+        if self.waiting is not None:
+            d, self.waiting = self.waiting, None
+            d.callback(self._drain())
+
+    def _drain(self):
+        chunks, self.chunks = self.chunks, []
+        if chunks and self.drained is not None:
+            self.drained()
+        if self.done:
+            # the result goes out with this
+            self._unwatch()
+        return {'chunks':chunks, 'done':self.done, 'result':self.result}
+
+    def _watch(self):
+        # (re)start the time the stream waits for its next poll
+        self._unwatch()
+        if not (self.discarded or self.done):
+            self.expiry = reactor.callLater(self.poll_timeout * self.expire_polls, self._expire)
+
+    def _unwatch(self):
+        if self.expiry is not None and self.expiry.active():
+            self.expiry.cancel()
+        self.expiry = None
+
+    def _expire(self):
+        self.expiry = None
+        self.discard()
+        if self.expired is not None:
+            self.expired()
+
+
 class EngineInstanceClient(object):
     """
     This does not properly implement IEngine yet.
@@ -92,13 +354,21 @@ class EngineInstanceClient(object):
     """
 
     #implements(IEngine)
+
+    streamFactory = OutputStream
     
-    def __init__(self, port):
+    def __init__(self, port, transport='xmlrpc'):
         """
+        transport is the engine configurations transport; anything but
+        'frame' falls back to xmlrpc.
         """
-        self.client = xmlrpc.Proxy("http://localhost:%s" % port)
+        if transport == 'frame':
+            self.client = EngineFrameProxy(port)
+        else:
+            self.client = xmlrpc.Proxy("http://localhost:%s" % port)
         self.engine_id = ''
         self.backend = None
+        self.streams = {}
 
     def __str__(self):
         return 'Engine Client %s' % str(self.engine_id)
@@ -142,6 +412,80 @@ class EngineInstanceClient(object):
         result = yield self.client.callRemote('evaluate', to_evaluate)
         defer.returnValue(result)
 
+    def engine_evaluate_stream(self, to_evaluate, cellid):
+        """
+        Start an evaluation and return right away. Output is collected
+        with engine_output (same cellid) while the code runs; the last
+        poll carries the evaluation result.
+
+        Without the frame transport nothing can be streamed and all output
+        arrives with the result.
+        """
+        stream = self._newStream(cellid)
+        if hasattr(self.client, 'callStreaming'):
+            d = self.client.callStreaming(stream, 'evaluate_stream', to_evaluate)
+        else:
+            d = self.client.callRemote('evaluate', to_evaluate)
+        d.addCallbacks(stream.finish, stream.fail)
+        d.addBoth(lambda _: self._forgetStream(cellid, stream))
+        return {'streaming':True}
+
+    def engine_evaluate_batch(self, batch, batchid):
+        """
+        Start evaluating the cells of a notebook in one engine call and
+        return right away; batch is {'cells': [[cellid, code], ...],
+        'stop_on_error': bool}.
+
+        Like engine_evaluate_stream, with batchid as the cellid to poll
+        engine_output with. Each poll carries, as 'result' chunks, the
+        results ({'cellid', 'result'}) of the cells done since the last
+        one; the final result says which cell the batch stopped at, if it
+        stopped early. Without the frame transport all results come with
+        the final result.
+        """
+        stream = self._newStream(batchid)
+        args = ('evaluate_batch', batch['cells'], bool(batch.get('stop_on_error')))
+        if hasattr(self.client, 'callStreaming'):
+            d = self.client.callStreaming(stream, *args)
+        else:
+            d = self.client.callRemote(*args)
+        d.addCallbacks(stream.finish, stream.fail)
+        d.addBoth(lambda _: self._forgetStream(batchid, stream))
+        return {'streaming':True}
+
+    def streaming(self):
+        """Whether a streaming evaluation is still running. Those return
+        right away, so the engine has no request in progress meanwhile.
+        """
+        for stream in self.streams.values():
+            if not stream.done:
+                return True
+        return False
+
+    def _newStream(self, key):
+        if key in self.streams:
+            self.streams[key].discard()
+        stream = self.streams[key] = self.streamFactory()
+        stream.onExpired(lambda: self._forgetStream(key, stream))
+        return stream
+
+    def _forgetStream(self, key, stream):
+        # a discarded stream is not polled for; drop it once it is done
+        if stream.discarded and stream.done and self.streams.get(key) is stream:
+            del self.streams[key]
+
+    @defer.inlineCallbacks
+    def engine_output(self, arg, cellid):
+        """Long poll for output of a streaming evaluation.
+        """
+        stream = self.streams.get(cellid)
+        if stream is None:
+            defer.returnValue({'chunks':[], 'done':True, 'result':None})
+        output = yield stream.poll()
+        if output['done'] and self.streams.get(cellid) is stream:
+            del self.streams[cellid]
+        defer.returnValue(output)
+
     @defer.inlineCallbacks
     def engine_complete(self, to_complete, cellid):
         """
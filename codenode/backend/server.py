@@ -55,9 +55,17 @@ class BackendAdminRC(xmlrpc.XMLRPC):
     def xmlrpc_allocateEngine(self, engine_type):
         return self.backend.allocateEngine(engine_type)
 
+    def xmlrpc_allocateEngines(self, engine_type, count):
+        return self.backend.allocateEngines(engine_type, count)
+
     def xmlrpc_listEngineInstances(self):
         return self.backend.listEngineInstances()
 
+    def xmlrpc_getLoad(self):
+        """engines, cpu (load per cpu) and free_memory (MB) of this host.
+        """
+        return self.backend.getLoad()
+
     def xmlrpc_terminateInstance(self, engine_id):
         self.backend.terminateEngineInstance(engine_id)
         return
@@ -87,6 +95,14 @@ class BackendConfig(usage.Options):
             ['host', 'h', settings.HOST, 'Interface to listen on'],
             ['port', 'p', settings.PORT, 'Port number to listen on', int],
             ['env_path', 'e', os.path.abspath('.'), 'Codenode environment path'],
+            ['engine_pool', None, getattr(settings, 'ENGINE_POOL_SIZE', 0),
+                'Number of idle engines to keep running per engine type', int],
+            ['image_store', None, getattr(settings, 'IMAGE_STORE', None),
+                "Frontend plot image directory engines write images to"],
+            ['engine_idle_timeout', None, getattr(settings, 'ENGINE_IDLE_TIMEOUT', 0),
+                'Seconds after which unused engines are stopped (0 to disable)', int],
+            ['engine_memory_budget', None, getattr(settings, 'ENGINE_MEMORY_BUDGET', 0),
+                'MB of memory idle notebook engines may use before the least recently used are stopped (0 to disable)', int],
             ]
 
     optFlags = [
@@ -111,12 +127,17 @@ class BackendServerServiceMaker(object):
         clientManager = core.EngineClientManager() #sessions
         clientManager.setServiceParent(backendServices)
 
-        processManager = core.EngineProcessManager()
+        processManager = core.EngineProcessManager(options['engine_pool'],
+                                                options['image_store'])
         processManager.setServiceParent(backendServices)
 
         backend = core.Backend(processManager, clientManager)
         backend.updateEngineTypes()
 
+        reaper = core.EngineReaper(backend, options['engine_idle_timeout'],
+                                options['engine_memory_budget'] * 1024 * 1024)
+        reaper.setServiceParent(backendServices)
+
         backendEngineBus = core.EngineBus(backend)
 
         eng_proxy_factory = server.Site(BackendRoot(backend,
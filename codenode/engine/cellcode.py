@@ -0,0 +1,86 @@
+#########################################################################
+# Copyright (C) 2007, 2008, 2009
+# Alex Clemesha <alex@clemesha.org> & Dorian Raymer <deldotdr@gmail.com>
+#
+# This module is part of codenode, and is distributed under the terms
+# of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
+#########################################################################
+
+"""
+Compiling a cell once, into one code object per statement.
+
+The cell is parsed to an AST in one go and each top level statement is
+compiled on its own in 'single' mode, so the values of expression
+statements (also those in loops and other blocks) are echoed as at the
+interactive prompt. Running the code objects one after the other behaves
+like feeding the statements to the prompt one by one.
+
+Compiled cells are kept in an LRU cache keyed by a hash of their source,
+so evaluating a cell again (re-running a notebook) compiles nothing.
+"""
+
+import ast
+import codeop
+import hashlib
+
+FILENAME = '<femhub-online-lab>'
+
+# flags of the __future__ features; a code object carries those in effect
+_future_flags = 0
+for _feature in codeop._features:
+    _future_flags |= _feature.compiler_flag
+
+
+def compile_cell(source, flags=0, filename=FILENAME):
+    """list of code objects for the statements of source, compiled with
+    the __future__ flags (and those source imports). Raises SyntaxError
+    (and the like) if source does not parse.
+    """
+    tree = compile(source, filename, 'exec', flags | ast.PyCF_ONLY_AST, True)
+    codes = []
+    for node in tree.body:
+        code = compile(ast.Interactive(body=[node]), filename, 'single', flags, True)
+        # a __future__ import applies to the statements after it
+        flags |= code.co_flags & _future_flags
+        codes.append(code)
+    return codes
+
+def future_flags(codes):
+    """The __future__ flags that statements in codes turned on.
+    """
+    flags = 0
+    for code in codes:
+        flags |= code.co_flags & _future_flags
+    return flags
+
+
+class CodeCache(object):
+    """
+    Least recently used cache of compile_cell results.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.entries = {}
+        self.tick = 0
+
+    def key(self, source, flags):
+        if isinstance(source, unicode):
+            source = source.encode('utf-8')
+        return (hashlib.sha1(source).hexdigest(), flags)
+
+    def compile(self, source, flags=0):
+        """compile_cell(source, flags), from the cache if possible.
+        """
+        key = self.key(source, flags)
+        self.tick += 1
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[0] = self.tick
+            return entry[1]
+        codes = compile_cell(source, flags)
+        if len(self.entries) >= self.size:
+            oldest = min(self.entries.items(), key=lambda item: item[1][0])[0]
+            del self.entries[oldest]
+        self.entries[key] = [self.tick, codes]
+        return codes
@@ -1,8 +1,8 @@
-######################################################################### 
-# Copyright (C) 2007, 2008, 2009 
+#########################################################################
+# Copyright (C) 2007, 2008, 2009
 # Alex Clemesha <alex@clemesha.org> & Dorian Raymer <deldotdr@gmail.com>
-# 
-# This module is part of codenode, and is distributed under the terms 
+#
+# This module is part of codenode, and is distributed under the terms
 # of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
 #########################################################################
 
@@ -10,24 +10,266 @@
 Complete partial function, variable, attribute, etc. names
 Introspect an objects attributes/methods...
 
+Names are looked up in a sorted index of the keywords, builtins and
+namespace names, so completing a name costs a binary search plus the
+matches however large the namespace is (a pylab or sage namespace has
+thousands of names). The interpreter calls update() after each evaluation;
+it applies only the names that were added or removed since.
+
+Attribute completion never runs user code: the expression before the dot
+is not evaluated but resolved name by name from the namespace and the
+__dict__s of the objects and their classes (static_getattr), stopping at
+anything that would have to be computed, like a property or __getattr__.
+Attribute names are taken from dir() of the type of an object, cached per
+type, plus the instance's own __dict__; the completions of an object are
+cached by its identity. Any evaluation may change objects and the types
+defined by the user, so those caches are dropped on update().
+
 FIXME: need to handle errors
     example: introspect (attr_matches) on class. errors because class is a
     builtin.
 
 """
 
-import rlcompleter
+import re
+import types
+import bisect
+import keyword
+import __builtin__
+
+# Py_TPFLAGS_HEAPTYPE: the type was created by a class statement
+_HEAPTYPE = 1 << 9
+
+_re_attr = re.compile(r"(\w+(\.\w+)*)\.(\w*)$")
+
+
+def _prefixed(names, text):
+    """Names of the sorted list names starting with text.
+    """
+    matches = []
+    for i in xrange(bisect.bisect_left(names, text), len(names)):
+        if not names[i].startswith(text):
+            break
+        matches.append(names[i])
+    return matches
+
+def _callable_postfix(val, word):
+    if isinstance(val, types.InstanceType):
+        # callable() would ask the instance, maybe its __getattr__
+        is_callable = static_getattr(val, '__call__') is not NOT_FOUND
+    else:
+        is_callable = callable(val)
+    if is_callable:
+        word = word + "("
+    return word
+
+# result of static_getattr for an attribute that can not be read statically
+NOT_FOUND = object()
+
+# descriptors implemented in C, reading them runs no user code
+_c_descriptors = (types.GetSetDescriptorType, types.MemberDescriptorType)
+
+def _mro(klass):
+    if isinstance(klass, types.ClassType):
+        classes = [klass]
+        for base in klass.__bases__:
+            classes.extend(_mro(base))
+        return classes
+    return list(type.__dict__['__mro__'].__get__(klass))
+
+# classic classes and their instances answer __dict__ and __class__
+# themselves, never through __getattr__
+_classic = (types.ClassType, types.InstanceType)
+
+def _instance_dict(obj):
+    try:
+        if isinstance(obj, _classic):
+            instance_dict = obj.__dict__
+        else:
+            instance_dict = object.__getattribute__(obj, '__dict__')
+    except Exception:
+        return {}
+    if not isinstance(instance_dict, (dict, types.DictProxyType)):
+        return {}
+    return instance_dict
+
+def _class_of(obj):
+    if isinstance(obj, types.InstanceType):
+        return obj.__class__
+    return type(obj)
+
+def static_getattr(obj, name):
+    """The attribute name of obj, looked up in the __dict__s of obj and of
+    its classes without calling anything; NOT_FOUND if it is not there or
+    reading it would run code (properties, __getattr__ and the like).
+    """
+    if isinstance(obj, (type, types.ClassType)):
+        for klass in _mro(obj):
+            klass_dict = _instance_dict(klass)
+            if name in klass_dict:
+                value = klass_dict[name]
+                if isinstance(value, _c_descriptors):
+                    # for the instances; the metaclass may have its own
+                    break
+                if isinstance(value, (staticmethod, classmethod)):
+                    return value.__get__(None, obj)
+                return value
+        if isinstance(obj, types.ClassType):
+            # classic classes have no metaclass attributes
+            return NOT_FOUND
+        # then as an instance of its metaclass
+        instance_dict = {}
+    elif isinstance(obj, types.ModuleType):
+        instance_dict = _instance_dict(obj)
+        if name in instance_dict:
+            return instance_dict[name]
+    elif isinstance(obj, types.InstanceType):
+        if name == '__class__':
+            return obj.__class__
+        # no data descriptors: the instance always comes first
+        instance_dict = _instance_dict(obj)
+        if name in instance_dict:
+            return instance_dict[name]
+    else:
+        instance_dict = _instance_dict(obj)
+    for klass in _mro(_class_of(obj)):
+        klass_dict = _instance_dict(klass)
+        if name in klass_dict:
+            value = klass_dict[name]
+            if isinstance(value, _c_descriptors):
+                try:
+                    return value.__get__(obj, klass)
+                except Exception:
+                    return NOT_FOUND
+            if hasattr(type(value), '__set__') and not isinstance(value, types.InstanceType):
+                # data descriptor: takes precedence, but would run code
+                return NOT_FOUND
+            if name in instance_dict:
+                return instance_dict[name]
+            if isinstance(value, (staticmethod, classmethod, types.FunctionType)):
+                return value.__get__(obj, klass)
+            return value
+    return instance_dict.get(name, NOT_FOUND)
+
+def resolve(expr, namespace):
+    """The object expr (a dotted name) refers to in namespace, or NOT_FOUND
+    if it can not be resolved without running code (see static_getattr).
+    """
+    names = expr.split('.')
+    obj = namespace.get(names[0], NOT_FOUND)
+    if obj is NOT_FOUND:
+        obj = __builtin__.__dict__.get(names[0], NOT_FOUND)
+    for name in names[1:]:
+        if obj is NOT_FOUND:
+            break
+        obj = static_getattr(obj, name)
+    return obj
+
+def _class_members(klass):
+    members = dir(klass)
+    for base in getattr(klass, '__bases__', ()):
+        members = members + _class_members(base)
+    return members
 
 
 class Completer:
     def __init__(self, namespace=None):
-        self.completer = rlcompleter.Completer(namespace)
+        if namespace is None:
+            namespace = {}
+        self.namespace = namespace
+        self.static_names = sorted(set(keyword.kwlist) | set(__builtin__.__dict__))
+        self.names = []
+        self.name_set = frozenset()
+        self.type_attrs = {}
+        self.attr_cache = {}
+        self.update()
+
+    def update(self):
+        """Bring the index up to date with the namespace.
+
+        The index is replaced, not changed in place, so a completion
+        running meanwhile (see server.py) sees either the old or the new.
+        """
+        keys = set(self.namespace.keys())
+        keys.discard('__builtins__')
+        names = self.names
+        current = self.name_set
+        added, removed = keys - current, current - keys
+        if len(added) + len(removed) > len(names) / 8:
+            names = sorted(keys)
+        elif added or removed:
+            names = list(names)
+            for name in removed:
+                del names[bisect.bisect_left(names, name)]
+            for name in added:
+                bisect.insort(names, name)
+        self.names = names
+        self.name_set = frozenset(keys)
+        for klass in self.type_attrs.keys():
+            if getattr(klass, '__flags__', _HEAPTYPE) & _HEAPTYPE:
+                del self.type_attrs[klass]
+        self.attr_cache = {}
 
     def global_matches(self, text):
-        return self.completer.global_matches(text)
+        namespace = self.namespace
+        matches = []
+        for word in _prefixed(self.names, text):
+            try:
+                matches.append(_callable_postfix(namespace[word], word))
+            except KeyError:
+                # removed since the last update
+                continue
+        for word in _prefixed(self.static_names, text):
+            if word in namespace:
+                continue
+            if keyword.iskeyword(word):
+                matches.append(word)
+            else:
+                matches.append(_callable_postfix(__builtin__.__dict__[word], word))
+        return matches
+
+    def object_attrs(self, obj):
+        """Attribute names of obj, as dir() would find them.
+        """
+        if isinstance(obj, (type, types.ClassType)):
+            words = set()
+            for klass in _mro(obj):
+                words.update(_instance_dict(klass).keys())
+            if isinstance(obj, type):
+                words.add('__class__')
+                words.update(_class_members(type(obj)))
+            return words
+        klass = _class_of(obj)
+        words = self.type_attrs.get(klass)
+        if words is None:
+            words = frozenset(_class_members(klass))
+            self.type_attrs[klass] = words
+        words = set(words) | set(_instance_dict(obj).keys())
+        if isinstance(obj, types.InstanceType):
+            words.add('__class__')
+        return words - set(['__builtins__'])
+
+    def completions(self, obj):
+        """Sorted attribute names of obj, callables ending in '(' (when
+        they can be told statically), cached by the identity of obj.
+        """
+        entry = self.attr_cache.get(id(obj))
+        if entry is not None and entry[0] is obj:
+            return entry[1]
+        words = []
+        for word in self.object_attrs(obj):
+            words.append(_callable_postfix(static_getattr(obj, word), word))
+        words.sort()
+        # holds on to obj, so its id is not reused until update
+        self.attr_cache[id(obj)] = (obj, words)
+        return words
 
     def attr_matches(self, text):
-        m = self.completer.attr_matches(text)
-        m = list(set(m))
-        m.sort()
-        return m
+        m = _re_attr.match(text)
+        if not m:
+            return []
+        expr, attr = m.group(1, 3)
+        obj = resolve(expr, self.namespace)
+        if obj is NOT_FOUND:
+            return []
+        return ["%s.%s" % (expr, word) for word in _prefixed(self.completions(obj), attr)]
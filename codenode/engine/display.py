@@ -0,0 +1,54 @@
+#########################################################################
+# Copyright (C) 2007, 2008, 2009
+# Alex Clemesha <alex@clemesha.org> & Dorian Raymer <deldotdr@gmail.com>
+#
+# This module is part of codenode, and is distributed under the terms
+# of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
+#########################################################################
+
+"""
+Rich (non text) output of the engine.
+
+Code running in the engine publishes images here instead of writing them
+to stdout. The interpreter collects what was published during an
+evaluation and returns it under 'display' next to the text output.
+
+When the backend gives the engine an image store (the
+CODENODE_IMAGE_STORE environment variable, a directory shared with the
+frontend) images are written there, named by the sha1 of their content,
+and only the file name goes back. Otherwise the image bytes go back base64
+encoded.
+"""
+
+import os
+import base64
+import hashlib
+
+STORE_VARIABLE = 'CODENODE_IMAGE_STORE'
+
+_extensions = {'image/png':'.png'}
+_published = []
+
+def publish_image(data, mimetype='image/png'):
+    """Publish the bytes of an image.
+    """
+    store = os.environ.get(STORE_VARIABLE)
+    if store:
+        name = hashlib.sha1(data).hexdigest() + _extensions.get(mimetype, '')
+        path = os.path.join(store, name)
+        if not os.path.exists(path):
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            f = open(tmp, 'wb')
+            f.write(data)
+            f.close()
+            os.rename(tmp, path)
+        _published.append({'type':mimetype, 'ref':name})
+    else:
+        _published.append({'type':mimetype, 'data':base64.b64encode(data)})
+
+def collect():
+    """Return and forget everything published so far.
+    """
+    items = _published[:]
+    del _published[:]
+    return items
@@ -23,9 +23,11 @@ from code import softspace, InteractiveInterpreter
 #from codenode.kernel.engine.python.outputtrap import OutputTrap
 #from codenode.kernel.engine.python.completer import Completer
 #from codenode.kernel.engine.python.introspection import introspect
-from outputtrap import OutputTrap
+from outputtrap import OutputTrap, StreamingOutputTrap
 from completer import Completer
 from introspection import introspect
+import display
+import cellcode
 
 class codenodeError(Exception):
     pass
@@ -47,8 +49,12 @@ class Interpreter(InteractiveInterpreter):
         InteractiveInterpreter.__init__(self, namespace)
         self.output_trap = OutputTrap()
         self.completer = Completer(self.locals)
+        self.code_cache = cellcode.CodeCache()
         self.input_count = 0
         self.interrupted = False
+        # whether the last evaluation raised, or was interrupted
+        self.failed = False
+        self.aborted = False
 
     def _result_dict(self, out, in_string='', err='', in_count='', cmd_count=''):
         return {'input_count':in_count,
@@ -65,21 +71,58 @@ class Interpreter(InteractiveInterpreter):
         self.interrupted = False
         return self._result_dict('ok')
 
-    def evaluate(self, input_string):
+    def evaluate(self, input_string, sink=None):
         """give the input_string to the python interpreter in the
-        usernamespace"""
-        self.output_trap.set()
+        usernamespace
+
+        If sink is given, output is passed to sink(name, data) while the
+        code runs ('out' or 'err' for name) and is not part of the result.
+        """
+        if sink is None:
+            output_trap = self.output_trap
+        else:
+            output_trap = StreamingOutputTrap(sink)
+        self.failed = self.aborted = False
+        output_trap.set()
         command_count = self._runcommands(input_string)
-        out_values = self.output_trap.get_values()
-        self.output_trap.reset()
+        out_values = output_trap.get_values()
+        output_trap.reset()
+        self.completer.update()
         self.input_count += 1
         result = {'input_count':self.input_count,
                     'cmd_count':command_count,
                     'in':input_string,
                     'out':out_values[0],
-                    'err':out_values[1]}
+                    'err':out_values[1],
+                    'display':display.collect()}
         return result
 
+    def evaluate_batch(self, cells, stop_on_error=False, sink=None):
+        """Evaluate cells, a list of (cellid, input_string,), in order,
+        like evaluate each.
+
+        Stops after a cell that raised if stop_on_error is set, and after
+        an interrupted cell in any case.
+
+        return a dict containing:
+            - results: a {'cellid', 'result'} dict per evaluated cell
+            - stopped: the cellid the batch stopped at, or None
+        If sink is given, each result is passed to sink('result', ...)
+        as soon as the cell is done instead of being in results.
+        """
+        results = []
+        stopped = None
+        for cellid, input_string in cells:
+            item = {'cellid':cellid, 'result':self.evaluate(input_string)}
+            if sink is None:
+                results.append(item)
+            else:
+                sink('result', item)
+            if self.aborted or (self.failed and stop_on_error):
+                stopped = cellid
+                break
+        return {'results':results, 'stopped':stopped}
+
     def introspect(self, input_string):
         """See what information there is about this objects methods and
         attributes."""
@@ -121,25 +164,49 @@ class Interpreter(InteractiveInterpreter):
 
     def _runcommands(self, input_string):
         """input_string could contain multiple lines, multiple commands, or
-        multiple multiline commands. This method builds a compiled command
-        line by line until a complete command has been compiled. Once it
-        has a complete command, it execs it in the username space and the
-        output is stored in the output trap. There may be more than one
+        multiple multiline commands. It is compiled once into a code object
+        per command (see cellcode.py), cached by its source, and the
+        commands are executed in the username space one after the other;
+        the output is stored in the output trap. The number of commands is
+        returned.
+
+        Input that does not compile as a whole is run line by line as at
+        the prompt (_runlines), so the commands before the error still run.
+        """
+        if self.interrupted:
+            print>>sys.stderr, 'Aborted.'
+            return 0
+        lines = [l and self._pre_execute_filter(l) for l in input_string.split('\n')]
+        flags = self.compile.compiler.flags
+        try:
+            codes = self.code_cache.compile('\n'.join(lines), flags)
+        except (OverflowError, SyntaxError, ValueError):
+            return self._runlines([l for l in lines if len(l) > 0])
+        # like codeop, later input compiles with the __future__ features
+        # this input imported
+        self.compile.compiler.flags = flags | cellcode.future_flags(codes)
+        command_count = 0
+        for code in codes:
+            try:
+                self.runcode(code)
+            except OperationAborted, e:
+                print>>sys.stderr, e.value
+                self.aborted = True
+                return command_count
+            command_count += 1
+        return command_count
+
+    def _runlines(self, lines):
+        """This method builds a compiled command line by line until a
+        complete command has been compiled. Once it has a complete command,
+        it execs it in the username space. There may be more than one
         command; the number of complete commands is counted
         (Based off of ipython1.core.shell.InteractiveShell._runlines)"""
 
         command_buffer = []
         command_count = 0
-
-        if self.interrupted:
-            print>>sys.stderr, 'Aborted.'
-            #sys.stderr.write('Aborted')
-            return command_count
-        lines = input_string.split('\n')
-        lines = [l for l in lines if len(l) > 0]
         more = False
         for line in lines:
-            line = self._pre_execute_filter(line)
             command_buffer.append(line)
             if line or more:
                 torun = '\n'.join(command_buffer)
@@ -147,6 +214,7 @@ class Interpreter(InteractiveInterpreter):
                     more = self.runsource(torun)
                 except OperationAborted, e:
                     print>>sys.stderr, e.value
+                    self.aborted = True
                     #sys.stderr.write(e.value)
                     # XXX This could be bad if something other than the
                     # kernelConnection triggers an interrupt
@@ -175,7 +243,7 @@ class Interpreter(InteractiveInterpreter):
            the new implementation is almost identical to the original one.
 
         """
-        filename = '<femhub-online-lab>'
+        filename = cellcode.FILENAME
 
         try:
             code = self.compile(source, filename, 'single')
@@ -219,6 +287,14 @@ class Interpreter(InteractiveInterpreter):
             if softspace(sys.stdout, 0):
                 print
 
+    def showsyntaxerror(self, filename=None):
+        self.failed = True
+        InteractiveInterpreter.showsyntaxerror(self, filename)
+
+    def showtraceback(self):
+        self.failed = True
+        InteractiveInterpreter.showtraceback(self)
+
     def _pre_execute_filter(self, input_string):
         """Very simple at this point in devel.
         Look for '?' at end of a line."""
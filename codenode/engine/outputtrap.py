@@ -11,6 +11,8 @@ Trap for stdout and stderr of the python interpreter.
 """
 
 import sys
+import time
+import threading
 from cStringIO import StringIO
 
 class OutputTrap(object):
@@ -48,3 +50,91 @@ class OutputTrap(object):
         err = self.err.getvalue()
         return (out, err)
 
+
+class StreamingOutput(object):
+    """
+    File like object standing in for stdout or stderr during a streaming
+    evaluation.
+
+    Text is handed to sink(name, data) in chunks instead of piling up until
+    the evaluation finishes. A chunk goes out once chunk_size bytes are
+    buffered, or flush_interval seconds after the first unsent write, so
+    no more than chunk_size bytes are ever held here.
+    """
+
+    chunk_size = 4096
+    flush_interval = 0.2 #seconds
+
+    def __init__(self, name, sink):
+        self.name = name
+        self.sink = sink
+        self.softspace = 0
+        self.buffer = []
+        self.size = 0
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.lock.acquire()
+        try:
+            self.buffer.append(data)
+            self.size += len(data)
+            if self.size >= self.chunk_size:
+                self._flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.setDaemon(True)
+                self.timer.start()
+        finally:
+            self.lock.release()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            self._flush()
+        finally:
+            self.lock.release()
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.buffer:
+            data = ''.join(self.buffer)
+            self.buffer = []
+            self.size = 0
+            self.sink(self.name, data)
+
+    def close(self):
+        self.flush()
+
+    def isatty(self):
+        return False
+
+
+class StreamingOutputTrap(OutputTrap):
+    """
+    Trap that passes output on to sink as it is produced instead of
+    keeping it. get_values only returns what is left over, which after a
+    flush is nothing.
+    """
+
+    def __init__(self, sink):
+        self.out = StreamingOutput('out', sink)
+        self.err = StreamingOutput('err', sink)
+
+    def reset(self):
+        self.out.close()
+        self.err.close()
+        self.unset()
+
+    def get_values(self):
+        self.out.flush()
+        self.err.flush()
+        return ('', '')
@@ -7,40 +7,207 @@
 #########################################################################
 
 import sys
+import Queue
+import socket
+import struct
+import threading
+import SocketServer
 #import logging as log
 from SimpleXMLRPCServer import SimpleXMLRPCServer
+from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
 
-class EngineRPCServer(SimpleXMLRPCServer):
 
-    def __init__(self, addr, interpreter, namespace):
-        SimpleXMLRPCServer.__init__(self, addr)
+class _Job(object):
+    """
+    One engine method call. callback(result, error) is called once with
+    its outcome; error is None or the sys.exc_info() of its exception.
+    """
+
+    def __init__(self, func, args, callback):
+        self.func = func
+        self.args = args
+        self.callback = callback
+        self.finished = False
+
+    def run(self):
+        try:
+            result = self.func(*self.args)
+        except:
+            self.finish(None, sys.exc_info())
+        else:
+            self.finish(result, None)
+
+    def finish(self, result, error):
+        if self.finished:
+            return
+        try:
+            self.callback(result, error)
+        except KeyboardInterrupt:
+            # an interrupt meant for the job came in late; the caller is
+            # still owed an answer
+            self.finish(None, sys.exc_info())
+            return
+        except Exception:
+            # e.g. the connection to answer on is gone; the engine goes on
+            pass
+        # only now: an interrupt escaping from here is handled by finishing
+        # the job again (see serve_forever)
+        self.finished = True
+
+
+class _Window(object):
+    """
+    Flow control of the output of one streaming request: at most size
+    bytes of it are sent ahead of what the backend said it drained.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.pending = 0
+        self.closed = False
+        self.changed = threading.Condition()
+
+    def consume(self, size):
+        """Wait until size more bytes may be sent.
+        """
+        self.changed.acquire()
+        try:
+            while self.pending >= self.size and not self.closed:
+                # with a timeout, so an interrupt gets through
+                self.changed.wait(0.5)
+            self.pending += size
+        finally:
+            self.changed.release()
+
+    def drained(self, size):
+        self.changed.acquire()
+        try:
+            self.pending -= size
+            self.changed.notifyAll()
+        finally:
+            self.changed.release()
+
+    def close(self):
+        self.changed.acquire()
+        try:
+            self.closed = True
+            self.changed.notifyAll()
+        finally:
+            self.changed.release()
+
+
+class EngineRPCServer(SocketServer.ThreadingMixIn, SimpleXMLRPCServer):
+    """
+    Requests are read on a thread per connection. Methods that only read
+    the interpreter state (concurrent_methods) are answered right there, so
+    completion keeps working while a cell runs; all others (evaluate) run
+    one at a time, in the order they arrived, on the main thread in
+    serve_forever, which is the thread an interrupt (SIGINT) reaches.
+
+    The concurrent methods read the namespace while a cell may be changing
+    it; they only take copies of it (dict.items(), dir()), each made in
+    one step, so they see it as it was between two bytecodes of the cell.
+    """
+
+    daemon_threads = True
+
+    # methods that can pass output to a sink while they run
+    streaming_methods = ('evaluate_stream', 'evaluate_batch')
+
+    # methods answered on the request thread, also while a cell runs; not
+    # introspect, which prints, into the output of the running cell
+    concurrent_methods = ('hello', 'status', 'complete', 'complete_name', 'complete_attr',
+                          'cancel_interrupt')
+
+    # seconds between checks for an interrupt while no cell runs
+    poll_interval = 0.5
+
+    def __init__(self, addr, interpreter, namespace,
+                requestHandler=SimpleXMLRPCRequestHandler):
+        SimpleXMLRPCServer.__init__(self, addr, requestHandler=requestHandler)
         self.user_namespace = namespace
         self._interpreter = interpreter
         self.interpreter = self._interpreter(self.user_namespace)
+        self.jobs = Queue.Queue()
+        self.running = None
 
-    def _dispatch(self, method, params):
+    def _call(self, method, params, sink=None):
         try:
             func = getattr(self, 'xmlrpc_' + method)
         except AttributeError:
             raise Exception('method %s is not supported' % method)
         else:
+            if sink is not None and method in self.streaming_methods:
+                return func(*params, **{'sink':sink})
             return func(*params)
 
+    def submit(self, method, params, sink, callback):
+        """Start the method call, in a thread of its own or after the
+        calls queued for the main thread, and return right away. See _Job
+        for callback.
+        """
+        job = _Job(self._call, (method, params, sink), callback)
+        if method in self.concurrent_methods:
+            thread = threading.Thread(target=job.run)
+            thread.setDaemon(True)
+            thread.start()
+        else:
+            self.jobs.put(job)
+
+    def _dispatch(self, method, params, sink=None):
+        """Call method and wait for its result.
+        """
+        done = threading.Event()
+        outcome = []
+        def callback(result, error):
+            outcome.append((result, error))
+            done.set()
+        self.submit(method, params, sink, callback)
+        done.wait()
+        result, error = outcome[0]
+        if error is not None:
+            raise error[0], error[1], error[2]
+        return result
+
     def serve_forever(self):
         sys.stdout.flush()
+        accept = threading.Thread(target=self._accept_forever)
+        accept.setDaemon(True)
+        accept.start()
         while True:
+            job = None
             try:
-                self.handle_request()
+                # wakes up now and then so an interrupt gets through
+                job = self.jobs.get(True, self.poll_interval)
+                self.running = job
+                job.run()
+            except Queue.Empty:
+                pass
             except KeyboardInterrupt:
-                #sys.stderr.flush()
-                #sys.stdout.flush()
-                continue
+                # the interrupt came just around the job, not inside it
+                if job is not None:
+                    job.finish(None, sys.exc_info())
+            self.running = None
+
+    def _accept_forever(self):
+        while True:
+            self.handle_request()
 
     def xmlrpc_hello(self):
         return 'hi'
 
+    def xmlrpc_status(self):
+        """Whether a cell is running and how many calls wait behind it.
+        """
+        return {'busy':self.running is not None, 'queued':self.jobs.qsize(),
+                'input_count':self.interpreter.input_count}
+
     def xmlrpc_interpreter_go(self):
         self.interpreter = self._interpreter(self.user_namespace)
         return 'ON'
@@ -59,6 +226,28 @@ class EngineRPCServer(SimpleXMLRPCServer):
             result = 'Interpreter Error: Interpeter is probably starting up.'
         return result
 
+    def xmlrpc_evaluate_stream(self, to_evaluate, sink=None):
+        """Evaluate code, handing output to sink as it is produced.
+        XML-RPC can not stream, so there all output comes with the result
+        just like evaluate.
+        """
+        try:
+            result = self.interpreter.evaluate(to_evaluate, sink)
+        except AttributeError:
+            result = 'Interpreter Error: Interpeter is probably starting up.'
+        return result
+
+    def xmlrpc_evaluate_batch(self, cells, stop_on_error=False, sink=None):
+        """Evaluate a list of [cellid, code] in one call, see
+        Interpreter.evaluate_batch. Streamed, the result of each cell is
+        sent as a 'result' output as soon as it is done.
+        """
+        try:
+            result = self.interpreter.evaluate_batch(cells, stop_on_error, sink)
+        except AttributeError:
+            result = 'Interpreter Error: Interpeter is probably starting up.'
+        return result
+
     def xmlrpc_complete(self, to_complete):
         """Search for possible completion matches of source in the
         usernamespace.
@@ -109,4 +298,147 @@ class EngineRPCServer(SimpleXMLRPCServer):
 
 
 
+class FrameRequestHandler(SocketServer.BaseRequestHandler):
+    """
+    Serve one long lived connection from the backend.
 
+    Every message is a frame: a 4 byte big endian length followed by that
+    many bytes of JSON. A request looks like
+        {"id": 1, "method": "evaluate", "params": ["1+1"]}
+    and is answered with
+        {"id": 1, "result": ...} or {"id": 1, "error": "..."}
+    The id lets the backend keep several requests in flight on the same
+    connection; answers come in the order the requests finish, so a
+    completion asked for during an evaluate is answered first.
+
+    While a streaming method runs, its output is sent ahead of the result
+    as {"id": 1, "stream": "out", "data": "..."} frames. Once stream_window
+    bytes of them are out that the backend has not acknowledged with
+    {"id": 1, "drained": n}, the user code writing the output is held up
+    until it does; other requests on the connection carry on.
+
+    Frames are written by a thread of their own, from a queue: the main
+    thread, which runs the cells and gets the interrupts, only queues
+    whole frames, so an interrupt can not cut one off halfway.
+    """
+
+    stream_window = 1024 * 1024
+
+    def setup(self):
+        self.windows = {}
+        self.frames = Queue.Queue()
+        writer = threading.Thread(target=self._write_forever)
+        writer.setDaemon(True)
+        writer.start()
+
+    def handle(self):
+        while True:
+            frame = self.read_frame()
+            if frame is None:
+                return
+            self.handle_frame(frame)
+
+    def finish(self):
+        # nobody is left to drain the output
+        for window in self.windows.values():
+            window.close()
+        self.frames.put(None)
+
+    def handle_frame(self, frame):
+        """Start the request; its result is written when it is done,
+        meanwhile further frames are read.
+        """
+        request_id = None
+        try:
+            msg = json.loads(frame)
+            request_id = msg.get('id')
+            if 'drained' in msg:
+                window = self.windows.get(request_id)
+                if window is not None:
+                    window.drained(msg['drained'])
+                return
+            method = msg['method']
+            params = msg.get('params', [])
+        except Exception, e:
+            self.write_frame({'id':request_id, 'error':str(e)})
+            return
+        sink = None
+        if method in self.server.streaming_methods:
+            sink = self._sink(request_id)
+        def callback(result, error):
+            window = self.windows.pop(request_id, None)
+            if window is not None:
+                window.close()
+            self.reply(request_id, result, error)
+        self.server.submit(method, params, sink, callback)
+
+    def reply(self, request_id, result, error):
+        if error is None:
+            self.write_frame({'id':request_id, 'result':result})
+        elif issubclass(error[0], KeyboardInterrupt):
+            self.write_frame({'id':request_id, 'error':'Interrupted'})
+        else:
+            self.write_frame({'id':request_id, 'error':str(error[1])})
+
+    def _sink(self, request_id):
+        window = self.windows[request_id] = _Window(self.stream_window)
+        def sink(name, data):
+            data = _encode({'id':request_id, 'stream':name, 'data':data})
+            window.consume(len(data))
+            self.frames.put(data)
+        return sink
+
+    def read_frame(self):
+        """return the next frame, or None once the backend hung up.
+        """
+        header = self._recv(4)
+        if header is None:
+            return None
+        (length,) = struct.unpack('!I', header)
+        return self._recv(length)
+
+    def _recv(self, size):
+        chunks = []
+        while size:
+            data = self.request.recv(size)
+            if not data:
+                return None
+            chunks.append(data)
+            size -= len(data)
+        return ''.join(chunks)
+
+    def write_frame(self, msg):
+        """Queue msg to be sent, see _write_forever.
+        """
+        self.frames.put(_encode(msg))
+
+    def _write_forever(self):
+        while True:
+            data = self.frames.get()
+            if data is None:
+                return
+            try:
+                self.request.sendall(struct.pack('!I', len(data)) + data)
+            except socket.error:
+                # the backend hung up; handle sees that too
+                return
+
+
+def _encode(msg):
+    """Engine output is a byte string of unknown encoding; try utf-8 first.
+    """
+    try:
+        return json.dumps(msg)
+    except UnicodeDecodeError:
+        return json.dumps(msg, encoding='latin-1')
+
+
+class EngineFrameServer(EngineRPCServer):
+    """
+    Same engine methods as EngineRPCServer, served over one persistent
+    framed JSON connection instead of one HTTP request per call.
+    """
+
+    def __init__(self, addr, interpreter, namespace):
+        EngineRPCServer.__init__(self, addr, interpreter, namespace,
+                                requestHandler=FrameRequestHandler)
@@ -0,0 +1,60 @@
+import unittest
+
+from codenode.engine.completer import Completer
+
+
+class TestAttributeCompletion(unittest.TestCase):
+
+    def setUp(self):
+        self.namespace = {'calls':[]}
+        exec """
+class Old:
+    x = 1
+    def m(self): pass
+
+class OldLazy:
+    def __getattr__(self, name):
+        calls.append(name)
+        return 1
+
+class New(object):
+    x = 1
+    def m(self): pass
+    @property
+    def slow(self):
+        calls.append('slow')
+        return New()
+
+class Lazy(object):
+    def __getattr__(self, name):
+        calls.append(name)
+        return 1
+
+o = Old()
+o.inst = 3
+lazy_old = OldLazy()
+n = New()
+n.inst = Old()
+lazy = Lazy()
+""" in self.namespace
+        self.completer = Completer(self.namespace)
+
+    def test_classic_classes_and_instances(self):
+        c = self.completer
+        assert c.attr_matches('Old.') == ['Old.__doc__', 'Old.__module__', 'Old.m(', 'Old.x']
+        assert c.attr_matches('o.m') == ['o.m(']
+        assert c.attr_matches('o.') == ['o.__class__(', 'o.__doc__', 'o.__module__',
+                                        'o.inst', 'o.m(', 'o.x']
+        assert c.global_matches('o') == ['o', 'object(', 'oct(', 'open(', 'or', 'ord(']
+        assert c.attr_matches('n.inst.') == ['n.inst.__class__(', 'n.inst.__doc__',
+                                             'n.inst.__module__', 'n.inst.m(', 'n.inst.x']
+
+    def test_properties_and_getattr_are_not_run(self):
+        c = self.completer
+        assert 'n.slow' in c.attr_matches('n.s')
+        assert c.attr_matches('n.slow.') == []
+        assert c.attr_matches('lazy.anything.') == []
+        assert c.attr_matches('lazy_old.anything.') == []
+        assert 'lazy_old.__getattr__(' in c.attr_matches('lazy_old.')
+        assert c.global_matches('lazy_o') == ['lazy_old']
+        assert self.namespace['calls'] == []
@@ -1,24 +1,17 @@
-import os
-import sys
-import uuid
-import pickle
-from StringIO import StringIO
+
+from cStringIO import StringIO
 
 from pylab import show, savefig 
 
+from codenode.engine import display
+
 # cache pylab's original show function
 _original_show = show
 
 def show(fn=None, *args, **kwargs):
-    fn = str(uuid.uuid4()) + '.png'
-    realpath = os.path.join(os.path.abspath('.'), fn)
-    savefig(realpath, dpi=80, **kwargs)
-    f = open(realpath)
+    """Render the current figure and publish it as a png image.
+    """
     s = StringIO()
-    s.write(f.read())
-    p = pickle.dumps(s)
-    data = "__imagefile__" + p
-    f.close()
-    os.unlink(realpath)
-    sys.stdout.write(data)
+    savefig(s, format='png', dpi=80, **kwargs)
+    display.publish_image(s.getvalue(), 'image/png')
     
@@ -3,14 +3,15 @@
 # file.
 
 def setUpPackage(self):    
-    # create a search index
+    # create a search index, written to right away (the background writer
+    # would not see the test transactions)
     from codenode.frontend.search import search
     import tempfile
-    search.SEARCH_INDEX = tempfile.mktemp() # do not create the file, otherwise index is not created
-    search.create_index()
+    search.indexer.index = search.open_index(tempfile.mkdtemp())
+    search.indexer.synchronous = True
     
 def tearDownPackage():
     # delete search index
     from codenode.frontend.search import search
     import shutil
-    shutil.rmtree(search.SEARCH_INDEX)
\ No newline at end of file
+    shutil.rmtree(search.indexer.index.path)
\ No newline at end of file
@@ -80,6 +80,23 @@ AUTH_PROFILE_MODULE = "usersettings.UserSettings"
 #Search
 SEARCH_INDEX = PROJECT_PATH+'/../data/search_index'
 
+#'whoosh', 'simple' (built in, no dependencies) or None for whoosh when
+#it is installed
+SEARCH_BACKEND = None
+
+#Seconds notebook changes are collected before they are written to the
+#search index in one batch
+SEARCH_BATCH_DELAY = 1.0
+
+#Seconds between merges of all search index segments
+SEARCH_OPTIMIZE_INTERVAL = 60 * 60
+
+#Seconds a backend load report is used for placing new engines
+BACKEND_LOAD_TTL = 5
+
+#Engine access ids allocated per request to a backend
+ACCESS_ID_BATCH_SIZE = 8
+
 APP_HOST = 'localhost'
 APP_PORT = 9000
 
@@ -88,6 +105,16 @@ APP_PORT = 9000
 ENV_PATH = os.path.join(os.path.abspath('.'), 'data') #XXX
 PLOT_IMAGES = os.path.join(ENV_PATH, 'plot_images')
 
+#Plot images no cell references are removed after this many seconds
+PLOT_IMAGES_GRACE = 60 * 60
+
+#MB plot images may use; images only old revisions reference are evicted
+#beyond that. 0 for no limit.
+PLOT_IMAGES_MAX_SIZE = 0
+
+#Seconds between plot image garbage collections
+PLOT_IMAGES_GC_INTERVAL = 60 * 60
+
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 
 TEMPLATE_DIRS = (
@@ -106,6 +133,7 @@ INSTALLED_APPS = (
     'codenode.frontend.notebook',
     'codenode.frontend.backend',
     'codenode.frontend.usersettings',
+    'codenode.frontend.search',
 )
 
 #########################################################
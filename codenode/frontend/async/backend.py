@@ -6,18 +6,19 @@
 # of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
 #########################################################################
 import os
-import uuid
-import pickle
-#from StringIO import StringIO
+import re
+import base64
 
 from zope.interface import implements
 
 from twisted.internet import defer
+from twisted.internet import threads
 from twisted.web import xmlrpc
 from twisted.web import resource
 from twisted.web import server
 from twisted.web.client import getPage
 from twisted.python import log
+from twisted.python import failure
 
 
 from django.utils import simplejson as json
@@ -25,14 +26,42 @@ from django.utils import simplejson as json
 from django.conf import settings
 
 from codenode.frontend.notebook import models as notebook_models
+from codenode.frontend.notebook.images import image_store
+from codenode.frontend.backend.models import NotebookBackendRecord
+from codenode.frontend.backend.scheduler import scheduler
 
 def write_image(image):
-    fn = str(uuid.uuid4()) + '.png'
-    fullpath = os.path.join(settings.PLOT_IMAGES, fn)
-    f = open(fullpath, 'w')
-    f.write(image)
-    f.close()
-    return fn
+    return image_store.put(image)
+
+
+_re_image_ref = re.compile(r"^[0-9a-f]{40}\.png$")
+
+def format_result(data):
+    """Set the cellstyle of an evaluation result, storing images it
+    contains.
+
+    Images come in the 'display' list of the result (see
+    codenode.engine.display), either as the name of a file the engine
+    already wrote to PLOT_IMAGES or as base64 encoded data. The names of
+    the images, one per line, become the output of the cell (so the image
+    store sees them all referenced); the text output is kept under 'text'.
+    """
+    images = []
+    for item in data.pop('display', None) or []:
+        if item.get('ref'):
+            if _re_image_ref.match(item['ref']):
+                images.append(item['ref'])
+            else:
+                log.msg('Ignoring invalid image reference %r' % item['ref'])
+        elif item.get('data'):
+            images.append(write_image(base64.b64decode(item['data'])))
+    if images:
+        data['text'] = data['out']
+        data['out'] = '\n'.join(images)
+        data['images'] = images
+        data['cellstyle'] = 'outputimage'
+    else:
+        data['cellstyle'] = 'outputtext'
 
 
 class BackendAdmin:
@@ -117,6 +146,8 @@ class BackendBus(object):
 
     backends dict of backend_name to backend_client instance
     notebook_map dict of notebook_id to (backend, access_id,)
+    placing dict of notebook_id to list of Deferreds waiting for the
+    notebook to be added (see getNotebook)
     """
 
     backendFactory = BackendClient
@@ -126,6 +157,7 @@ class BackendBus(object):
         """
         self.backends = {}
         self.notebook_map = {}
+        self.placing = {}
 
     def addBackend(self, backend_name, backend_address):
         """
@@ -134,8 +166,46 @@ class BackendBus(object):
         self.backends[backend_name] = backend
         return backend
 
-    def addNotebook(self, notebook_id):
+    def getBackend(self, backend_server):
+        try:
+            return self.backends[backend_server.name]
+        except KeyError:
+            return self.addBackend(backend_server.name, backend_server.address)
+
+    def getNotebook(self, notebook_id, stale_access_id=None):
+        """
+        Deferred (backend, access_id,) of the notebook, or None if it has
+        no backend record. The first request of a notebook adds it; any
+        request coming in meanwhile waits for that instead of placing the
+        notebook a second time.
+        """
+        result = self.notebook_map.get(notebook_id)
+        if result is not None and result[1] != stale_access_id:
+            return defer.succeed(result)
+        d = defer.Deferred()
+        if notebook_id in self.placing:
+            self.placing[notebook_id].append(d)
+            return d
+        self.placing[notebook_id] = [d]
+        self.notebook_map.pop(notebook_id, None)
+        added = self.addNotebook(notebook_id, stale_access_id)
+        added.addBoth(self._notebookAdded, notebook_id)
+        return d
+
+    def _notebookAdded(self, result, notebook_id):
+        waiting = self.placing.pop(notebook_id)
+        for d in waiting:
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    @defer.inlineCallbacks
+    def addNotebook(self, notebook_id, stale_access_id=None):
         """
+        Notebooks without an engine access id yet (or with the one the
+        backend no longer knows, stale_access_id) get one from the backend
+        the scheduler places them on.
         """
         nb = notebook_models.Notebook.objects.get(guid=notebook_id)
 
@@ -146,28 +216,47 @@ class BackendBus(object):
         else:
             return
 
-        access_id = record.access_id
-        backend_name = record.engine_type.backend.name
-        try:
-            backend = self.backends[backend_name]
-        except KeyError:
-            backend_address = record.engine_type.backend.address
-            backend = self.addBackend(backend_name, backend_address)
-        # check key d n e
-        self.notebook_map[notebook_id] = (backend, access_id,)
-        return (backend, access_id,)
+        if stale_access_id and record.access_id == stale_access_id:
+            # the backend forgot the access id (e.g. it restarted)
+            scheduler.forget(record.engine_type.backend.address)
+            yield self.placeNotebook(record)
+        elif not record.access_id:
+            yield self.placeNotebook(record)
+        backend = self.getBackend(record.engine_type.backend)
+        self.notebook_map[notebook_id] = (backend, record.access_id,)
+        defer.returnValue((backend, record.access_id,))
+
+    @defer.inlineCallbacks
+    def placeNotebook(self, record):
+        """Allocate an engine for a notebook on the least loaded backend
+        that has its engine type. The scheduler makes blocking calls, so
+        it runs in a thread.
+
+        The record only takes the new access id if it still has the one
+        it was placed for; if another frontend process placed the notebook
+        meanwhile, record gets that placement instead.
+        """
+        previous = record.access_id
+        engine_type, access_id = yield threads.deferToThread(scheduler.place,
+                                                    record.engine_type)
+        records = NotebookBackendRecord.objects.filter(pk=record.pk, access_id=previous)
+        if records.update(engine_type=engine_type, access_id=access_id):
+            record.engine_type = engine_type
+            record.access_id = access_id
+            log.msg('Placed notebook %s on %s' % (record.notebook_id, engine_type.backend))
+        else:
+            placed = NotebookBackendRecord.objects.get(pk=record.pk)
+            record.engine_type = placed.engine_type
+            record.access_id = placed.access_id
+            log.msg('Notebook %s was placed meanwhile, dropping access id %s' % (record.notebook_id, access_id))
 
     @defer.inlineCallbacks
     def handleRequest(self, notebook_id, msg):
         """
         """
-        try:
-            result = self.notebook_map[notebook_id]
-        except KeyError:
-            result = self.addNotebook(notebook_id)
-
-            if result is None:
-                return
+        result = yield self.getNotebook(notebook_id)
+        if result is None:
+            return
 
         backend, access_id = result
 
@@ -181,13 +270,9 @@ class BackendBus(object):
             log.err('Backend error %s' % str(result['response']))
             err = result['response']
             if err == 'InvalidAccessId':
-                #self.reset_access_id(self, notebook_id)
-                nb = notebook_models.Notebook.objects.get(guid=notebook_id)
-                engine_type = str(nb.backend.all()[0].engine_type.name)
-                new_access_id = yield backend.newAccessId(engine_type)
-                nb.backend.all()[0].access_id = new_access_id
-                nb.save()
-                self.notebook_map[notebook_id] = (backend, new_access_id,)
+                # place the notebook again (once, however many requests
+                # found out at the same time)
+                backend, new_access_id = yield self.getNotebook(notebook_id, access_id)
                 result_retry = yield backend.send(new_access_id, msg)
                 status = result_retry['status']
                 # TODO: Better handling. return no matter what for now
@@ -228,18 +313,21 @@ class EngineSessionAdapter(resource.Resource):
     def _success(self, data, request, cellid):
         """
         horrible. not always eval...
+
+        Polls for streamed output carry the evaluation result once it is
+        done, and for a batch evaluation the results of the cells done so
+        far.
         """
-        out = data['out']
-        if type(out) is str:
-            if out.startswith("__imagefile__"):
-                image_pick = out[13:]
-                image_io = pickle.loads(image_pick)
-                image = image_io.getvalue()
-                image_file_name = write_image(image)
-                data['out'] = image_file_name
-                data['cellstyle'] = 'outputimage'
-            else:
-                data['cellstyle'] = 'outputtext'
+        for name, chunk in data.get('chunks', []):
+            if name == 'result':
+                format_result(chunk['result'])
+        if isinstance(data.get('result'), dict):
+            for item in data['result'].get('results', []):
+                format_result(item['result'])
+            if 'out' in data['result']:
+                format_result(data['result'])
+        if 'out' in data:
+            format_result(data)
         data['cellid'] = cellid
         jsobj = json.dumps(data)
         request.write(jsobj)
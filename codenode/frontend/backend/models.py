@@ -32,10 +32,13 @@ class NotebookBackendRecord(models.Model):
     Each notebook gets an engine access id from the backend server.
     The access id is a token for making computation requests to the
     backend. The backend associates the access id with an engine type.
+
+    A new notebook has no access id yet; it is allocated the first time
+    the notebook sends a request to an engine.
     """
     notebook = models.ForeignKey(Notebook, unique=True, related_name='backend')
     engine_type = models.ForeignKey(EngineType)
-    access_id = models.CharField(max_length=32)
+    access_id = models.CharField(max_length=32, blank=True)
 
     def __unicode__(self):
         return u"Notebook Engine Type: %s" % (self.engine_type,)
@@ -1,17 +1,45 @@
 
+import threading
 import xmlrpclib
 
+_clients = threading.local()
+
+def _client(address):
+    """One ServerProxy per backend and thread, so the http connection to
+    the backend is kept open and reused.
+    """
+    address = str(address)
+    try:
+        clients = _clients.proxies
+    except AttributeError:
+        clients = _clients.proxies = {}
+    try:
+        return clients[address]
+    except KeyError:
+        client = clients[address] = xmlrpclib.ServerProxy(address + '/admin/')
+        return client
+
 def listEngineTypes(address):
-    client = xmlrpclib.ServerProxy(address + '/admin/')
+    client = _client(address)
     engine_types = client.listEngineTypes()
     return engine_types
 
 def allocateEngine(address, engine_type):
-    client = xmlrpclib.ServerProxy(str(address) + '/admin/')
+    client = _client(address)
     access_id = client.allocateEngine(str(engine_type))
     return access_id
 
+def allocateEngines(address, engine_type, count):
+    client = _client(address)
+    access_ids = client.allocateEngines(str(engine_type), count)
+    return access_ids
+
+def getLoad(address):
+    client = _client(address)
+    load = client.getLoad()
+    return load
+
 def interruptInstance(address, instance_id):
-    client = xmlrpclib.ServerProxy(address + '/admin/')
+    client = _client(address)
     client.interruptInstance(instance_id)
 
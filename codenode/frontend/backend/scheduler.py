@@ -0,0 +1,149 @@
+#########################################################################
+# Copyright (C) 2007, 2008, 2009
+# Alex Clemesha <alex@clemesha.org> & Dorian Raymer <deldotdr@gmail.com>
+#
+# This module is part of codenode, and is distributed under the terms
+# of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
+#########################################################################
+
+"""
+Placement of notebook engines across backend servers.
+
+Every backend server registers its own EngineType rows. Engine types with
+the same name on different backends are interchangeable, so a notebook
+asking for e.g. 'Python' can have its engine run on whichever of those
+backends is least loaded.
+"""
+
+import time
+import socket
+import xmlrpclib
+
+from django.conf import settings
+
+from codenode.frontend.backend import models
+from codenode.frontend.backend import rpc
+
+
+class BackendScheduler(object):
+    """
+    Picks the backend for new engines using the load reports backends
+    give through their admin interface (getLoad).
+
+    Load reports are cached for load_ttl seconds. Backends that can not be
+    reached are left out; if none can be reached, the requested engine
+    type is used as is.
+
+    Access ids are allocated batch_size at a time and handed out from
+    access_ids, so placing a notebook usually costs no backend round trip.
+
+    loads dict backend address: (time fetched, load dict or None)
+    access_ids dict (backend address, engine type name): list of access_id
+    """
+
+    # score = cpu load per cpu + engine_weight * engines
+    #         - memory_weight * GB of free memory
+    engine_weight = 0.05
+    memory_weight = 0.1
+
+    def __init__(self, load_ttl=None, batch_size=None):
+        if load_ttl is None:
+            load_ttl = getattr(settings, 'BACKEND_LOAD_TTL', 5)
+        if batch_size is None:
+            batch_size = getattr(settings, 'ACCESS_ID_BATCH_SIZE', 8)
+        self.load_ttl = load_ttl
+        self.batch_size = batch_size
+        self.loads = {}
+        self.access_ids = {}
+
+    def candidates(self, engine_type):
+        """All engine types with the same name as engine_type.
+        """
+        return models.EngineType.objects.filter(name=engine_type.name).select_related('backend')
+
+    def fetchLoad(self, address):
+        return rpc.getLoad(address)
+
+    def load(self, backend):
+        """Load report of backend, None if it can not be reached.
+        Backends without getLoad report an empty load.
+        """
+        now = time.time()
+        cached = self.loads.get(backend.address)
+        if cached is not None and now - cached[0] < self.load_ttl:
+            return cached[1]
+        try:
+            load = self.fetchLoad(backend.address)
+        except xmlrpclib.Fault:
+            load = {}
+        except (socket.error, xmlrpclib.ProtocolError):
+            load = None
+        self.loads[backend.address] = (now, load)
+        return load
+
+    def score(self, load):
+        """Lower is better.
+        """
+        score = load.get('cpu', 1.0) + self.engine_weight * load.get('engines', 0)
+        if 'free_memory' in load:
+            score -= self.memory_weight * load['free_memory'] / 1024.0
+        return score
+
+    def choose(self, engine_type):
+        """return the EngineType (and with it the backend) a new engine of
+        engine_type should run on.
+        """
+        best, best_score = None, None
+        for candidate in self.candidates(engine_type):
+            load = self.load(candidate.backend)
+            if load is None:
+                continue
+            score = self.score(load)
+            if best is None or score < best_score:
+                best, best_score = candidate, score
+        if best is None:
+            return engine_type
+        return best
+
+    def allocate(self, engine_type):
+        """An access id for engine_type on its backend, from the batch
+        allocated earlier if there is one left.
+        """
+        address = engine_type.backend.address
+        key = (address, engine_type.name)
+        try:
+            return self.access_ids[key].pop()
+        except (KeyError, IndexError):
+            pass
+        try:
+            access_ids = rpc.allocateEngines(address, engine_type.name, self.batch_size)
+        except xmlrpclib.Fault:
+            # backend without batch allocation
+            return rpc.allocateEngine(address, engine_type.name)
+        access_id = access_ids.pop()
+        self.access_ids[key] = access_ids
+        return access_id
+
+    def forget(self, address):
+        """Drop the cached load report and access ids of a backend, e.g.
+        after it restarted and lost its allocations.
+        """
+        self.loads.pop(address, None)
+        for key in self.access_ids.keys():
+            if key[0] == address:
+                self.access_ids.pop(key, None)
+
+    def place(self, engine_type):
+        """Choose a backend and allocate an engine access id on it.
+        return (engine_type, access_id,)
+        """
+        chosen = self.choose(engine_type)
+        access_id = self.allocate(chosen)
+        load = self.loads.get(chosen.backend.address)
+        if load is not None and load[1] is not None:
+            # count the new engine until the next report comes in
+            load[1]['engines'] = load[1].get('engines', 0) + 1
+        return (chosen, access_id,)
+
+
+scheduler = BackendScheduler()
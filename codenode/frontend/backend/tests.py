@@ -0,0 +1,63 @@
+import socket
+
+from django.test import TestCase
+
+from codenode.frontend.backend import models
+from codenode.frontend.backend.scheduler import BackendScheduler
+
+
+class StubScheduler(BackendScheduler):
+    """Scheduler with canned load reports instead of rpc calls."""
+
+    def __init__(self, reports):
+        BackendScheduler.__init__(self, load_ttl=60)
+        self.reports = reports
+        self.fetched = []
+
+    def fetchLoad(self, address):
+        self.fetched.append(address)
+        report = self.reports[address]
+        if report is None:
+            raise socket.error("connection refused")
+        return dict(report)
+
+
+class TestBackendScheduler(TestCase):
+
+    def setUp(self):
+        self.engine_types = []
+        for name in ['busy', 'idle', 'down']:
+            server = models.BackendServer(name=name, address="http://%s.example.com" % name)
+            server.save()
+            engine_type = models.EngineType(name="Python", backend=server)
+            engine_type.save()
+            self.engine_types.append(engine_type)
+        self.busy, self.idle, self.down = self.engine_types
+
+    def test_choose_least_loaded_backend(self):
+        scheduler = StubScheduler({
+            "http://busy.example.com":{'engines':40, 'cpu':1.5, 'free_memory':512},
+            "http://idle.example.com":{'engines':2, 'cpu':0.1, 'free_memory':4096},
+            "http://down.example.com":None,
+            })
+        chosen = scheduler.choose(self.busy)
+        assert chosen.id == self.idle.id
+
+    def test_unreachable_backends_fall_back_to_requested_type(self):
+        scheduler = StubScheduler({
+            "http://busy.example.com":None,
+            "http://idle.example.com":None,
+            "http://down.example.com":None,
+            })
+        chosen = scheduler.choose(self.down)
+        assert chosen.id == self.down.id
+
+    def test_load_reports_are_cached(self):
+        scheduler = StubScheduler({
+            "http://busy.example.com":{'engines':1},
+            "http://idle.example.com":{'engines':0},
+            "http://down.example.com":{'engines':3},
+            })
+        scheduler.choose(self.busy)
+        scheduler.choose(self.busy)
+        assert len(scheduler.fetched) == 3
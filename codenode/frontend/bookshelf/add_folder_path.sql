@@ -0,0 +1,13 @@
+ALTER TABLE bookshelf_folder ADD COLUMN path varchar(255) DEFAULT '' NOT NULL;
+CREATE INDEX bookshelf_folder_path ON bookshelf_folder (path);
+CREATE TEMPORARY TABLE bookshelf_folder_paths AS
+    WITH RECURSIVE paths (id, path) AS (
+        SELECT id, id || '/' FROM bookshelf_folder
+            WHERE parent_id IS NULL OR parent_id NOT IN (SELECT id FROM bookshelf_folder)
+        UNION ALL
+        SELECT f.id, p.path || f.id || '/' FROM bookshelf_folder f JOIN paths p ON f.parent_id = p.id
+    )
+    SELECT id, path FROM paths;
+UPDATE bookshelf_folder SET
+    path = COALESCE((SELECT p.path FROM bookshelf_folder_paths p WHERE p.id = bookshelf_folder.id), '');
+DROP TABLE bookshelf_folder_paths;
@@ -0,0 +1,119 @@
+#########################################################################
+# Copyright (C) 2007, 2008, 2009
+# Alex Clemesha <alex@clemesha.org> & Dorian Raymer <deldotdr@gmail.com>
+#
+# This module is part of codenode, and is distributed under the terms
+# of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
+#########################################################################
+
+"""
+Notebook listings (bookshelf, femhub, search) in a fixed number of
+queries: the notebooks themselves, which carry their last modification
+(see Notebook.last_modified), and the engine names of all of them at once.
+
+Long listings are read a page at a time. Pages are addressed by a cursor,
+the sort key value and id of the last notebook of the previous page,
+instead of an offset, so each page is an index range scan (see
+notebook/add_listing_indexes.sql) however deep into the listing it is, and
+notebooks added meanwhile do not shift the pages.
+"""
+
+import base64
+
+from django.db.models import Q
+from django.utils import simplejson as json
+
+from codenode.frontend.backend.models import NotebookBackendRecord
+
+UNDEFINED_ENGINE = u'(undefined)'
+
+# sort names clients use: Notebook field
+SORT_KEYS = {
+    'title':'title',
+    'created':'created_time',
+    'lastmodified':'last_modified',
+}
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    """The cursor is malformed or belongs to another sort order.
+    """
+
+def engine_names(notebook_ids):
+    """dict notebook id: engine type name, for the notebooks that have a
+    backend record.
+    """
+    engines = {}
+    records = NotebookBackendRecord.objects.filter(notebook__in=list(notebook_ids)).select_related('engine_type')
+    for record in records:
+        engines.setdefault(record.notebook_id, record.engine_type.name)
+    return engines
+
+def notebook_listing(notebooks):
+    """List of dicts with guid, title, engine, modified (formatted) and
+    location of notebooks (an iterable of Notebooks, e.g. a QuerySet, the
+    order is kept).
+    """
+    notebooks = list(notebooks)
+    engines = engine_names([nb.id for nb in notebooks])
+    listing = []
+    for nb in notebooks:
+        listing.append({
+            'guid':nb.guid,
+            'title':nb.title,
+            'engine':engines.get(nb.id, UNDEFINED_ENGINE),
+            'modified':nb.last_modified_time().strftime("%Y-%m-%d %H:%M:%S"),
+            'location':nb.location,
+            })
+    return listing
+
+def order_fields(sort, descending=False):
+    """The order_by() arguments for sort, ties broken by id.
+    """
+    fields = [SORT_KEYS[sort], 'id']
+    if descending:
+        fields = ['-' + field for field in fields]
+    return fields
+
+def encode_cursor(notebook, sort, descending):
+    value = getattr(notebook, SORT_KEYS[sort])
+    if value is not None and not isinstance(value, basestring):
+        value = str(value)
+    return base64.urlsafe_b64encode(json.dumps([sort, descending, value, notebook.id]))
+
+def decode_cursor(cursor, sort, descending):
+    """return (sort key value, id,) of the cursor.
+    """
+    try:
+        cursor_sort, cursor_descending, value, id = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        id = int(id)
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+    if (cursor_sort, cursor_descending) != (sort, descending):
+        raise InvalidCursor(cursor)
+    return value, id
+
+def page(notebooks, sort='lastmodified', descending=False, cursor=None, limit=PAGE_SIZE):
+    """One page of the QuerySet notebooks sorted by sort (a key of
+    SORT_KEYS): the limit notebooks after cursor (None for the first page).
+    return (list of Notebooks, cursor of the next page or None,)
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError("Unknown sort key %r" % sort)
+    descending = bool(descending)
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    if cursor:
+        value, id = decode_cursor(cursor, sort, descending)
+        field = SORT_KEYS[sort]
+        op = descending and 'lt' or 'gt'
+        after = Q(**{field + '__' + op:value}) | Q(**{field:value, 'id__' + op:id})
+        notebooks = notebooks.filter(after)
+    rows = list(notebooks.order_by(*order_fields(sort, descending))[:limit + 1])
+    next = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next = encode_cursor(rows[-1], sort, descending)
+    return rows, next
@@ -7,23 +7,85 @@
 #########################################################################
 
 import uuid
-from django.db import models
+from django.conf import settings
+from django.db import connection, models, transaction
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext_lazy as _
 
 from codenode.frontend.notebook.models import Notebook
 
+# the longest path segment: a 32 bit id and its slash
+_MAX_SEGMENT_LENGTH = 11
+
+class FolderTooDeep(ValueError):
+    """The folder would be nested deeper than Folder.path can record.
+    """
+
 class Folder(models.Model):
     guid = models.CharField(max_length=32, unique=True, editable=False) #needs to be globally unique
     owner = models.ForeignKey(User)
     parent = models.ForeignKey('Folder', null=True)
     title = models.CharField(max_length=100)
     notebooks = models.ManyToManyField(Notebook, blank=True, related_name='folder_notebooks')
+    # ids of the root folder down to this one, e.g. '1/5/12/', so a whole
+    # subtree is selected by prefix (see subtree); maintained by save.
+    # Empty means not computed yet (see full_path), never a prefix.
+    path = models.CharField(max_length=255, editable=False, db_index=True, default='')
 
     def save(self):
         if not self.guid:
             self.guid = unicode(uuid.uuid4()).replace("-", "")
+        new = self.id is None
+        if not new and not self.path:
+            # nor do the folders below it; compute them so they move along
+            self.full_path()
+        self._check_depth()
         super(Folder, self).save()
+        path = '%s%d/' % (self._parent_path(), self.id)
+        if path != self.path:
+            old_path, self.path = self.path, path
+            if old_path:
+                # moved: so did the subtree, this folder included
+                _replace_path_prefix(old_path, path)
+            else:
+                Folder.objects.filter(pk=self.pk).update(path=path)
+
+    def _parent_path(self):
+        if self.parent_id is None:
+            return ''
+        return self.parent.full_path()
+
+    def _check_depth(self):
+        """Raise FolderTooDeep if the path of this folder, or of one below
+        it, would not fit into the path column.
+        """
+        max_length = self._meta.get_field('path').max_length
+        if self.id is None:
+            length = len(self._parent_path()) + _MAX_SEGMENT_LENGTH
+        else:
+            path = '%s%d/' % (self._parent_path(), self.id)
+            if path == self.path:
+                return
+            length = len(path) + _longest_path(self.path) - len(self.path)
+        if length > max_length:
+            raise FolderTooDeep(self.title)
+
+    def subtree(self):
+        """This folder and all below it, parents before their children.
+        """
+        return Folder.objects.filter(path__startswith=self.full_path()).order_by('path')
+
+    def is_ancestor_of(self, folder):
+        return folder.full_path().startswith(self.full_path())
+
+    def full_path(self):
+        """path, computing the paths of all folders first if this one has
+        none yet (folders from before the column was added).
+        """
+        if not self.path:
+            rebuild_paths()
+            self.path = Folder.objects.filter(pk=self.pk).values_list('path', flat=True)[0]
+        return self.path
 
     class Meta:
         verbose_name = _('Bookshelf Folder')
@@ -36,3 +98,45 @@ class Folder(models.Model):
             return u"Folder '%s' (parent: '%s', owner: '%s')" % (self.title, self.parent.title, self.owner)
 
 
+
+
+def rebuild_paths():
+    """Compute Folder.path of all folders from their parents, e.g. after
+    adding the column (see add_folder_path.sql).
+    """
+    folders = list(Folder.objects.all())
+    ids = set([folder.id for folder in folders])
+    children = {}
+    for folder in folders:
+        children.setdefault(folder.parent_id, []).append(folder)
+    # a folder whose parent is gone counts as a root, so every folder gets
+    # a path (an empty one would be a prefix of all)
+    pending = [(folder, '') for folder in folders
+                if folder.parent_id is None or folder.parent_id not in ids]
+    while pending:
+        folder, parent_path = pending.pop()
+        path = '%s%d/' % (parent_path, folder.id)
+        if path != folder.path:
+            Folder.objects.filter(pk=folder.pk).update(path=path)
+        pending.extend([(child, path) for child in children.get(folder.id, [])])
+
+def _longest_path(prefix):
+    """Length of the longest path starting with prefix.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT MAX(LENGTH(path)) FROM %s WHERE path LIKE %%s"
+            % connection.ops.quote_name(Folder._meta.db_table), [prefix + '%'])
+    return cursor.fetchone()[0] or len(prefix)
+
+def _replace_path_prefix(old, new):
+    """Replace the prefix old of paths by new with one query.
+    """
+    if settings.DATABASE_ENGINE == 'mysql':
+        concat = "CONCAT(%s, SUBSTRING(path, %s))"
+    else:
+        concat = "%s || SUBSTR(path, %s)"
+    cursor = connection.cursor()
+    cursor.execute("UPDATE %s SET path = %s WHERE path LIKE %%s"
+            % (connection.ops.quote_name(Folder._meta.db_table), concat),
+            [new, len(old) + 1, old + '%'])
+    transaction.commit_unless_managed()
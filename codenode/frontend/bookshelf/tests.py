@@ -4,7 +4,8 @@ from django.test import TestCase
 from django.utils import simplejson as json
 
 from codenode.frontend.bookshelf import views
-from codenode.frontend.bookshelf.models import Folder
+from codenode.frontend.bookshelf.models import Folder, FolderTooDeep
+from codenode.frontend.notebook.models import Notebook
 
 
 class TestBookshelf(TestCase):
@@ -38,3 +39,94 @@ class TestBookshelf(TestCase):
         assert resp[0][1] == "test_folder1"
         folder.delete() #clean up
 
+
+    def test_load_notebooks_in_pages(self):
+        for title in ['e', 'b', 'd', 'a', 'c']:
+            Notebook(owner=self.user1, title=title, location='root').save()
+        self.client.login(username='test', password='password')
+
+        titles, cursor = [], None
+        while True:
+            params = {'location':'root', 'order':'title', 'sort':'asc', 'limit':2}
+            if cursor:
+                params['cursor'] = cursor
+            resp = json.loads(self.client.get('/bookshelf/load', params).content)
+            assert len(resp['notebooks']) <= 2
+            titles.extend([row[1] for row in resp['notebooks']])
+            cursor = resp['next']
+            if cursor is None:
+                break
+        assert titles == ['a', 'b', 'c', 'd', 'e']
+
+        response = self.client.get('/bookshelf/count', {'location':'root'})
+        assert json.loads(response.content)['count'] == 5
+        # a cursor is only valid for the order it was made for
+        params = {'location':'root', 'order':'title', 'limit':2}
+        params['cursor'] = json.loads(self.client.get('/bookshelf/load', params).content)['next']
+        params['order'] = 'created'
+        assert self.client.get('/bookshelf/load', params).status_code == 400
+
+    def test_folder_paths_follow_moves(self):
+        root = Folder(owner=self.user1, title="root")
+        root.save()
+        a = Folder(owner=self.user1, parent=root, title="a")
+        a.save()
+        b = Folder(owner=self.user1, parent=a, title="b")
+        b.save()
+        c = Folder(owner=self.user1, parent=root, title="c")
+        c.save()
+        titles = [f.title for f in root.subtree()]
+        assert titles[0] == "root" and sorted(titles) == ["a", "b", "c", "root"]
+        assert titles.index("a") < titles.index("b")
+
+        a.parent = c
+        a.save()
+        b = Folder.objects.get(pk=b.pk)
+        assert b.path == "%d/%d/%d/%d/" % (root.id, c.id, a.id, b.id)
+        assert [f.title for f in c.subtree()] == ["c", "a", "b"]
+        assert a.is_ancestor_of(b) and not b.is_ancestor_of(a)
+
+    def test_folders_without_paths_get_them_when_needed(self):
+        root = Folder(owner=self.user1, title="root")
+        root.save()
+        a = Folder(owner=self.user1, parent=root, title="a")
+        a.save()
+        b = Folder(owner=self.user1, parent=a, title="b")
+        b.save()
+        other = Folder(owner=self.user1, title="other")
+        other.save()
+        # as left by adding the column to existing folders
+        Folder.objects.all().update(path='')
+        root, a, b, other = [Folder.objects.get(pk=f.pk) for f in (root, a, b, other)]
+        assert not other.is_ancestor_of(a) and root.is_ancestor_of(b)
+        assert [f.title for f in a.subtree()] == ["a", "b"]
+        c = Folder(owner=self.user1, parent=b, title="c")
+        c.save()
+        assert c.path == "%d/%d/%d/%d/" % (root.id, a.id, b.id, c.id)
+
+    def test_nesting_is_limited_by_the_path_column(self):
+        deepest = Folder(owner=self.user1, title="top")
+        deepest.save()
+        try:
+            while True:
+                folder = Folder(owner=self.user1, parent=deepest, title="sub")
+                folder.save()
+                deepest = folder
+        except FolderTooDeep:
+            pass
+        assert 255 - 11 < len(deepest.path) <= 255
+        # a subtree six levels deep does not fit below the deepest folder
+        other = Folder(owner=self.user1, title="other")
+        other.save()
+        folder = other
+        for i in range(5):
+            folder = Folder(owner=self.user1, parent=folder, title="sub")
+            folder.save()
+        other.parent = deepest
+        try:
+            other.save()
+        except FolderTooDeep:
+            pass
+        else:
+            assert False, 'moved too deep'
+        assert Folder.objects.get(pk=other.pk).path == "%d/" % other.id
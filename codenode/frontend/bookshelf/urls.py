@@ -9,12 +9,13 @@
 from django.conf.urls.defaults import *
 
 from codenode.frontend.bookshelf.views import bookshelf, folders
-from codenode.frontend.bookshelf.views import load_bookshelf_data, change_notebook_location
+from codenode.frontend.bookshelf.views import load_bookshelf_data, count_notebooks, change_notebook_location
 from codenode.frontend.bookshelf.views import empty_trash, new_notebook
 
 urlpatterns = patterns('',
     url(r'^$', bookshelf, name='bookshelf'),
     url(r'^load$', load_bookshelf_data, name='load_bookshelf_data'),
+    url(r'^count$', count_notebooks, name='count_notebooks'),
     url(r'^folders$', folders, name='folders'),
     url(r'^move$', change_notebook_location, name='change_notebook_location'),
     url(r'^new$', new_notebook, name='new_notebook'),
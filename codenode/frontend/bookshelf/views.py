@@ -7,7 +7,7 @@
 #########################################################################
 from django.conf import settings
 from django.shortcuts import render_to_response
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseBadRequest
 from django.template import RequestContext
 from django.utils import simplejson as json
 from django.contrib.auth.decorators import login_required
@@ -15,7 +15,7 @@ from django.contrib.auth.decorators import login_required
 from codenode.frontend.bookshelf import models as bookshelf_models
 from codenode.frontend.notebook import models as notebook_models
 from codenode.frontend.backend import models as backend_models
-from codenode.frontend.backend import rpc
+from codenode.frontend.bookshelf import listing
 
 @login_required
 def bookshelf(request, template_name='bookshelf/bookshelf.html'):
@@ -26,39 +26,50 @@ def bookshelf(request, template_name='bookshelf/bookshelf.html'):
     return render_to_response(template_name,
         {'engine_types':engine_types, 'path':request.path}, context_instance=RequestContext(request))
 
+def _listing_row(item):
+    return [item['guid'], item['title'], item['engine'], item['modified'], item['location']]
+
 @login_required
 def load_bookshelf_data(request):
     """Retrieve a user's Notebooks for the Bookshelf.
 
     Handles the current location (all, trash, archive, folder id) as well
     and the order (asc or desc) and field that it is to be sorted on.
+
+    Given a limit (and, after the first page, the cursor the previous
+    page returned) only one page is returned, as {'notebooks':[...],
+    'next':cursor or null}; order is then one of listing.SORT_KEYS.
     """
     location, order, sort = [request.GET.get(v, '') for v in ['location', 'order', 'sort']]
-    if order == "lastmodified":
-        order = "created_time" #XXX
-    if sort == "desc":
-        order = "-"+order
-    q = notebook_models.Notebook.objects.filter(owner=request.user, location=location).order_by(order)
-    #print "XXX: " + len(q)
-    data = []
-
-    for e in q:
-        #import pdb
-        #pdb.set_trace()
+    q = notebook_models.Notebook.objects.filter(owner=request.user, location=location)
+    if 'limit' in request.GET or 'cursor' in request.GET:
         try:
-            item = [e.guid,
-                    e.title,
-                    e.backend.all()[0].engine_type.name,
-                    e.last_modified_time().strftime("%Y-%m-%d %H:%M:%S"),
-                    e.location]
-            data.append(item)
-        except:
-            #print "XXX: Invalid notebook (removing)"
-            e.delete()
+            notebooks, next = listing.page(q, order or 'lastmodified', sort == "desc",
+                    request.GET.get('cursor'), request.GET.get('limit', listing.PAGE_SIZE))
+        except ValueError:
+            return HttpResponseBadRequest()
+        data = {'notebooks':[_listing_row(item) for item in listing.notebook_listing(notebooks)],
+                'next':next}
+    else:
+        if order in listing.SORT_KEYS:
+            order = listing.order_fields(order, sort == "desc")
+        else:
+            if sort == "desc":
+                order = "-"+order
+            order = [order]
+        data = [_listing_row(item) for item in listing.notebook_listing(q.order_by(*order))]
 
     jsobj = json.dumps(data)
     return HttpResponse(jsobj, mimetype='application/json')
 
+@login_required
+def count_notebooks(request):
+    """Number of the user's Notebooks in a location, for paging.
+    """
+    location = request.GET.get('location', '')
+    count = notebook_models.Notebook.objects.filter(owner=request.user, location=location).count()
+    return HttpResponse(json.dumps({'count':count}), mimetype='application/json')
+
 
 @login_required
 def folders(request):
@@ -114,10 +125,9 @@ def new_notebook(request):
     nb = notebook_models.Notebook(owner=request.user)
     nb.save()
     engine_type = backend_models.EngineType.objects.get(id=engine_type_id)
-    access_id = rpc.allocateEngine(engine_type.backend.address, engine_type.name)
+    # access id is allocated when the notebook first uses its engine
     default_engine = backend_models.NotebookBackendRecord(notebook=nb,
-                                                engine_type=engine_type,
-                                                access_id=access_id)
+                                                engine_type=engine_type)
     default_engine.save()
     redirect = "/notebook/%s" % nb.guid
     return HttpResponseRedirect(redirect)
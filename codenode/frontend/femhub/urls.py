@@ -2,11 +2,12 @@
 from django.conf.urls.defaults import *
 
 from codenode.external.jsonrpc import jsonrpc_site
-from codenode.frontend.femhub.views import femhub
+from codenode.frontend.femhub.views import femhub, stream_cells
 
 urlpatterns = patterns('',
     url(r'^$', femhub, name='femhub'),
     url(r'^json/$', jsonrpc_site.dispatch, name='jsonrpc_mountpoint'),
+    url(r'^cells/(?P<guid>\w{32})$', stream_cells, name='stream_cells'),
     url(r'^json/browse/$', 'codenode.external.jsonrpc.views.browse', name='jsonrpc_browser'),
 )
 
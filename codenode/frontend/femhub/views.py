@@ -1,22 +1,27 @@
 
 from django.shortcuts import render_to_response
+from django.http import HttpResponse, Http404
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
 from django.template import loader, Context, TemplateDoesNotExist
 from django.contrib.auth.models import User
 from django.utils import simplejson as json
 from django.conf import settings
+from django.db.models import Count
 
 from codenode.external.jsonrpc import jsonrpc_method
 
-from codenode.frontend.bookshelf.models import Folder
+from codenode.frontend.bookshelf.models import Folder, FolderTooDeep
+from codenode.frontend.bookshelf import listing
 from codenode.frontend.notebook.models import Notebook, Cell
+from codenode.frontend.notebook.bulk import save_delta, VersionConflict
+from codenode.frontend.notebook import stream
 from codenode.frontend.backend.models import EngineType
 
 import codenode.frontend.bookshelf.models as _bookshelf
 import codenode.frontend.notebook.models as _notebook
 import codenode.frontend.backend.models as _backend
 
-from codenode.frontend.backend.rpc import allocateEngine
 
 def jsonrpc_auth_method(method, safe=False, validate=False):
     """Convenience function for authenticated Json RPC requests. """
@@ -49,10 +54,17 @@ def rpc_Template_render(request, template, context=None):
 
 @jsonrpc_auth_method('RPC.Backend.getEngines')
 def rpc_Backend_getEngines(request):
-    """Return a list of all available engines. """
-    engines = []
+    """Return a list of all available engines.
 
-    for engine in EngineType.objects.all():
+    Engine types of the same name on several backends are listed once;
+    the scheduler picks the backend when the notebook first uses it.
+    """
+    engines, names = [], set()
+
+    for engine in EngineType.objects.all().order_by('id'):
+        if engine.name in names:
+            continue
+        names.add(engine.name)
         engines.append({
             'id': engine.id,
             'name': engine.name,
@@ -157,7 +169,10 @@ def rpc_Folders_addFolder(request, guid, title):
         return { 'ok': False, 'reason': 'does-not-exist' }
 
     folder = Folder(owner=request.user, parent=parent, title=title)
-    folder.save()
+    try:
+        folder.save()
+    except FolderTooDeep:
+        return { 'ok': False, 'reason': 'too-deep' }
 
     return { 'ok': True, 'guid': folder.guid }
 
@@ -173,6 +188,29 @@ def rpc_Folders_getFolders(request, guid):
 
     return [ { 'ok': True, 'guid': folder.guid, 'title': folder.title } for folder in folders ]
 
+@jsonrpc_auth_method('RPC.Folders.getTree')
+def rpc_Folders_getTree(request, guid):
+    """Get the folder with the given guid and all folders below it, each
+    with the number of its notebooks, as nested 'folders' lists. """
+    try:
+        root = Folder.objects.get(owner=request.user, guid=guid)
+    except Folder.DoesNotExist:
+        return { 'ok': False, 'reason': 'does-not-exist' }
+
+    nodes = {}
+    tree = None
+
+    for folder in root.subtree().filter(owner=request.user).annotate(count=Count('notebook')):
+        node = { 'guid': folder.guid, 'title': folder.title, 'notebooks': folder.count, 'folders': [] }
+        nodes[folder.id] = node
+
+        if folder.id == root.id:
+            tree = node
+        elif folder.parent_id in nodes:
+            nodes[folder.parent_id]['folders'].append(node)
+
+    return { 'ok': True, 'tree': tree }
+
 @jsonrpc_auth_method('RPC.Folders.renameFolder')
 def rpc_Folders_renameFolder(request, guid, title):
     """Set new title to the given folder. """
@@ -211,8 +249,14 @@ def rpc_Folders_moveFolder(request, parent_guid, folder_guid):
     except Folder.DoesNotExist:
         return { 'ok': False, 'reason': 'does-not-exist' }
 
+    if folder.is_ancestor_of(parent):
+        return { 'ok': False, 'reason': 'invalid-move' }
+
     folder.parent = parent
-    folder.save()
+    try:
+        folder.save()
+    except FolderTooDeep:
+        return { 'ok': False, 'reason': 'too-deep' }
 
     return { 'ok': True }
 
@@ -227,13 +271,12 @@ def rpc_Notebooks_addNotebook(request, engine_guid, folder_guid, title='untitled
     notebook = Notebook(owner=request.user, folder=folder, title=title)
     notebook.save()
 
-    ### XXX: this has to be improved
+    # The engine is placed and allocated by the async backend bus the
+    # first time the notebook talks to it, so creating a notebook never
+    # waits on a backend.
     engine = _backend.EngineType.objects.get(id=engine_guid)
-    access = allocateEngine(engine.backend.address, engine.name)
-
-    backend = _backend.NotebookBackendRecord(notebook=notebook, engine_type=engine, access_id=access)
+    backend = _backend.NotebookBackendRecord(notebook=notebook, engine_type=engine)
     backend.save()
-    ################################
 
     return { 'ok': True, 'guid': notebook.guid }
 
@@ -263,31 +306,52 @@ def rpc_Notebooks_deleteNotebook(request, guid):
     return { 'ok': True }
 
 @jsonrpc_auth_method('RPC.Notebooks.getNotebooks')
-def rpc_Notebooks_getNotebooks(request, guid):
-    """Get all notebooks from the given location. """
+def rpc_Notebooks_getNotebooks(request, guid, sort=None, descending=False, cursor=None, limit=None):
+    """Get all notebooks from the given location.
+
+    With a limit, get one page of them sorted by sort ('title', 'created'
+    or 'lastmodified', the default); pass the returned 'next' cursor to
+    get the following page ('next' is null on the last one).
+    """
     try:
         folder = Folder.objects.get(owner=request.user, guid=guid)
     except Folder.DoesNotExist:
         return { 'ok': False, 'reason': 'does-not-exist' }
 
-    notebooks = []
+    query = Notebook.objects.filter(owner=request.user, folder=folder)
+    next = None
 
-    for notebook in Notebook.objects.filter(owner=request.user, folder=folder):
-        mapping = notebook.backend.all()
+    if limit is not None or cursor is not None:
+        try:
+            query, next = listing.page(query, sort or 'lastmodified', descending, cursor, limit or listing.PAGE_SIZE)
+        except ValueError:
+            return { 'ok': False, 'reason': 'invalid-page' }
+    elif sort is not None:
+        if sort not in listing.SORT_KEYS:
+            return { 'ok': False, 'reason': 'invalid-page' }
+        query = query.order_by(*listing.order_fields(sort, descending))
 
-        if len(mapping):
-            engine_name = mapping[0].engine_type.name
-        else:
-            engine_name = u'(undefined)'
+    notebooks = []
 
+    for item in listing.notebook_listing(query):
         notebooks.append({
-            'guid': notebook.guid,
-            'title': notebook.title,
-            'engine': engine_name,
-            'datetime': notebook.last_modified_time().strftime("%Y-%m-%d %H:%M:%S"),
+            'guid': item['guid'],
+            'title': item['title'],
+            'engine': item['engine'],
+            'datetime': item['modified'],
         })
 
-    return { 'ok': True, 'notebooks': notebooks }
+    return { 'ok': True, 'notebooks': notebooks, 'next': next }
+
+@jsonrpc_auth_method('RPC.Notebooks.countNotebooks')
+def rpc_Notebooks_countNotebooks(request, guid):
+    """Get the number of notebooks in the given location. """
+    try:
+        folder = Folder.objects.get(owner=request.user, guid=guid)
+    except Folder.DoesNotExist:
+        return { 'ok': False, 'reason': 'does-not-exist' }
+
+    return { 'ok': True, 'count': Notebook.objects.filter(owner=request.user, folder=folder).count() }
 
 @jsonrpc_auth_method('RPC.Notebooks.moveNotebooks')
 def rpc_Notebooks_moveNotebooks(request, folder_guid, notebooks_guid):
@@ -309,82 +373,77 @@ def rpc_Notebooks_moveNotebooks(request, folder_guid, notebooks_guid):
     return { 'ok': True }
 
 @jsonrpc_auth_method('RPC.Notebooks.saveNotebook')
-def rpc_Notebooks_saveNotebook(request, guid, cellsdata, orderlist):
-    """Save the given notebook. """
+def rpc_Notebooks_saveNotebook(request, guid, cellsdata, orderlist=None, deleted=None, version=None):
+    """Save the given notebook.
+
+    Only cells that changed need to be sent in ``cellsdata``, the order
+    list only when it changed, and the ids of removed cells in ``deleted``.
+    With ``version`` (as returned by the previous save or by getCells) the
+    save fails with 'version-conflict' if the notebook was saved since.
+    """
     try:
         notebook = Notebook.objects.get(owner=request.user, guid=guid)
-    except Folder.DoesNotExist:
+    except Notebook.DoesNotExist:
         return { 'ok': False, 'reason': 'does-not-exist' }
 
-    for cellid, data in cellsdata.items():
-        cells = Cell.objects.filter(guid=cellid, notebook=notebook)
+    try:
+        version = save_delta(notebook, cellsdata, orderlist, deleted, version)
+    except VersionConflict:
+        version = Notebook.objects.get(pk=notebook.pk).version
+        return { 'ok': False, 'reason': 'version-conflict', 'version': version }
 
-        content = data["content"]
-        style = data["cellstyle"]
-        props = data["props"]
+    return { 'ok': True, 'version': version }
 
-        if len(cells) > 0:
-            cell = cells[0]
-            cell.content = content
-            cell.type = u"text"
-            cell.style = style
-            cell.props = props
-            cell.save()
-        else:
-            cell = Cell(guid=cellid,
-                        notebook=notebook,
-                        owner=notebook.owner,
-                        content=content,
-                        type=u"text",
-                        style=style,
-                        props=props)
-            notebook.cell_set.add(cell)
-
-    notebook.orderlist = orderlist
-    notebook.save()
+def style_to_type(style):
+    if style == 'outputtext':
+        return 'output'
 
-    return { 'ok': True }
+    if style == 'outputimage':
+        return 'image'
+
+    if style == 'text':
+        return 'content'
+
+    return style
+
+def iter_typed_cells(notebook, type=None):
+    """Cells of the notebook as in RPC.Notebooks.getCells, in order. """
+    for guid, content, style, props in stream.iter_cells(notebook):
+        if type is None or style_to_type(style) == type:
+            yield {
+                'guid': guid,
+                'type': type,
+                'content': content,
+            }
 
 @jsonrpc_auth_method('RPC.Notebooks.getCells')
 def rpc_Notebooks_getCells(request, guid, type=None):
     """Retrieve cells from the given notebook. """
     try:
         notebook = Notebook.objects.get(owner=request.user, guid=guid)
-    except Folder.DoesNotExist:
+    except Notebook.DoesNotExist:
         return { 'ok': False, 'reason': 'does-not-exist' }
 
     if notebook.orderlist == 'orderlist':
-        return { 'ok': True }
-
-    def style_to_type(style):
-        if style == 'outputtext':
-            return 'output'
-
-        if style == 'outputimage':
-            return 'image'
-
-        if style == 'text':
-            return 'content'
-
-        return style
+        return { 'ok': True, 'version': notebook.version }
 
-    data, cells = {}, []
+    cells = list(iter_typed_cells(notebook, type))
 
-    for cell in Cell.objects.filter(notebook=notebook):
-        ctype, guid = style_to_type(cell.style), cell.guid
+    return { 'ok': True, 'cells': cells, 'version': notebook.version }
 
-        if type is None or ctype == type:
-            data[guid] = {
-                'guid': guid,
-                'type': type,
-                'content': cell.content,
-            }
-
-    orderlist = json.loads(notebook.orderlist)
+@login_required
+def stream_cells(request, guid):
+    """RPC.Notebooks.getCells as newline delimited JSON, for rendering
+    cells as they arrive: a line {'ok': true, 'version': ...} followed by
+    a line per cell (see notebook/stream.py). Takes ``type`` as a query
+    parameter. """
+    try:
+        notebook = Notebook.objects.get(owner=request.user, guid=guid)
+    except Notebook.DoesNotExist:
+        raise Http404
 
-    for guid in orderlist:
-        if guid in data:
-            cells.append(data[guid])
+    head = { 'ok': True, 'version': notebook.version }
+    lines = stream.ndjson(head, iter_typed_cells(notebook, request.GET.get('type')))
 
-    return { 'ok': True, 'cells': cells }
+    return HttpResponse(lines, mimetype=stream.MIMETYPE)
 
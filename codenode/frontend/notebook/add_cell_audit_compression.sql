@@ -0,0 +1,4 @@
+ALTER TABLE notebook_cell_audit ADD COLUMN _audit_snapshot bool DEFAULT 1 NOT NULL;
+ALTER TABLE notebook_cell_audit ADD COLUMN _audit_base integer NULL;
+ALTER TABLE notebook_cell_audit ADD COLUMN _audit_delta text DEFAULT '' NOT NULL;
+CREATE INDEX notebook_cell_audit__audit_base ON notebook_cell_audit (_audit_base);
@@ -0,0 +1,6 @@
+CREATE INDEX notebook_notebook_owner_location_title ON notebook_notebook (owner_id, location, title, id);
+CREATE INDEX notebook_notebook_owner_location_created ON notebook_notebook (owner_id, location, created_time, id);
+CREATE INDEX notebook_notebook_owner_location_modified ON notebook_notebook (owner_id, location, last_modified, id);
+CREATE INDEX notebook_notebook_folder_owner_title ON notebook_notebook (folder_id, owner_id, title, id);
+CREATE INDEX notebook_notebook_folder_owner_created ON notebook_notebook (folder_id, owner_id, created_time, id);
+CREATE INDEX notebook_notebook_folder_owner_modified ON notebook_notebook (folder_id, owner_id, last_modified, id);
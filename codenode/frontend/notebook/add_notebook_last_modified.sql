@@ -0,0 +1,11 @@
+ALTER TABLE notebook_notebook ADD COLUMN last_modified datetime NULL;
+ALTER TABLE notebook_notebook ADD COLUMN last_modified_user_id integer NULL REFERENCES auth_user (id);
+CREATE INDEX notebook_notebook_last_modified ON notebook_notebook (last_modified);
+CREATE INDEX notebook_notebook_last_modified_user_id ON notebook_notebook (last_modified_user_id);
+ALTER TABLE notebook_notebook_audit ADD COLUMN last_modified datetime NULL;
+ALTER TABLE notebook_notebook_audit ADD COLUMN last_modified_user_id integer NULL REFERENCES auth_user (id);
+CREATE INDEX notebook_notebook_audit_last_modified ON notebook_notebook_audit (last_modified);
+CREATE INDEX notebook_notebook_audit_last_modified_user_id ON notebook_notebook_audit (last_modified_user_id);
+UPDATE notebook_notebook SET
+    last_modified = COALESCE((SELECT MAX(c.last_modified) FROM notebook_cell c WHERE c.notebook_id = notebook_notebook.id), created_time),
+    last_modified_user_id = COALESCE((SELECT c.owner_id FROM notebook_cell c WHERE c.notebook_id = notebook_notebook.id ORDER BY c.last_modified DESC LIMIT 1), owner_id);
@@ -0,0 +1,2 @@
+ALTER TABLE notebook_notebook ADD COLUMN version integer DEFAULT 0 NOT NULL;
+ALTER TABLE notebook_notebook_audit ADD COLUMN version integer DEFAULT 0 NOT NULL;
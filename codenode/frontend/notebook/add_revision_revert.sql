@@ -0,0 +1 @@
+ALTER TABLE notebook_notebook_audit ADD COLUMN _audit_revert_of integer NULL;
@@ -0,0 +1,4 @@
+ALTER TABLE notebook_notebook_audit ADD COLUMN _audit_changed bool NULL;
+ALTER TABLE notebook_notebook_audit ADD COLUMN _audit_summary text NULL;
+CREATE INDEX notebook_notebook_audit_guid ON notebook_notebook_audit (guid);
+CREATE INDEX notebook_cell_audit_guid ON notebook_cell_audit (guid);
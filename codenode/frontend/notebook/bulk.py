@@ -0,0 +1,277 @@
+#########################################################################
+# Copyright (C) 2007, 2008, 2009
+# Alex Clemesha <alex@clemesha.org> & Dorian Raymer <deldotdr@gmail.com>
+#
+# This module is part of codenode, and is distributed under the terms
+# of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
+#########################################################################
+
+"""
+Saving a whole notebook in a handful of queries.
+
+Saving cell by cell costs a select, a save and an audit insert per cell.
+save_notebook fetches the cells of the notebook once, writes only the
+cells that changed (one executemany for updates, one for inserts), writes
+their audit rows the same way, and does it all in one transaction.
+
+save_delta does the same for a client that only sends what changed since
+the version of the notebook it last saved or loaded.
+"""
+
+from django.db import connection, transaction
+from django.db import models as db_models
+from django.db.models import F
+from django.dispatch import Signal
+
+from codenode.frontend.notebook import models
+from codenode.frontend.notebook import revision
+from codenode.frontend.notebook.revision_utils import load_orderlist, get_recent_cells, \
+        summarize_change, cell_revisions
+
+# Cell fields the client sends, as (payload key, model field,)
+CELL_FIELDS = (('content', 'content'), ('cellstyle', 'style'), ('props', 'props'))
+
+# Sent after the cells of a notebook were written here, since that does
+# not send the model signals of the cells.
+cells_written = Signal(providing_args=['notebook'])
+
+
+def _values(instance, fields, add):
+    return [f.get_db_prep_save(f.pre_save(instance, add)) for f in fields]
+
+def insert_many(model, instances):
+    """Insert unsaved instances of model with one executemany. Signals
+    are not sent and AutoField primary keys are not set on instances.
+    """
+    if not instances:
+        return
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.local_fields if not isinstance(f, db_models.AutoField)]
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (qn(model._meta.db_table),
+            ", ".join([qn(f.column) for f in fields]),
+            ", ".join(["%s"] * len(fields)))
+    cursor = connection.cursor()
+    cursor.executemany(sql, [_values(instance, fields, True) for instance in instances])
+    transaction.set_dirty()
+
+def update_many(model, instances):
+    """Update all fields of saved instances of model with one executemany.
+    Signals are not sent.
+    """
+    if not instances:
+        return
+    qn = connection.ops.quote_name
+    pk = model._meta.pk
+    fields = [f for f in model._meta.local_fields if not f.primary_key]
+    sql = "UPDATE %s SET %s WHERE %s = %%s" % (qn(model._meta.db_table),
+            ", ".join(["%s = %%s" % qn(f.column) for f in fields]),
+            qn(pk.column))
+    params = []
+    for instance in instances:
+        params.append(_values(instance, fields, False) + [pk.get_db_prep_save(instance.pk)])
+    cursor = connection.cursor()
+    cursor.executemany(sql, params)
+    transaction.set_dirty()
+
+def delete_many(model, pks):
+    """Delete rows of model by primary key with one query. Signals are not
+    sent.
+    """
+    if not pks:
+        return
+    qn = connection.ops.quote_name
+    pk = model._meta.pk
+    sql = "DELETE FROM %s WHERE %s IN (%s)" % (qn(model._meta.db_table),
+            qn(pk.column), ", ".join(["%s"] * len(pks)))
+    cursor = connection.cursor()
+    cursor.execute(sql, [pk.get_db_prep_save(v) for v in pks])
+    transaction.set_dirty()
+
+def _cells(notebook):
+    return dict([(cell.guid, cell) for cell in models.Cell.objects.filter(notebook=notebook)])
+
+def save_cells(notebook, cellsdata, existing=None):
+    """Insert or update the cells in cellsdata (dict cell id: {'content',
+    'cellstyle', 'props'}) of notebook, skipping cells that did not change.
+    A field missing from the data of a cell keeps its value (its default
+    for a new cell).
+    existing is the dict cell id: Cell of the notebook, if already fetched;
+    inserted cells are added to it.
+    return (inserted, updated,) lists of Cells.
+    """
+    if existing is None:
+        existing = _cells(notebook)
+    inserted, updated = [], []
+    for cellid, data in cellsdata.items():
+        cell = existing.get(cellid)
+        if cell is None:
+            cell = models.Cell(guid=cellid,
+                            notebook=notebook,
+                            owner=notebook.owner,
+                            type=u"text")
+            for key, name in CELL_FIELDS:
+                setattr(cell, name, data.get(key, getattr(cell, name)))
+            inserted.append(cell)
+            continue
+        changed = cell.type != u"text"
+        for key, name in CELL_FIELDS:
+            value = data.get(key, getattr(cell, name))
+            if getattr(cell, name) != value:
+                setattr(cell, name, value)
+                changed = True
+        if changed:
+            cell.type = u"text"
+            updated.append(cell)
+    for cell in inserted:
+        existing[cell.guid] = cell
+    insert_many(models.Cell, inserted)
+    update_many(models.Cell, updated)
+    # one snapshot lookup for the audit rows of all the cells
+    rows = (revision.audit_rows(models.Cell, inserted, 'I', compress=False) +
+            revision.audit_rows(models.Cell, updated, 'U', compress=False))
+    revision.compress_rows(models.Cell._audit_model, rows)
+    insert_many(models.Cell._audit_model, rows)
+    _cells_modified(notebook, inserted + updated)
+    return inserted, updated
+
+def _cells_modified(notebook, cells):
+    # the cells got their last_modified from pre_save; the caller saves
+    # the notebook
+    if cells:
+        last = max(cells, key=lambda cell: cell.last_modified)
+        notebook.last_modified, notebook.last_modified_user_id = last.last_modified, last.owner_id
+
+def delete_cells(notebook, cellids, existing=None):
+    """Delete the cells of notebook with ids in cellids (and from existing,
+    see save_cells).
+    return list of deleted Cells.
+    """
+    if existing is None:
+        existing = _cells(notebook)
+    cells = [existing.pop(cellid) for cellid in cellids if cellid in existing]
+    insert_many(models.Cell._audit_model, revision.audit_rows(models.Cell, cells, 'D'))
+    delete_many(models.Cell, [cell.guid for cell in cells])
+    return cells
+
+def _contents(cells):
+    return dict([(cellid, cell.content) for cellid, cell in cells.items()])
+
+def _summarize(notebook, previous_orderlist, previous_contents, cells):
+    previous = get_recent_cells(load_orderlist(previous_orderlist), previous_contents)
+    current = get_recent_cells(load_orderlist(notebook.orderlist), _contents(cells))
+    notebook._audit_changed, notebook._audit_summary = summarize_change(current, previous)
+
+def _bump_version(notebook):
+    """Increment the version of notebook in the database, and set the new
+    one on notebook. The increment is done by the UPDATE itself, so each
+    of concurrent saves gets a version of its own.
+    """
+    query = models.Notebook.objects.filter(pk=notebook.pk)
+    query.update(version=F('version') + 1)
+    notebook.version = query.values_list('version', flat=True)[0]
+
+def _write_notebook(notebook):
+    # the fields the bulk saves change; not version, see _bump_version
+    models.Notebook.objects.filter(pk=notebook.pk).update(orderlist=notebook.orderlist,
+            last_modified=notebook.last_modified, last_modified_user=notebook.last_modified_user_id)
+
+def save_revision(notebook, previous_orderlist, previous_contents, cells, change_type='U'):
+    """Save notebook, storing in the revision this creates what changed
+    since the previous one, so listing revisions does not recompute it.
+    previous_contents: dict cell id: content before the changes
+    cells: dict cell id: Cell after the changes
+    change_type: of the revision, 'U' or 'R' for a revert
+    """
+    _summarize(notebook, previous_orderlist, previous_contents, cells)
+    try:
+        _write_notebook(notebook)
+        insert_many(models.Notebook._audit_model,
+                revision.audit_rows(models.Notebook, [notebook], change_type))
+    finally:
+        del notebook._audit_changed, notebook._audit_summary
+
+@transaction.commit_on_success
+def save_notebook(notebook, cellsdata, orderlist):
+    """Save the cells and the orderlist of notebook in one transaction.
+    """
+    cells = _cells(notebook)
+    previous_orderlist, previous_contents = notebook.orderlist, _contents(cells)
+    save_cells(notebook, cellsdata, cells)
+    notebook.orderlist = orderlist
+    _bump_version(notebook)
+    save_revision(notebook, previous_orderlist, previous_contents, cells)
+    cells_written.send(sender=models.Notebook, notebook=notebook)
+
+
+class VersionConflict(Exception):
+    """The notebook was saved by someone else since the version the
+    client based its changes on.
+    """
+
+@transaction.commit_on_success
+def save_delta(notebook, cellsdata, orderlist=None, deleted=None, version=None):
+    """Save changed cells (same format as for save_notebook), delete the
+    cells with ids in deleted and replace the orderlist if one is given.
+
+    If version is given it must still be the version of the notebook in
+    the database, otherwise nothing is saved and VersionConflict is
+    raised. return the new version.
+    """
+    if version is not None:
+        bumped = models.Notebook.objects.filter(pk=notebook.pk, version=version).update(version=version + 1)
+        if not bumped:
+            raise VersionConflict(notebook.guid)
+        notebook.version = version + 1
+    else:
+        _bump_version(notebook)
+    cells = _cells(notebook)
+    previous_orderlist, previous_contents = notebook.orderlist, _contents(cells)
+    if deleted:
+        delete_cells(notebook, deleted, cells)
+    if cellsdata:
+        save_cells(notebook, cellsdata, cells)
+    if orderlist is not None:
+        notebook.orderlist = orderlist
+    # also records the notebook revision the cell changes belong to
+    save_revision(notebook, previous_orderlist, previous_contents, cells)
+    cells_written.send(sender=models.Notebook, notebook=notebook)
+    return notebook.version
+
+@transaction.commit_on_success
+def revert_to_revision(id):
+    """Revert to revision with given id.
+
+    Resolves the state of all cells as of the revision at once, writes
+    them back with one update (and one insert for cells deleted since),
+    and records the revert as a single notebook revision with change type
+    'R' instead of a revision per cell (see revision_utils.cell_revisions).
+
+    Returns original Notebook id.
+    """
+    nbrev = models.Notebook.revisions.get(_audit_id=id)
+    nb = models.Notebook.objects.get(guid=nbrev.guid)
+    cells = _cells(nb)
+    previous_orderlist, previous_contents = nb.orderlist, _contents(cells)
+    target = cell_revisions(nb.id, nbrev._audit_timestamp)
+    inserted, updated = [], []
+    for cellid in load_orderlist(nbrev.orderlist):
+        cellrev = target.get(cellid)
+        if cellrev is None:
+            continue
+        cell = cells.get(cellid)
+        if cell is None:
+            cell = models.Cell(guid=cellid, notebook=nb, owner_id=cellrev.owner_id)
+            cells[cellid] = cell
+            inserted.append(cell)
+        else:
+            updated.append(cell)
+        cell.content, cell.style, cell.type, cell.props = cellrev.content, cellrev.style, cellrev.type, cellrev.props
+    insert_many(models.Cell, inserted)
+    update_many(models.Cell, updated)
+    _cells_modified(nb, inserted + updated)
+    nb.orderlist = nbrev.orderlist
+    _bump_version(nb)
+    nb._audit_revert_of = nbrev._audit_id
+    save_revision(nb, previous_orderlist, previous_contents, cells, 'R')
+    cells_written.send(sender=models.Notebook, notebook=nb)
+    return nb.guid
@@ -0,0 +1,134 @@
+#########################################################################
+# Copyright (C) 2007, 2008, 2009
+# Alex Clemesha <alex@clemesha.org> & Dorian Raymer <deldotdr@gmail.com>
+#
+# This module is part of codenode, and is distributed under the terms
+# of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
+#########################################################################
+
+"""
+Content addressed store for plot images (settings.PLOT_IMAGES).
+
+Images are named by the sha1 of their bytes, so storing the same plot
+twice keeps one file, and a file never changes once written. Engines
+with a shared image store (see codenode.engine.display) write files with
+the same names directly.
+
+Cells reference images by file name in their content (cellstyle
+'outputimage'), one per line. collect() removes files no cell or cell revision
+references any more, and keeps the directory under max_size by evicting
+files only old revisions reference, least recently stored first. Images
+of current cells are never removed.
+"""
+
+import os
+import time
+import hashlib
+
+from django.conf import settings
+
+from codenode.frontend.notebook import models
+
+
+def _count_images(counts, content):
+    for fn in content.splitlines():
+        counts[fn] = counts.get(fn, 0) + 1
+
+
+class ImageStore(object):
+    """
+    grace: seconds a new file is kept even if nothing references it yet
+    (the cell holding it is usually saved some time after evaluation).
+    max_size: bytes the store may use, 0 for no limit.
+    """
+
+    def __init__(self, path=None, max_size=None, grace=None):
+        if path is None:
+            path = settings.PLOT_IMAGES
+        if max_size is None:
+            max_size = getattr(settings, 'PLOT_IMAGES_MAX_SIZE', 0) * 1024 * 1024
+        if grace is None:
+            grace = getattr(settings, 'PLOT_IMAGES_GRACE', 60 * 60)
+        self.path = path
+        self.max_size = max_size
+        self.grace = grace
+
+    def name(self, data, extension='.png'):
+        return hashlib.sha1(data).hexdigest() + extension
+
+    def put(self, data, extension='.png'):
+        """Store data, return its file name.
+        """
+        fn = self.name(data, extension)
+        fullpath = os.path.join(self.path, fn)
+        if os.path.exists(fullpath):
+            # mark as recently stored
+            os.utime(fullpath, None)
+            return fn
+        tmp = '%s.%d.tmp' % (fullpath, os.getpid())
+        f = open(tmp, 'wb')
+        f.write(data)
+        f.close()
+        os.rename(tmp, fullpath)
+        return fn
+
+    def references(self):
+        """return (current, revisions,): dicts of file name: number of
+        references from current cells and from cell revisions.
+        """
+        current, revisions = {}, {}
+        for content in models.Cell.objects.filter(style='outputimage').values_list('content', flat=True):
+            _count_images(current, content)
+        # image names are far below the size the audit trail compresses
+        for content in models.Cell.revisions.filter(style='outputimage').values_list('content', flat=True):
+            _count_images(revisions, content)
+        return current, revisions
+
+    def files(self):
+        """return list of (mtime, size, file name,) of stored files.
+        """
+        files = []
+        for fn in os.listdir(self.path):
+            try:
+                st = os.stat(os.path.join(self.path, fn))
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, fn,))
+        return files
+
+    def remove(self, fn):
+        try:
+            os.remove(os.path.join(self.path, fn))
+        except OSError:
+            pass
+
+    def collect(self):
+        """Remove unreferenced files and evict files over max_size.
+        return list of removed file names.
+        """
+        current, revisions = self.references()
+        files = self.files()
+        now = time.time()
+        removed = []
+        kept = []
+        for mtime, size, fn in files:
+            if fn not in current and fn not in revisions and now - mtime >= self.grace:
+                self.remove(fn)
+                removed.append(fn)
+            else:
+                kept.append((mtime, size, fn,))
+        if self.max_size:
+            total = sum([size for mtime, size, fn in kept])
+            kept.sort()
+            for mtime, size, fn in kept:
+                if total <= self.max_size:
+                    break
+                if fn in current or now - mtime < self.grace:
+                    continue
+                self.remove(fn)
+                removed.append(fn)
+                total -= size
+        return removed
+
+
+image_store = ImageStore()
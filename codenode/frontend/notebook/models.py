@@ -7,6 +7,7 @@
 #########################################################################
 
 import uuid
+import datetime
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext_lazy as _
@@ -23,19 +24,37 @@ class Notebook(models.Model):
     folder = models.ForeignKey('bookshelf.Folder')
     created_time = models.DateTimeField(auto_now_add=True)
     orderlist = models.TextField(editable=False, default='orderlist')
-
-    revisions = revision.AuditTrail()
+    version = models.IntegerField(editable=False, default=0) #incremented by every save of the cells
+    # copied from the most recently saved cell, so listings need no query per notebook
+    last_modified = models.DateTimeField(null=True, editable=False, db_index=True)
+    last_modified_user = models.ForeignKey(User, null=True, editable=False, related_name='notebook_last_modified')
+
+    # whether the cells differ from the previous revision and what changed,
+    # None until computed (see revision_utils.summarize_revisions)
+    revisions = revision.AuditTrail(track_fields=(
+                    ('_audit_changed', models.NullBooleanField(), None),
+                    ('_audit_summary', models.TextField(null=True, blank=True), None),
+                    # audit id of the revision a revert (change type 'R') restored
+                    ('_audit_revert_of', models.IntegerField(null=True), None),
+                    ))
 
     def save(self):
         if not self.guid:
             self.guid = unicode(uuid.uuid4()).replace("-", "")
+        if self.last_modified is None:
+            self.last_modified = datetime.datetime.now()
+            self.last_modified_user_id = self.owner_id
         super(Notebook, self).save()
 
     def last_modified_time(self):
         """Last time corresponding Notebook was modified.
 
-        This is equivalent to finding the most recently modified Cell in this Notebook.
+        This is the last_modified time of the most recently modified Cell
+        in this Notebook, kept on the Notebook by Cell.save and the bulk
+        saves (see bulk.py).
         """
+        if self.last_modified is not None:
+            return self.last_modified
         try:
             return self.cell_set.latest(field_name="last_modified").last_modified
         except Cell.DoesNotExist:
@@ -44,14 +63,27 @@ class Notebook(models.Model):
     def last_modified_by(self):
         """User who modified corresponding Notebook last; 
 
-        Find who recently modified the last modified cell in this Notebook
+        The owner of the last modified cell in this Notebook.
         """
+        if self.last_modified_user_id is not None:
+            return self.last_modified_user
         try:
             # this really needs cell to have a last_modified_by attribute
             return self.cell_set.latest(field_name="last_modified").owner
         except Cell.DoesNotExist: 
             return self.owner
 
+    def cell_modified(self, cell):
+        """Record cell as the last modification of this Notebook, without
+        saving the Notebook itself (which would add a revision).
+        Nothing is written if the Notebook already records it.
+        """
+        if (self.last_modified, self.last_modified_user_id) == (cell.last_modified, cell.owner_id):
+            return
+        self.last_modified, self.last_modified_user_id = cell.last_modified, cell.owner_id
+        Notebook.objects.filter(pk=self.pk).update(last_modified=cell.last_modified,
+                                                   last_modified_user=cell.owner_id)
+
     class Meta:
         verbose_name = _('Notebook')
         verbose_name_plural = _('Notebooks')
@@ -70,7 +102,7 @@ class Cell(models.Model):
     props = models.TextField() 
     last_modified = models.DateTimeField(auto_now=True)
 
-    revisions = revision.AuditTrail()
+    revisions = revision.AuditTrail(compress_fields=['content'])
 
     def save_evaluate(self, json_obj):
         """
@@ -84,8 +116,11 @@ class Cell(models.Model):
         """
         save data resulting from an evaluation. (Temp name)
         """
-    #def save(self):
-        #update Notebook last modified time.
+    def save(self, *args, **kwargs):
+        super(Cell, self).save(*args, **kwargs)
+        #update Notebook last modified time. The bulk saves (see bulk.py)
+        #do not come through here and record it once per save.
+        self.notebook.cell_modified(self)
 
     class Meta:
         verbose_name = _('Cell')
@@ -8,14 +8,25 @@
 
 """
 This file is from here: http://code.djangoproject.com/wiki/AuditTrail
+
+With compress_fields, long values of those fields are not copied into
+every audit row. Every snapshot_interval rows (or when a value changed too
+much) a row is a full snapshot; the rows in between store, in
+_audit_delta, zlib compressed line deltas against the snapshot they name
+in _audit_base, and leave the field empty. expand() rebuilds the values
+of such rows.
 """
 from django.dispatch import dispatcher
-from django.db import models
+from django.db import models, connection
 from django.core.exceptions import ImproperlyConfigured
 from django.contrib import admin
+from django.utils import simplejson as json
 import copy
 import re
 import types
+import zlib
+import base64
+import difflib
 try:
     import settings_audit
 except ImportError:
@@ -24,11 +35,15 @@ value_error_re = re.compile("^.+'(.+)'$")
 
 class AuditTrail(object):
     def __init__(self, show_in_admin=False, save_change_type=True, audit_deletes=True,
-                 track_fields=None):
+                 track_fields=None, compress_fields=None, snapshot_interval=20,
+                 compress_min_size=256):
         self.opts = {}
         self.opts['show_in_admin'] = show_in_admin
         self.opts['save_change_type'] = save_change_type
         self.opts['audit_deletes'] = audit_deletes
+        self.opts['compress_fields'] = compress_fields or []
+        self.opts['snapshot_interval'] = snapshot_interval
+        self.opts['compress_min_size'] = compress_min_size
         if track_fields:
             self.opts['track_fields'] = track_fields
         else:
@@ -49,18 +64,8 @@ class AuditTrail(object):
                 admin.site.register(model)
             descriptor = AuditTrailDescriptor(model._default_manager, sender._meta.pk.attname)
             setattr(sender, name, descriptor)
-
-            def _audit_track(instance, field_arr, **kwargs):
-                field_name = field_arr[0]
-                try:
-                    return getattr(instance, field_name)
-                except:
-                    if len(field_arr) > 2:
-                        if callable(field_arr[2]):
-                            fn = field_arr[2]
-                            return fn(instance)
-                        else:
-                            return field_arr[2]
+            sender._audit_model = model
+            model._audit_opts = self.opts
 
             def _audit(sender, instance, created, **kwargs):
                 # Write model changes to the audit model.
@@ -75,8 +80,8 @@ class AuditTrail(object):
                     else:
                         kwargs['_audit_change_type'] = 'U'
                 for field_arr in model._audit_track:
-                    kwargs[field_arr[0]] = _audit_track(instance, field_arr)
-                model._default_manager.create(**kwargs)
+                    kwargs[field_arr[0]] = _track_value(instance, field_arr)
+                _create_row(model, kwargs)
             ## Uncomment this line for pre r8223 Django builds
             #dispatcher.connect(_audit, signal=models.signals.post_save, sender=cls, weak=False)
             ## Comment this line for pre r8223 Django builds
@@ -91,8 +96,8 @@ class AuditTrail(object):
                     if self.opts['save_change_type']:
                         kwargs['_audit_change_type'] = 'D'
                     for field_arr in model._audit_track:
-                        kwargs[field_arr[0]] = _audit_track(instance, field_arr)
-                    model._default_manager.create(**kwargs)
+                        kwargs[field_arr[0]] = _track_value(instance, field_arr)
+                    _create_row(model, kwargs)
                 ## Uncomment this line for pre r8223 Django builds
                 #dispatcher.connect(_audit_delete, signal=models.signals.pre_delete, sender=cls, weak=False)
                 ## Comment this line for pre r8223 Django builds
@@ -103,6 +108,147 @@ class AuditTrail(object):
         ## Comment this line for pre r8223 Django builds
         models.signals.class_prepared.connect(_contribute, sender=cls, weak=False)
 
+def _track_value(instance, field_arr):
+    field_name = field_arr[0]
+    try:
+        return getattr(instance, field_name)
+    except:
+        if len(field_arr) > 2:
+            if callable(field_arr[2]):
+                fn = field_arr[2]
+                return fn(instance)
+            else:
+                return field_arr[2]
+
+def audit_rows(cls, instances, change_type, compress=True):
+    """Unsaved audit model instances recording instances of cls (a model
+    with an AuditTrail), for writing many of them at once instead of one
+    insert per save signal. change_type is 'I', 'U' or 'D'.
+    With compress=False the caller passes them to compress_rows itself,
+    e.g. together with rows of another change_type.
+    """
+    model = cls._audit_model
+    rows = []
+    for instance in instances:
+        kwargs = {}
+        for field in cls._meta.fields:
+            kwargs[field.attname] = getattr(instance, field.attname)
+        if model._audit_opts['save_change_type']:
+            kwargs['_audit_change_type'] = change_type
+        for field_arr in model._audit_track:
+            kwargs[field_arr[0]] = _track_value(instance, field_arr)
+        rows.append(model(**kwargs))
+    if compress:
+        compress_rows(model, rows)
+    return rows
+
+def _create_row(model, kwargs):
+    row = model(**kwargs)
+    compress_rows(model, [row])
+    row.save()
+
+def encode_delta(base, value):
+    """Line based delta turning base into value: a list of [start, end]
+    (copy these lines of base) and strings (insert this text).
+    """
+    a, b = base.splitlines(True), value.splitlines(True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b).get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(b[j1:j2]))
+    return ops
+
+def apply_delta(base, ops):
+    a = base.splitlines(True)
+    out = []
+    for op in ops:
+        if isinstance(op, list):
+            out.extend(a[op[0]:op[1]])
+        else:
+            out.append(op)
+    return u''.join(out)
+
+def _pack(deltas):
+    return base64.b64encode(zlib.compress(json.dumps(deltas)))
+
+def _unpack(data):
+    return json.loads(zlib.decompress(base64.b64decode(data)))
+
+def _latest_snapshots(model, pks):
+    """The latest snapshots of the objects with pks by pk, each with the
+    number of deltas against it in _audit_deltas, in one query.
+    """
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    pk_name = model._audit_pk_name
+    pk_column = qn(model._meta.get_field(pk_name).column)
+    audit_id, base, snapshot = qn('_audit_id'), qn('_audit_base'), qn('_audit_snapshot')
+    latest = model._default_manager.filter(**{pk_name + '__in':list(pks)}).order_by().extra(
+        select={'_audit_deltas':'SELECT COUNT(*) FROM %s d WHERE d.%s = %s.%s' % (table, base, table, audit_id)},
+        where=['%s.%s = (SELECT MAX(s.%s) FROM %s s WHERE s.%s = %s.%s AND s.%s = %%s)' %
+               (table, audit_id, audit_id, table, pk_column, table, pk_column, snapshot)],
+        params=[True])
+    return dict([(getattr(snap, pk_name), snap) for snap in latest])
+
+def compress_rows(model, rows):
+    """Turn unsaved audit rows of model into snapshots or deltas against
+    the latest snapshot of the same object (see the module docstring).
+    The snapshots of all rows are looked up at once, so callers saving
+    many rows should pass them in one call.
+    """
+    fields = model._audit_opts['compress_fields']
+    if not fields:
+        return
+    min_size = model._audit_opts['compress_min_size']
+    interval = model._audit_opts['snapshot_interval']
+    pk_name = model._audit_pk_name
+    for row in rows:
+        row._audit_snapshot, row._audit_base, row._audit_delta = True, None, ''
+    # rows with only short values are kept as snapshots without a lookup
+    rows = [row for row in rows
+            if [name for name in fields if len(getattr(row, name) or u'') >= min_size]]
+    if not rows:
+        return
+    snapshots = _latest_snapshots(model, set([getattr(row, pk_name) for row in rows]))
+    for row in rows:
+        snap = snapshots.get(getattr(row, pk_name))
+        if snap is None or snap._audit_deltas + 1 >= interval:
+            continue
+        deltas = {}
+        for name in fields:
+            value = getattr(row, name) or u''
+            if len(value) < min_size:
+                continue
+            ops = encode_delta(getattr(snap, name) or u'', value)
+            deltas[name] = ops
+        if not deltas:
+            continue
+        packed = _pack(deltas)
+        if len(packed) * 2 > sum([len(getattr(row, name)) for name in deltas]):
+            # changed too much, start a new snapshot
+            continue
+        row._audit_snapshot, row._audit_base, row._audit_delta = False, snap._audit_id, packed
+        for name in deltas:
+            setattr(row, name, u'')
+
+def expand(rows):
+    """Rebuild the compressed field values of audit rows in place (one
+    query for all the snapshots they need). return rows.
+    """
+    packed = [row for row in rows if getattr(row, '_audit_delta', '')]
+    if not packed:
+        return rows
+    model = packed[0].__class__
+    snapshots = model._default_manager.in_bulk(list(set([row._audit_base for row in packed])))
+    for row in packed:
+        snap = snapshots[row._audit_base]
+        for name, ops in _unpack(row._audit_delta).items():
+            setattr(row, str(name), apply_delta(getattr(snap, name) or u'', ops))
+        row._audit_delta = ''
+    return rows
+
 class AuditTrailDescriptor(object):
     def __init__(self, manager, pk_attribute):
         self.manager = manager
@@ -158,6 +304,12 @@ def create_audit_model(cls, **kwargs):
     if 'save_change_type' in kwargs and kwargs['save_change_type']:
         attrs['_audit_change_type'] = models.CharField(max_length=1)
 
+    if kwargs.get('compress_fields'):
+        attrs['_audit_snapshot'] = models.BooleanField(default=True)
+        attrs['_audit_base'] = models.IntegerField(null=True, db_index=True)
+        attrs['_audit_delta'] = models.TextField(blank=True)
+        attrs['_audit_pk_name'] = cls._meta.pk.attname
+
     # Copy the fields from the existing model to the audit model
     for field in cls._meta.fields:
         #if field.attname in attrs:
@@ -170,7 +322,14 @@ def create_audit_model(cls, **kwargs):
             attrs[field.name] = copy.copy(field)
             # If 'unique' is in there, we need to remove it, otherwise the index
             # is created and multiple audit entries for one item fail.
+            if field.unique:
+                # still looked up by it
+                attrs[field.name].db_index = True
             attrs[field.name]._unique = False
+            if field.rel and field.rel.related_name:
+                # the reverse accessor of the model is taken
+                attrs[field.name].rel = copy.copy(field.rel)
+                attrs[field.name].rel.related_name = field.rel.related_name + '_audit'
             # If a model has primary_key = True, a second primary key would be
             # created in the audit model. Set primary_key to false.
             attrs[field.name].primary_key = False
@@ -6,48 +6,125 @@
 # of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
 #########################################################################
 
+from django.db import connection, transaction
+from django.db.models import Max
 from django.utils import simplejson as json
 from codenode.frontend.notebook.models import Notebook, Cell
+from codenode.frontend.notebook.revision import expand
 
-def get_nb_revisions(nbid, n=25):
-    """Get notebook revisions.
-
-    TODO: Only show 'n' revisions per page.
+def get_nb_revisions(nbid, n=25, page=1):
+    """Get notebook revisions that changed the cells, newest first, n per
+    page: list of (audit id, timestamp, summary of the change, orderlist).
     """
-    #Get all Notebook revisions, orderlist='orderlist' means there are no meaningful revisions:
-    nbrevs = Notebook.revisions.filter(guid=nbid).exclude(orderlist='orderlist')
+    summarize_revisions(nbid)
+    nbrevs = Notebook.revisions.filter(guid=nbid, _audit_changed=True).order_by('-_audit_id')
+    start = (page - 1) * n
     revisions = []
-    for nb in nbrevs:
-        orderlist = nb.orderlist
-        current_audit_id, current_audit_ts = nb._audit_id, nb._audit_timestamp #id and timestamp of nb revision snapshot.
-        recent_cells = get_recent_cells(orderlist, current_audit_ts)
-        revisions.append((current_audit_id, current_audit_ts, recent_cells))
-    unique_revisions = get_unique_revisions(revisions)
-    return unique_revisions
+    for nb in nbrevs[start:start + n]:
+        revisions.append((nb._audit_id, nb._audit_timestamp, nb._audit_summary, _orderlist(nb)))
+    return revisions
+
+def load_orderlist(orderlist):
+    #orderlist='orderlist' means there are no meaningful revisions
+    if orderlist == 'orderlist':
+        return []
+    return json.loads(orderlist)
+
+def _orderlist(nbrev):
+    if nbrev is None:
+        return []
+    return load_orderlist(nbrev.orderlist)
 
-def get_unique_revisions(revisions):
-    """Find in-order unique revisions.
-    In other words, drop all in-a-row duplicate revisions.
+def summarize_change(current, previous):
+    """(changed, summary,) of the change from previous to current, both
+    lists of (cellid, content).
     """
-    uniques = []
-    current_audit_id, current_audit_ts, current = revisions.pop(0)
-    for (current_audit_id, current_audit_ts, previous) in revisions:
-        if current != previous:
-            codediff = diff_from_previous(current, previous)
-            uniques.append((current_audit_id, current_audit_ts, codediff, current))
-        current = previous
-    return uniques
+    changed = current != previous
+    return changed, changed and diff_from_previous(current, previous) or ''
 
-def get_recent_cells(orderlist, current_audit_ts):
-    """The latest (cellid, content) for all cells in give 'orderlist'.
-    The 'current_nb_ts' is the timestamp of the notebook snapshot.
+def get_recent_cells(orderlist, state):
+    """The latest (cellid, content) for all cells in given 'orderlist',
+    from 'state' (dict cellid: content).
     """
-    orderlist = json.loads(orderlist)
-    allcontent = []
-    for cellid in orderlist:
-        cellrevs = Cell.revisions.filter(guid=cellid, _audit_timestamp__lte=current_audit_ts).order_by("-_audit_timestamp")[0] #most recent
-        allcontent.append((cellid, cellrevs.content))
-    return allcontent
+    return [(cellid, state[cellid]) for cellid in orderlist if cellid in state]
+
+def cell_revisions(notebook_id, ts):
+    """dict cellid: cell revision, the state of the cells of a notebook as
+    of time ts.
+
+    A revert (notebook revision with change type 'R') does not write cell
+    revisions; the state after it is the state as of the reverted to
+    revision plus the cell revisions since.
+    """
+    reverts = Notebook.revisions.filter(id=notebook_id, _audit_change_type='R',
+            _audit_timestamp__lte=ts).order_by('-_audit_id')[:1]
+    latest = Cell.revisions.filter(notebook=notebook_id, _audit_timestamp__lte=ts)
+    if reverts:
+        target = Notebook.revisions.get(_audit_id=reverts[0]._audit_revert_of)
+        state = cell_revisions(notebook_id, target._audit_timestamp)
+        latest = latest.filter(_audit_timestamp__gt=reverts[0]._audit_timestamp)
+    else:
+        state = {}
+    latest = latest.order_by().values('guid').annotate(last=Max('_audit_id'))
+    cellrevs = Cell.revisions.in_bulk([l['last'] for l in latest]).values()
+    expand(cellrevs)
+    for cellrev in cellrevs:
+        state[cellrev.guid] = cellrev
+    return state
+
+def cell_state(notebook_id, ts):
+    """dict cellid: content of the cells of a notebook as of time ts.
+    """
+    return dict([(cellid, cellrev.content) for cellid, cellrev in cell_revisions(notebook_id, ts).items()])
+
+@transaction.commit_on_success
+def summarize_revisions(nbid):
+    """Compute and store whether each not yet summarized revision of the
+    notebook changed its cells, and the change.
+
+    Saves through notebook.bulk record this when they create the
+    revision; this catches up on revisions created otherwise. It replays
+    the cell revisions between the previous summarized revision and the
+    last one once, instead of looking up every cell of every revision.
+    """
+    pending = list(Notebook.revisions.filter(guid=nbid, _audit_changed__isnull=True).order_by('_audit_id'))
+    if not pending:
+        return
+    notebook_id = pending[0].id
+    previous = Notebook.revisions.filter(guid=nbid, _audit_id__lt=pending[0]._audit_id).order_by('-_audit_id')[:1]
+    if previous:
+        previous = previous[0]
+        state = cell_state(notebook_id, previous._audit_timestamp)
+        cellrevs = Cell.revisions.filter(notebook=notebook_id,
+                _audit_timestamp__gt=previous._audit_timestamp,
+                _audit_timestamp__lte=pending[-1]._audit_timestamp)
+    else:
+        previous = None
+        state = {}
+        cellrevs = Cell.revisions.filter(notebook=notebook_id,
+                _audit_timestamp__lte=pending[-1]._audit_timestamp)
+    cellrevs = expand(list(cellrevs.order_by('_audit_timestamp', '_audit_id')))
+    previous_cells = get_recent_cells(_orderlist(previous), state)
+
+    summaries = []
+    i = 0
+    for nbrev in pending:
+        while i < len(cellrevs) and cellrevs[i]._audit_timestamp <= nbrev._audit_timestamp:
+            state[cellrevs[i].guid] = cellrevs[i].content
+            i += 1
+        if nbrev._audit_change_type == 'R':
+            state = cell_state(notebook_id, nbrev._audit_timestamp)
+        current = get_recent_cells(_orderlist(nbrev), state)
+        changed, summary = summarize_change(current, previous_cells)
+        summaries.append((changed, summary, nbrev._audit_id))
+        previous_cells = current
+
+    qn = connection.ops.quote_name
+    sql = "UPDATE %s SET %s = %%s, %s = %%s WHERE %s = %%s" % (qn(Notebook._audit_model._meta.db_table),
+            qn('_audit_changed'), qn('_audit_summary'), qn('_audit_id'))
+    cursor = connection.cursor()
+    cursor.executemany(sql, summaries)
+    transaction.set_dirty()
 
 def diff_from_previous(current, previous):
     """Difference of current to previous diff.
@@ -58,26 +135,3 @@ def diff_from_previous(current, previous):
     revdiff = reversed(list(diff))
     codediff = " | ".join([s[1].replace("\n", "") for s in revdiff if s[0][-1] != "o"])
     return codediff
-
-
-def revert_to_revision(id):
-    """Revert to revision with given id.
-    Copy all neeed data into new models and save,
-    which will create fresh timestamps and audit_id 
-    for the new Notebook and Cell data.
-
-    Returns original Notebook id.
-    """
-    #XXX The below code could _definitely_ be optimized:
-    nbrev = Notebook.revisions.get(_audit_id=id)
-    ts = nbrev._audit_timestamp
-    nb = Notebook.objects.get(guid=nbrev.guid)
-    nb.orderlist = nbrev.orderlist
-    nb.save()
-    orderlist = json.loads(nbrev.orderlist)
-    for cellid in orderlist:
-        cellrev = Cell.revisions.filter(guid=cellid, _audit_timestamp__lte=ts).order_by("-_audit_timestamp")[0] #most recent
-        cell = Cell.objects.get(guid=cellrev.guid)
-        cell.content, cell.style, cell.type, cell.props = cellrev.content, cellrev.style, cellrev.type, cellrev.props
-        cell.save()
-    return nb.guid
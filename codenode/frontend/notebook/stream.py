@@ -0,0 +1,62 @@
+#########################################################################
+# Copyright (C) 2007, 2008, 2009
+# Alex Clemesha <alex@clemesha.org> & Dorian Raymer <deldotdr@gmail.com>
+#
+# This module is part of codenode, and is distributed under the terms
+# of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
+#########################################################################
+
+"""
+Loading a notebook as a stream of newline delimited JSON.
+
+The cells are read from the database chunk_size at a time, in orderlist
+order, and each is written out as soon as its chunk is read; the first
+line describes the notebook. The client can render the first cells while
+the rest are still being read, and neither side holds the whole notebook
+in one JSON document.
+
+Returned as the content of an HttpResponse, the generators run while the
+response is written (the WSGI server sends each line as a chunk), so
+nothing here may be left to middleware that reads the whole content.
+"""
+
+from django.utils import simplejson as json
+
+from codenode.frontend.notebook import models
+from codenode.frontend.notebook.revision_utils import load_orderlist
+
+MIMETYPE = 'application/x-ndjson'
+
+CHUNK_SIZE = 50
+
+def iter_cells(notebook, chunk_size=CHUNK_SIZE):
+    """(guid, content, style, props,) of the cells of notebook in orderlist
+    order, one query per chunk_size cells. Cells not in the orderlist are
+    skipped, as when the notebook is displayed.
+    """
+    orderlist = load_orderlist(notebook.orderlist)
+    for start in range(0, len(orderlist), chunk_size):
+        chunk = orderlist[start:start + chunk_size]
+        rows = models.Cell.objects.filter(notebook=notebook, guid__in=chunk)
+        rows = dict([(row[0], row) for row in rows.values_list('guid', 'content', 'style', 'props')])
+        for cellid in chunk:
+            if cellid in rows:
+                yield rows.pop(cellid)
+
+def ndjson(head, items):
+    """Lines of JSON: the dict head, then each of items.
+    """
+    yield json.dumps(head) + '\n'
+    for item in items:
+        yield json.dumps(item) + '\n'
+
+def stream_notebook(notebook, settings=None):
+    """The content nbobject has, as lines: first the notebook (nbid,
+    title, orderlist, version and settings) then one line per cell with
+    guid, content, cellstyle and props.
+    """
+    head = {'nbid':notebook.guid, 'title':notebook.title, 'orderlist':notebook.orderlist,
+            'version':notebook.version, 'settings':settings or {}}
+    cells = ({'guid':guid, 'content':content, 'cellstyle':style, 'props':props}
+             for guid, content, style, props in iter_cells(notebook))
+    return ndjson(head, cells)
@@ -1,11 +1,20 @@
+import os
 import uuid
+import shutil
+import tempfile
 
 from django.contrib.auth.models import User
 from django.test.client import Client
 from django.test import TestCase
+from django.utils import simplejson as json
 
 from codenode.frontend.notebook import models
 from codenode.frontend.notebook import views
+from codenode.frontend.notebook import bulk
+from codenode.frontend.notebook import stream
+from codenode.frontend.notebook import revision
+from codenode.frontend.notebook.revision_utils import get_nb_revisions
+from codenode.frontend.notebook.images import ImageStore
 
 
 class TestNotebookModel(TestCase):
@@ -87,3 +96,237 @@ class TestNotebookModel(TestCase):
         # nb.delete() #clean up
     
     
+
+
+class TestImageStore(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = ImageStore(self.path, max_size=0, grace=0)
+        self.user = User(username='test')
+        self.user.save()
+        self.nb = models.Notebook(owner=self.user)
+        self.nb.save()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def add_image_cell(self, fn):
+        cell = models.Cell(guid=str(uuid.uuid4()).replace("-", ""),
+                notebook=self.nb, owner=self.user,
+                content=fn, style='outputimage')
+        cell.save()
+        return cell
+
+    def test_same_image_is_stored_once(self):
+        fn1 = self.store.put('image data')
+        fn2 = self.store.put('image data')
+        assert fn1 == fn2
+        assert os.listdir(self.path) == [fn1]
+
+    def test_collect_removes_unreferenced_images(self):
+        used = self.store.put('used')
+        unused = self.store.put('unused')
+        self.add_image_cell(used)
+        removed = self.store.collect()
+        assert removed == [unused]
+        assert os.listdir(self.path) == [used]
+
+    def test_all_images_of_a_cell_are_referenced(self):
+        first = self.store.put('first plot')
+        second = self.store.put('second plot')
+        self.add_image_cell('%s\n%s' % (first, second))
+        assert self.store.collect() == []
+        assert sorted(os.listdir(self.path)) == sorted([first, second])
+
+    def test_eviction_keeps_images_of_current_cells(self):
+        old = self.store.put('old' * 100)
+        current = self.store.put('current' * 100)
+        cell = self.add_image_cell(old)
+        cell.content = current
+        cell.save()
+        self.store.max_size = 1
+        removed = self.store.collect()
+        assert removed == [old]
+        assert os.listdir(self.path) == [current]
+
+
+class TestBulkSave(TestCase):
+
+    def setUp(self):
+        self.user = User(username='test')
+        self.user.save()
+        self.nb = models.Notebook(owner=self.user)
+        self.nb.save()
+
+    def cellsdata(self, n, content='x = %d'):
+        cellsdata = {}
+        for i in range(n):
+            cellsdata['cell%d' % i] = {'content':content % i, 'cellstyle':'input', 'props':'evaluate'}
+        return cellsdata
+
+    def test_new_cells_are_inserted_with_audit_rows(self):
+        bulk.save_notebook(self.nb, self.cellsdata(3), '["cell0","cell1","cell2"]')
+        assert models.Cell.objects.filter(notebook=self.nb).count() == 3
+        assert models.Cell.revisions.filter(notebook=self.nb, _audit_change_type='I').count() == 3
+        assert models.Notebook.objects.get(pk=self.nb.pk).orderlist == '["cell0","cell1","cell2"]'
+
+    def test_only_changed_cells_are_written(self):
+        cellsdata = self.cellsdata(3)
+        bulk.save_notebook(self.nb, cellsdata, '[]')
+        inserted, updated = bulk.save_cells(self.nb, cellsdata)
+        assert inserted == [] and updated == []
+        cellsdata['cell1']['content'] = 'x = 10'
+        inserted, updated = bulk.save_cells(self.nb, cellsdata)
+        assert [cell.guid for cell in updated] == ['cell1']
+        assert models.Cell.objects.get(guid='cell1').content == 'x = 10'
+        assert models.Cell.revisions.filter(guid='cell1').count() == 2
+
+    def test_missing_fields_keep_their_values(self):
+        bulk.save_notebook(self.nb, self.cellsdata(1), '["cell0"]')
+        bulk.save_delta(self.nb, {'cell0':{'content':'y = 1'}, 'cell1':{'content':'z'}})
+        cell = models.Cell.objects.get(guid='cell0')
+        assert (cell.content, cell.style, cell.props) == ('y = 1', 'input', 'evaluate')
+        assert models.Cell.objects.get(guid='cell1').props == ''
+
+    def test_delta_save_deletes_cells_and_checks_version(self):
+        version = bulk.save_delta(self.nb, self.cellsdata(3), '["cell0","cell1","cell2"]')
+        cellsdata = {'cell2':{'content':'y', 'cellstyle':'input', 'props':'evaluate'}}
+        version = bulk.save_delta(self.nb, cellsdata, None, ['cell0'], version)
+        assert models.Cell.objects.filter(notebook=self.nb).count() == 2
+        assert models.Cell.objects.get(guid='cell2').content == 'y'
+        assert models.Cell.revisions.filter(guid='cell0', _audit_change_type='D').count() == 1
+        # a client still holding the previous version is refused
+        try:
+            bulk.save_delta(self.nb, cellsdata, None, None, version - 1)
+        except bulk.VersionConflict:
+            pass
+        else:
+            assert False, 'stale version was accepted'
+
+    def test_saves_of_stale_copies_do_not_lose_versions(self):
+        other = models.Notebook.objects.get(pk=self.nb.pk)
+        bulk.save_notebook(self.nb, self.cellsdata(1), '["cell0"]')
+        bulk.save_notebook(other, self.cellsdata(2), '["cell0","cell1"]')
+        version = bulk.save_delta(self.nb, self.cellsdata(1), None)
+        assert (self.nb.version, other.version, version) == (3, 2, 3)
+        assert models.Notebook.objects.get(pk=self.nb.pk).version == 3
+        versions = models.Notebook.revisions.filter(guid=self.nb.guid, _audit_change_type='U')
+        assert sorted([nbrev.version for nbrev in versions]) == [1, 2, 3]
+
+    def test_stream_yields_cells_in_orderlist_order(self):
+        bulk.save_notebook(self.nb, self.cellsdata(5), '["cell3","cell0","cell4","cell1","cell2"]')
+        lines = list(stream.stream_notebook(self.nb))
+        assert json.loads(lines[0])['version'] == self.nb.version
+        cells = [json.loads(line) for line in lines[1:]]
+        assert [cell['guid'] for cell in cells] == ['cell3', 'cell0', 'cell4', 'cell1', 'cell2']
+        assert cells[0]['content'] == 'x = 3'
+        # chunks do not change the order
+        assert [row[0] for row in stream.iter_cells(self.nb, chunk_size=2)] == \
+                ['cell3', 'cell0', 'cell4', 'cell1', 'cell2']
+
+    def test_saving_cells_records_the_last_modification_on_the_notebook(self):
+        before = self.nb.last_modified
+        bulk.save_notebook(self.nb, self.cellsdata(2), '["cell0","cell1"]')
+        nb = models.Notebook.objects.get(pk=self.nb.pk)
+        assert nb.last_modified == models.Cell.objects.filter(notebook=nb).latest('last_modified').last_modified
+        assert nb.last_modified >= before
+        assert nb.last_modified_by() == self.user
+
+
+class TestRevisionCompression(TestCase):
+
+    def setUp(self):
+        self.user = User(username='test')
+        self.user.save()
+        self.nb = models.Notebook(owner=self.user)
+        self.nb.save()
+
+    def test_revisions_store_deltas_and_expand_to_full_content(self):
+        lines = ["line %d\n" % i for i in range(100)]
+        cell = models.Cell(guid='cell', notebook=self.nb, owner=self.user,
+                content=''.join(lines), style='input', props='evaluate')
+        cell.save()
+        contents = [cell.content]
+        for i in range(5):
+            lines[i * 10] = "changed %d\n" % i
+            cell.content = ''.join(lines)
+            cell.save()
+            contents.append(cell.content)
+        revs = list(models.Cell.revisions.filter(guid='cell').order_by('_audit_id'))
+        assert revs[0]._audit_snapshot
+        assert not revs[-1]._audit_snapshot and revs[-1].content == ''
+        revision.expand(revs)
+        assert [rev.content for rev in revs] == contents
+
+    def test_bulk_saves_store_deltas_of_all_cells(self):
+        lines = ["line %d\n" % i for i in range(100)]
+        cellsdata = {}
+        for cellid in ('cell0', 'cell1'):
+            cellsdata[cellid] = {'content':''.join(lines), 'cellstyle':'input', 'props':'evaluate'}
+        bulk.save_cells(self.nb, cellsdata)
+        lines[0] = "changed\n"
+        for cellid in cellsdata:
+            cellsdata[cellid]['content'] = ''.join(lines)
+        bulk.save_cells(self.nb, cellsdata)
+        for cellid in cellsdata:
+            revs = list(models.Cell.revisions.filter(guid=cellid).order_by('_audit_id'))
+            assert revs[0]._audit_snapshot
+            assert revs[1]._audit_base == revs[0]._audit_id
+            revision.expand(revs)
+            assert revs[1].content == ''.join(lines)
+
+
+class TestRevisionListing(TestCase):
+
+    def setUp(self):
+        self.user = User(username='test')
+        self.user.save()
+        self.nb = models.Notebook(owner=self.user)
+        self.nb.save()
+
+    def save(self, contents):
+        cellsdata = {}
+        for cellid, content in contents:
+            cellsdata[cellid] = {'content':content, 'cellstyle':'input', 'props':'evaluate'}
+        orderlist = '[%s]' % ','.join(['"%s"' % cellid for cellid, content in contents])
+        bulk.save_notebook(self.nb, cellsdata, orderlist)
+
+    def test_unchanged_revisions_are_skipped_and_pages_are_limited(self):
+        self.save([('a', 'x = 1')])
+        self.save([('a', 'x = 1')])
+        self.save([('a', 'x = 2'), ('b', 'y = 1')])
+        revisions = get_nb_revisions(self.nb.guid)
+        assert len(revisions) == 2
+        audit_id, ts, summary, orderlist = revisions[0]
+        assert orderlist == ['a', 'b']
+        assert 'y = 1' in summary and 'x = 2' in summary
+        assert len(get_nb_revisions(self.nb.guid, n=1, page=2)) == 1
+        assert get_nb_revisions(self.nb.guid, n=1, page=3) == []
+
+    def test_saves_store_the_change_summary(self):
+        self.save([('a', 'x = 1')])
+        self.save([('a', 'x = 1')])
+        self.save([('a', 'x = 2')])
+        nbrevs = models.Notebook.revisions.filter(guid=self.nb.guid).order_by('_audit_id')
+        assert [nbrev._audit_changed for nbrev in nbrevs] == [None, True, False, True]
+        assert nbrevs[3]._audit_summary == 'x = 2 | x = 1' or nbrevs[3]._audit_summary == 'x = 1 | x = 2'
+
+    def test_revert_restores_cells_with_a_single_revision(self):
+        self.save([('a', 'x = 1')])
+        first = models.Notebook.revisions.filter(guid=self.nb.guid).order_by('-_audit_id')[0]
+        self.save([('a', 'x = 2'), ('b', 'y = 1')])
+        cell_revisions = models.Cell.revisions.filter(notebook=self.nb).count()
+        bulk.revert_to_revision(first._audit_id)
+        assert models.Cell.objects.get(guid='a').content == 'x = 1'
+        assert models.Cell.revisions.filter(notebook=self.nb).count() == cell_revisions
+        latest = models.Notebook.revisions.filter(guid=self.nb.guid).order_by('-_audit_id')[0]
+        assert latest._audit_change_type == 'R'
+        assert latest._audit_revert_of == first._audit_id
+        assert latest.orderlist == '["a"]'
+        # the listing replays the revert instead of the cell revisions
+        self.nb = models.Notebook.objects.get(pk=self.nb.pk)
+        self.save([('a', 'x = 1'), ('c', 'z = 1')])
+        models.Notebook.revisions.filter(guid=self.nb.guid).update(_audit_changed=None)
+        audit_id, ts, summary, orderlist = get_nb_revisions(self.nb.guid)[0]
+        assert summary == 'z = 1'
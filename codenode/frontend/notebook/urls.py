@@ -13,6 +13,7 @@ from codenode.frontend.notebook.views import *
 urlpatterns = patterns('',
     url(r'^(?P<nbid>\w{32})/$', notebook, name='notebook'),
     url(r'^(?P<nbid>\w{32})/nbobject$', nbobject, name='nbobject'),
+    url(r'^(?P<nbid>\w{32})/nbstream$', nbstream, name='nbstream'),
     url(r'^(?P<nbid>\w{32})/save$', save, name='save'),
     url(r'^(?P<nbid>\w{32})/deletecell$', delete_cell, name='delete_cell'),
     url(r'^(?P<nbid>\w{32})/title$', title, name='title'),
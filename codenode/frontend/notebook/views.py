@@ -21,8 +21,11 @@ from codenode.frontend.notebook import models as notebook_models
 from codenode.frontend.usersettings.models import UserSettings
 
 from codenode.frontend.notebook import forms 
+from codenode.frontend.notebook import bulk
+from codenode.frontend.notebook import stream
 
-from codenode.frontend.notebook.revision_utils import get_nb_revisions, revert_to_revision
+from codenode.frontend.notebook.revision_utils import get_nb_revisions
+from codenode.frontend.notebook.bulk import revert_to_revision
 
 @login_required
 def notebook(request, nbid=None, owner=None, title=None, template_name='notebook/notebook.html'):
@@ -48,8 +51,14 @@ def notebook(request, nbid=None, owner=None, title=None, template_name='notebook
 def revisions(request, nbid=None, template_name='notebook/revisions.html'):
     """Notebook revisions.
     """
-    revisions = get_nb_revisions(nbid)
-    return render_to_response(template_name, {'nbid':nbid, 'user':request.user, 'revisions':revisions})
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    per_page = 25
+    revisions = get_nb_revisions(nbid, per_page, page)
+    return render_to_response(template_name, {'nbid':nbid, 'user':request.user, 'revisions':revisions,
+                                              'page':page, 'more':len(revisions) == per_page})
 
 @login_required
 def nbobject(request, nbid):
@@ -65,9 +74,18 @@ def nbobject(request, nbid):
     nbdata['nbid'] = nb.guid
     nbdata['orderlist'] = nb.orderlist
     nbdata['title'] = nb.title
+    nbdata['version'] = nb.version
     jsobj = json.dumps(nbdata)
     return HttpResponse(jsobj, mimetype="application/json")
 
+@login_required
+def nbstream(request, nbid):
+    """nbobject as newline delimited JSON, cells in order (see stream.py).
+    """
+    nb = notebook_models.Notebook.objects.get(owner=request.user, guid=nbid)
+    nbsettings = {'cell_input_border':'None', 'cell_output_border':'None'}
+    return HttpResponse(stream.stream_notebook(nb, nbsettings), mimetype=stream.MIMETYPE)
+
 @login_required
 def title(request, nbid):
     if request.method == "POST":
@@ -87,30 +105,7 @@ def save(request, nbid):
     nb = notebook_models.Notebook.objects.get(owner=request.user, guid=nbid)
     orderlist = request.POST.get('orderlist')
     cellsdata = json.loads(request.POST.get('cellsdata'))
-
-    for cellid, data in cellsdata.items():
-        cells = notebook_models.Cell.objects.filter(guid=cellid, notebook=nb)
-        content = data["content"]
-        style = data["cellstyle"]
-        props = data["props"]
-        if len(cells) > 0:
-            cell = cells[0]
-            cell.content = content
-            cell.type = u"text"
-            cell.style = style
-            cell.props = props
-            cell.save()
-        else:
-            cell = notebook_models.Cell(guid=cellid, 
-                            notebook=nb, 
-                            owner=nb.owner,
-                            content=content, 
-                            type=u"text", 
-                            style=style, 
-                            props=props)
-            nb.cell_set.add(cell)
-    nb.orderlist = orderlist
-    nb.save()
+    bulk.save_notebook(nb, cellsdata, orderlist)
     resp = {'resp':'ok'}
     jsobj = json.dumps(resp)
     return HttpResponse(jsobj, mimetype="application/json")
@@ -0,0 +1,36 @@
+#########################################################################
+# Copyright (C) 2007, 2008, 2009
+# Alex Clemesha <alex@clemesha.org> & Dorian Raymer <deldotdr@gmail.com>
+#
+# This module is part of codenode, and is distributed under the terms
+# of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
+#########################################################################
+
+"""
+The search app has no models; Django imports this module for every
+installed app, which connects the index to notebook changes.
+"""
+
+from django.db.models import signals
+
+from codenode.frontend.notebook.models import Notebook, Cell
+from codenode.frontend.notebook.bulk import cells_written
+from codenode.frontend.search.search import indexer
+
+
+def cell_saved(sender, instance, **kwargs):
+    indexer.update(instance.notebook.guid)
+
+def notebook_saved(sender, instance, **kwargs):
+    indexer.update(instance.guid)
+
+def notebook_deleted(sender, instance, **kwargs):
+    indexer.delete(instance.guid)
+
+def notebook_cells_written(sender, notebook, **kwargs):
+    indexer.update(notebook.guid)
+
+signals.post_save.connect(cell_saved, sender=Cell)
+signals.post_save.connect(notebook_saved, sender=Notebook)
+signals.post_delete.connect(notebook_deleted, sender=Notebook)
+cells_written.connect(notebook_cells_written)
@@ -6,66 +6,196 @@
 # of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
 #########################################################################
 
-'''
-import os
-from whoosh import index
-from whoosh import analysis
-from whoosh.qparser import QueryParser
-from whoosh.fields import Schema, STORED, ID, KEYWORD, TEXT
-from whoosh.filedb.filestore import FileStorage
-
-from django.db.models import signals
+"""
+Full text search of notebooks.
+
+The index (whoosh, or the built in simpleindex where whoosh is not
+installed) holds one document per notebook: its title and the text of its
+cells, plus (stored) everything the search results list, so answering a
+query needs no database access. Documents are keyed by notebook guid and
+restricted to their owner inside the index.
+
+Saving a notebook only queues its guid (see models.py for the signals).
+A background thread, the Indexer, collects queued notebooks for
+batch_delay seconds, reads them from the database in a few queries and
+writes them to the index in one commit. Every optimize_interval seconds
+it also merges the index segments.
+"""
+
+import time
+import Queue
+import threading
+
 from django.conf import settings
 
-from codenode import frontend
+from twisted.python import log
+
 from codenode.frontend.notebook.models import Notebook, Cell
+from codenode.frontend.bookshelf.listing import notebook_listing
+
 
-SEARCH_INDEX = settings.SEARCH_INDEX
-SEARCH_SCHEMA = Schema(
-    nbid=KEYWORD(stored=True),
-    owner=KEYWORD(stored=True),
-    title=TEXT(field_boost=3),
-    content=TEXT(analyzer=analysis.FancyAnalyzer())
-)
-
-def create_index(**kwargs):
-    if not os.path.exists(SEARCH_INDEX):
-        os.mkdir(SEARCH_INDEX)
-        storage = FileStorage(SEARCH_INDEX)
-        storage.create_index(SEARCH_SCHEMA)
-#Django signal registration
-signals.post_syncdb.connect(create_index)
-
-def update_index(**kwargs):
-    instance = kwargs['instance']
-    ix = index.open_dir(SEARCH_INDEX)
-    writer = ix.writer()
-    instvars = [instance.notebook.guid, instance.notebook.owner, instance.notebook.title, instance.content]
-    nbid, owner, title, content = [unicode(e) for e in instvars] #XXX is this unicode usage correct?
-    writer.add_document(nbid=nbid, owner=owner, title=title, content=content)
-    writer.commit()
-#Django signal registration
-signals.post_save.connect(update_index, sender=Cell)
-
-def search(q, default_field="content"):
-    ix = index.open_dir(SEARCH_INDEX)
-    searcher = ix.searcher()
-    parser = QueryParser(default_field, schema=ix.schema)
-    query = parser.parse(q)
-    results = searcher.search(query)
-    return results
-
-def delete(**kwargs):
-    """Remove deleted Notebook's Cells from the Index.
+def open_index(path=None, backend=None):
+    """Open (or create) the index of the SEARCH_BACKEND: 'whoosh', 'simple'
+    (simpleindex, no dependencies) or None for whoosh if it is installed.
     """
-    instance = kwargs['instance']
-    ix = index.open_dir(SEARCH_INDEX)
-    searcher = ix.searcher()
-    parser = QueryParser("nbid", schema=ix.schema)
-    query = parser.parse(instance.guid)
-    number_deleted = ix.delete_by_query(query)
-    ix.commit()
-#Django signal registration
-signals.post_delete.connect(delete, sender=Notebook)
-'''
+    if path is None:
+        path = settings.SEARCH_INDEX
+    if backend is None:
+        backend = getattr(settings, 'SEARCH_BACKEND', None)
+    if backend is None:
+        try:
+            import whoosh
+            backend = 'whoosh'
+        except ImportError:
+            backend = 'simple'
+    if backend == 'whoosh':
+        from codenode.frontend.search.whooshindex import WhooshIndex
+        return WhooshIndex(path)
+    if backend == 'simple':
+        from codenode.frontend.search.simpleindex import SimpleIndex
+        return SimpleIndex(path)
+    raise ValueError("Unknown search backend %r" % backend)
+
+
+def notebook_documents(nbids):
+    """Index documents of the notebooks with guids in nbids: list of dicts
+    with nbid, owner, title, content, engine, modified and location.
+    """
+    notebooks = list(Notebook.objects.filter(guid__in=nbids))
+    ids = [nb.id for nb in notebooks]
+    contents = {}
+    cells = Cell.objects.filter(notebook__in=ids).exclude(style='outputimage')
+    for notebook_id, content in cells.values_list('notebook', 'content'):
+        contents.setdefault(notebook_id, []).append(content)
+    listing = dict([(item['guid'], item) for item in notebook_listing(notebooks)])
+    docs = []
+    for nb in notebooks:
+        docs.append({
+            'nbid':unicode(nb.guid),
+            'owner':unicode(nb.owner_id),
+            'title':unicode(nb.title),
+            'content':u'\n'.join(contents.get(nb.id, [])),
+            'engine':listing[nb.guid]['engine'],
+            'modified':listing[nb.guid]['modified'],
+            'location':unicode(nb.location),
+            })
+    return docs
+
+
+class Indexer(threading.Thread):
+    """
+    Applies queued index changes in batches.
+
+    With synchronous set (e.g. in tests, where the writer thread could not
+    see the test transaction) changes are applied right away instead.
+    """
+
+    def __init__(self, index=None, batch_delay=None, batch_size=500, optimize_interval=None):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        if batch_delay is None:
+            batch_delay = getattr(settings, 'SEARCH_BATCH_DELAY', 1.0)
+        if optimize_interval is None:
+            optimize_interval = getattr(settings, 'SEARCH_OPTIMIZE_INTERVAL', 60 * 60)
+        self._index = index
+        self.batch_delay = batch_delay
+        self.batch_size = batch_size
+        self.optimize_interval = optimize_interval
+        self.last_optimize = time.time()
+        self.synchronous = False
+        self.queue = Queue.Queue()
+        self.start_lock = threading.Lock()
 
+    def getIndex(self):
+        if self._index is None:
+            self._index = open_index()
+            if self._index.created:
+                self.rebuild()
+        return self._index
+
+    def setIndex(self, index):
+        self._index = index
+
+    index = property(getIndex, setIndex)
+
+    def ensureStarted(self):
+        self.start_lock.acquire()
+        try:
+            if not self.isAlive():
+                self.start()
+        finally:
+            self.start_lock.release()
+
+    def put(self, op, nbid):
+        if self.synchronous:
+            self.apply([(op, nbid)])
+            return
+        self.ensureStarted()
+        self.queue.put((op, nbid))
+
+    def update(self, nbid):
+        self.put('update', nbid)
+
+    def delete(self, nbid):
+        self.put('delete', nbid)
+
+    def rebuild(self):
+        """Queue every notebook.
+        """
+        for nbid in Notebook.objects.values_list('guid', flat=True):
+            self.update(nbid)
+
+    def flush(self):
+        """Wait until everything queued so far is in the index.
+        """
+        if self.synchronous or not self.isAlive():
+            return
+        self.queue.put(('flush', None))
+        self.queue.join()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.batch_delay
+            while len(batch) < self.batch_size and batch[-1][0] != 'flush':
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(True, timeout))
+                except Queue.Empty:
+                    break
+            try:
+                self.apply(batch)
+                if time.time() - self.last_optimize > self.optimize_interval:
+                    self.index.optimize()
+                    self.last_optimize = time.time()
+            except Exception:
+                log.err()
+            for item in batch:
+                self.queue.task_done()
+
+    def apply(self, batch):
+        """Write a batch of (op, nbid) to the index; the last op for a
+        notebook wins.
+        """
+        ops = {}
+        for op, nbid in batch:
+            if op != 'flush':
+                ops[nbid] = op
+        if not ops:
+            return
+        updated = [nbid for nbid, op in ops.items() if op == 'update']
+        docs = notebook_documents(updated)
+        found = set([doc['nbid'] for doc in docs])
+        deleted = [nbid for nbid in ops if nbid not in found]
+        self.index.write(docs, deleted)
+
+
+indexer = Indexer()
+
+def search(q, owner, limit=50):
+    """Notebooks of owner (a User) matching the query q, best first: list
+    of dicts of the stored fields (see notebook_documents).
+    """
+    return indexer.index.search(q, unicode(owner.id), limit)
@@ -0,0 +1,296 @@
+#########################################################################
+# Copyright (C) 2007, 2008, 2009
+# Alex Clemesha <alex@clemesha.org> & Dorian Raymer <deldotdr@gmail.com>
+#
+# This module is part of codenode, and is distributed under the terms
+# of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
+#########################################################################
+
+"""
+Search index in pure Python, for hosts without whoosh.
+
+The index is a list of immutable segments, one per write, plus a
+manifest naming the live segments and the deleted documents in them.
+A segment is three files:
+
+ <name>.docs  one JSON line of stored fields per document
+ <name>.terms one line per term: term, offset and number of postings
+ <name>.post  postings, per term an array of unsigned ints
+              (document number, content frequency, title frequency) *
+              postings, read through mmap
+
+Replacing a document marks the old one deleted; once there are more than
+merge_factor segments (or on optimize) all segments are merged into one
+without the deleted documents.
+
+Queries match documents having every query term in title or content,
+ranked with BM25 over both fields, title matches weighted title_boost
+times. Only the owner's documents are scored.
+"""
+
+import os
+import re
+import math
+import mmap
+import array
+import threading
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+_re_token = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text):
+    """Lower case words of text; identifiers with underscores also yield
+    their parts.
+    """
+    tokens = []
+    for token in _re_token.findall(text.lower()):
+        tokens.append(token)
+        if '_' in token:
+            tokens.extend([part for part in token.split('_') if part])
+    return tokens
+
+def _counts(tokens):
+    counts = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+class Segment(object):
+
+    def __init__(self, path, name):
+        self.name = name
+        base = os.path.join(path, name)
+        self.docs = [json.loads(line) for line in open(base + '.docs')]
+        self.terms = {}
+        for line in open(base + '.terms'):
+            term, offset, count = line.decode('utf-8').rsplit(' ', 2)
+            self.terms[term] = (int(offset), int(count))
+        f = open(base + '.post', 'rb')
+        try:
+            if os.fstat(f.fileno()).st_size:
+                self.postfile = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.postfile = ''
+        finally:
+            f.close()
+        self.len_title = sum([doc['len_title'] for doc in self.docs])
+        self.len_content = sum([doc['len_content'] for doc in self.docs])
+
+    def postings(self, term):
+        """array of (document number, content frequency, title frequency)
+        * postings, or None.
+        """
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        offset, count = entry
+        postings = array.array('I')
+        postings.fromstring(self.postfile[offset:offset + count * 3 * postings.itemsize])
+        return postings
+
+
+def write_segment(path, name, docs, postings):
+    """docs: list of stored field dicts (with len_title and len_content)
+    postings: dict term: list of (document number, content frequency,
+    title frequency,)
+    """
+    base = os.path.join(path, name)
+    f = open(base + '.docs.tmp', 'w')
+    for doc in docs:
+        f.write(json.dumps(doc) + '\n')
+    f.close()
+    post = open(base + '.post.tmp', 'wb')
+    terms = open(base + '.terms.tmp', 'w')
+    offset = 0
+    for term in sorted(postings):
+        entries = array.array('I')
+        for entry in postings[term]:
+            entries.extend(entry)
+        post.write(entries.tostring())
+        terms.write('%s %d %d\n' % (term.encode('utf-8'), offset, len(postings[term])))
+        offset += len(entries) * entries.itemsize
+    post.close()
+    terms.close()
+    for ext in ('.docs', '.post', '.terms'):
+        os.rename(base + ext + '.tmp', base + ext)
+
+
+class SimpleIndex(object):
+    """
+    Same interface as WhooshIndex. write() and optimize() are meant for a
+    single writer (the Indexer thread); search() may run concurrently.
+    """
+
+    merge_factor = 10
+    title_boost = 3.0
+    k1 = 1.2
+    b = 0.75
+
+    stored_fields = ('nbid', 'owner', 'title', 'engine', 'modified', 'location')
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = os.path.join(path, 'MANIFEST')
+        self.created = False
+        if not os.path.exists(path):
+            os.makedirs(path)
+        if not os.path.exists(self.manifest):
+            self._writeManifest(0, [], {})
+            self.created = True
+        self.lock = threading.Lock()
+        self._load()
+
+    def _writeManifest(self, generation, names, deleted):
+        data = {'generation':generation, 'segments':names,
+                'deleted':dict([(name, sorted(docnums)) for name, docnums in deleted.items()])}
+        f = open(self.manifest + '.tmp', 'w')
+        f.write(json.dumps(data))
+        f.close()
+        os.rename(self.manifest + '.tmp', self.manifest)
+
+    def _load(self):
+        data = json.loads(open(self.manifest).read())
+        self.generation = data['generation']
+        segments = [Segment(self.path, name) for name in data['segments']]
+        deleted = dict([(seg.name, set(data['deleted'].get(seg.name, []))) for seg in segments])
+        self.state = (segments, deleted)
+        self.locations = {}
+        for seg in segments:
+            for docnum, doc in enumerate(seg.docs):
+                if docnum not in deleted[seg.name]:
+                    self.locations[doc['nbid']] = (seg.name, docnum)
+
+    def _commit(self, segments, deleted):
+        self._writeManifest(self.generation, [seg.name for seg in segments], deleted)
+        # readers pick up the new state as a whole
+        self.state = (segments, deleted)
+
+    def _newName(self):
+        self.generation += 1
+        return 'seg%d' % self.generation
+
+    def write(self, docs, deleted):
+        """Add or replace docs and remove the documents of the notebooks
+        with guids in deleted.
+        """
+        self.lock.acquire()
+        try:
+            segments, old_deleted = self.state
+            deleted_docs = dict([(name, set(docnums)) for name, docnums in old_deleted.items()])
+            for nbid in [doc['nbid'] for doc in docs] + list(deleted):
+                location = self.locations.pop(nbid, None)
+                if location is not None:
+                    deleted_docs[location[0]].add(location[1])
+            if docs:
+                name = self._newName()
+                stored, postings = [], {}
+                for docnum, doc in enumerate(docs):
+                    title = tokenize(doc.get('title', u''))
+                    content = tokenize(doc.get('content', u''))
+                    fields = dict([(field, doc.get(field)) for field in self.stored_fields])
+                    fields['len_title'], fields['len_content'] = len(title), len(content)
+                    stored.append(fields)
+                    title, content = _counts(title), _counts(content)
+                    for term in set(title) | set(content):
+                        postings.setdefault(term, []).append((docnum, content.get(term, 0), title.get(term, 0)))
+                    self.locations[doc['nbid']] = (name, docnum)
+                write_segment(self.path, name, stored, postings)
+                segments = segments + [Segment(self.path, name)]
+                deleted_docs[name] = set()
+            self._commit(segments, deleted_docs)
+            if len(segments) > self.merge_factor:
+                self._merge()
+        finally:
+            self.lock.release()
+
+    def optimize(self):
+        self.lock.acquire()
+        try:
+            self._merge()
+        finally:
+            self.lock.release()
+
+    def _merge(self):
+        segments, deleted = self.state
+        if len(segments) < 2 and not [1 for docnums in deleted.values() if docnums]:
+            return
+        docs, postings = [], {}
+        for seg in segments:
+            remap = {}
+            for docnum, doc in enumerate(seg.docs):
+                if docnum not in deleted[seg.name]:
+                    remap[docnum] = len(docs)
+                    docs.append(doc)
+            for term in seg.terms:
+                entries = seg.postings(term)
+                kept = postings.get(term, [])
+                for i in xrange(0, len(entries), 3):
+                    docnum = remap.get(entries[i])
+                    if docnum is not None:
+                        kept.append((docnum, entries[i + 1], entries[i + 2]))
+                if kept:
+                    postings[term] = kept
+        name = self._newName()
+        write_segment(self.path, name, docs, postings)
+        self._commit([Segment(self.path, name)], {name:set()})
+        self.locations = dict([(doc['nbid'], (name, docnum)) for docnum, doc in enumerate(docs)])
+        for seg in segments:
+            # searches still using them keep their mapping
+            for ext in ('.docs', '.post', '.terms'):
+                os.remove(os.path.join(self.path, seg.name + ext))
+
+    def search(self, q, owner, limit=50):
+        terms = list(set(tokenize(q)))
+        segments, deleted = self.state
+        if not terms or not segments:
+            return []
+        ndocs = sum([len(seg.docs) for seg in segments])
+        if not ndocs:
+            return []
+        avg_title = float(sum([seg.len_title for seg in segments])) / ndocs or 1.0
+        avg_content = float(sum([seg.len_content for seg in segments])) / ndocs or 1.0
+        per_segment = []
+        df = dict([(term, 0) for term in terms])
+        for seg in segments:
+            found = {}
+            for term in terms:
+                entries = seg.postings(term)
+                if entries is not None:
+                    df[term] += len(entries) / 3
+                    found[term] = entries
+            if len(found) == len(terms):
+                per_segment.append((seg, found))
+        idf = dict([(term, math.log(1.0 + (ndocs - df[term] + 0.5) / (df[term] + 0.5))) for term in terms])
+        k1, b = self.k1, self.b
+        hits = []
+        for seg, found in per_segment:
+            candidates = None
+            frequencies = {}
+            for term, entries in found.items():
+                docs = {}
+                for i in xrange(0, len(entries), 3):
+                    docs[entries[i]] = (entries[i + 1], entries[i + 2])
+                frequencies[term] = docs
+                if candidates is None:
+                    candidates = set(docs)
+                else:
+                    candidates &= set(docs)
+            for docnum in candidates:
+                doc = seg.docs[docnum]
+                if doc['owner'] != owner or docnum in deleted[seg.name]:
+                    continue
+                norm_content = k1 * (1 - b + b * doc['len_content'] / avg_content)
+                norm_title = k1 * (1 - b + b * doc['len_title'] / avg_title)
+                score = 0.0
+                for term in terms:
+                    tf_content, tf_title = frequencies[term][docnum]
+                    score += idf[term] * (tf_content * (k1 + 1) / (tf_content + norm_content) +
+                            self.title_boost * tf_title * (k1 + 1) / (tf_title + norm_title))
+                hits.append((score, doc))
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [dict([(field, doc[field]) for field in self.stored_fields]) for score, doc in hits[:limit]]
@@ -1,4 +1,6 @@
 import uuid
+import shutil
+import tempfile
 
 from django.contrib.auth.models import User
 from django.test.client import Client
@@ -11,17 +13,18 @@ from codenode.frontend.search import search
 
 from codenode.frontend.backend import models as backend_models
 
-#If you see this error: 
-#  OSError: [Errno 17] File exists: 'tests/search_index/_MAIN_LOCK'
-#Do this:
-#  First fix any errors, then do "rm -rf tests/search_index", then test again.
-#See here:
-#  http://groups.google.com/group/whoosh/browse_thread/thread/50a06857db36e792/dcbd7c4e2a4c842b
-
 
 class TestSearch(TestCase):
 
+    backend = None
+
     def setUp(self):
+        # the writer thread would not see the test transaction
+        self.saved_indexer = (search.indexer._index, search.indexer.synchronous)
+        self.index_path = tempfile.mkdtemp()
+        search.indexer.index = search.open_index(self.index_path, self.backend)
+        search.indexer.synchronous = True
+
         for user in [User(username='test'), User(username='test2')]:
             user.set_password('password')
             user.save()
@@ -41,6 +44,8 @@ class TestSearch(TestCase):
         allcells = models.Cell.objects.all()
         for cell in allcells:
             cell.delete()
+        search.indexer.index, search.indexer.synchronous = self.saved_indexer
+        shutil.rmtree(self.index_path)
 
     def test_search(self):
         #XXX Turn off Nose doctests?
@@ -78,9 +83,17 @@ class TestSearch(TestCase):
             )
         cell2.save()
 
-        guids = [result["nbid"] for result in search.search(u"foo")]
+        guids = [result["nbid"] for result in search.search(u"foo", self.user1)]
         assert nb1.guid in guids
         assert nb2.guid not in guids
+        assert search.search(u"foo", self.user2) == []
+
+    def test_deleted_notebooks_leave_the_index(self):
+        nb = models.Notebook(owner=self.user1, title="Foo")
+        nb.save()
+        assert [r["nbid"] for r in search.search(u"foo", self.user1)] == [nb.guid]
+        nb.delete()
+        assert search.search(u"foo", self.user1) == []
 
 
     def test_view_search(self):
@@ -136,3 +149,8 @@ class TestSearch(TestCase):
         assert nb1.guid != result_nbid #incorrect notebook owner 
         assert nb2.guid == result_nbid #contains search term
         assert nb3.guid != result_nbid  #no search terms
+
+
+class TestSimpleIndexSearch(TestSearch):
+
+    backend = 'simple'
@@ -0,0 +1,71 @@
+#########################################################################
+# Copyright (C) 2007, 2008, 2009
+# Alex Clemesha <alex@clemesha.org> & Dorian Raymer <deldotdr@gmail.com>
+#
+# This module is part of codenode, and is distributed under the terms
+# of the BSD License:  http://www.opensource.org/licenses/bsd-license.php
+#########################################################################
+
+"""
+Search index stored with whoosh.
+"""
+
+import os
+
+from whoosh import index
+from whoosh import analysis
+from whoosh.query import And, Term
+from whoosh.qparser import MultifieldParser
+from whoosh.fields import Schema, STORED, ID, TEXT
+
+SEARCH_SCHEMA = Schema(
+    nbid=ID(stored=True, unique=True),
+    owner=ID(stored=True),
+    title=TEXT(stored=True, field_boost=3.0),
+    content=TEXT(analyzer=analysis.FancyAnalyzer()),
+    engine=STORED,
+    modified=STORED,
+    location=STORED,
+)
+
+
+class WhooshIndex(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.created = False
+        if not os.path.exists(path):
+            os.makedirs(path)
+        if not index.exists_in(path):
+            index.create_in(path, SEARCH_SCHEMA)
+            self.created = True
+
+    def write(self, docs, deleted):
+        """Add or replace docs and remove the documents of the notebooks
+        with guids in deleted, in one commit.
+        """
+        ix = index.open_dir(self.path)
+        writer = ix.writer()
+        try:
+            for nbid in deleted:
+                writer.delete_by_term('nbid', nbid)
+            for doc in docs:
+                writer.update_document(**doc)
+        except:
+            writer.cancel()
+            raise
+        # merges small segments
+        writer.commit()
+
+    def optimize(self):
+        index.open_dir(self.path).optimize()
+
+    def search(self, q, owner, limit=50):
+        ix = index.open_dir(self.path)
+        searcher = ix.searcher()
+        try:
+            parser = MultifieldParser(['title', 'content'], schema=ix.schema)
+            query = And([parser.parse(q), Term('owner', owner)])
+            return [dict(hit) for hit in searcher.search(query, limit=limit)]
+        finally:
+            searcher.close()
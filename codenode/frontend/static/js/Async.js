@@ -77,25 +77,166 @@ Notebook.Async.evalCell = function(cellid, input) {
     if (input == '?') {
         var input = 'introspect?';
     }
-    var data = JSON.stringify({method:'evaluate', 'cellid':cellid, 'input':input});
-    /*
-    $.post(path, data, self.evalSuccess, 'json')
-    */
+    // starts the evaluation; the output is polled for while it runs
+    var data = JSON.stringify({method:'evaluate_stream', 'cellid':cellid, 'input':input});
     $.ajax({
             url:path,
             type:'POST',
             data:data,
             dataType:'json',
-            success:self.evalSuccess});
+            success:function(response) {
+                self.streamCell(cellid);
+            },
+            error:function(response) {
+                self.evalError(cellid);
+            }});
     return;
 }; 
 
+/** streamCell - show the output of the evaluation of cellid as it
+ * arrives, and the result once it is done.
+ */
+Notebook.Async.streamCell = function(cellid) {
+    var self = Notebook.Async;
+    var t = Notebook.TreeBranch;
+    var text = '';
+    var onChunks = function(chunks) {
+        for (var i = 0; i < chunks.length; i++) {
+            text += chunks[i][1];
+        }
+        if (chunks.length > 0) {
+            t.spawnOutputCellNode(cellid, 'outputtext', text, 'Out[ ]:');
+        }
+    };
+    var onDone = function(result) {
+        if (result == null) {
+            self.evalError(cellid);
+            return;
+        }
+        if (typeof(result) != 'object') {
+            result = {'out':String(result), 'err':'', 'cellstyle':'outputtext'};
+        }
+        if (result.cellstyle != 'outputimage') {
+            // out and err were streamed
+            result.out = text + result.out;
+        }
+        result.cellid = cellid;
+        self.evalSuccess(result);
+    };
+    self.pollOutput(cellid, onChunks, onDone);
+};
+
+/** pollOutput - long poll for the output of the streaming evaluation id
+ * until it is done. onChunks gets the [name, data] chunks of each poll,
+ * onDone the result of the evaluation (null if polling failed).
+ */
+Notebook.Async.pollOutput = function(id, onChunks, onDone) {
+    var self = Notebook.Async;
+    var path = INTERPRETER_URL;
+    var data = JSON.stringify({method:'output', 'cellid':id});
+    $.ajax({
+            url:path,
+            type:'POST',
+            data:data,
+            dataType:'json',
+            success:function(response) {
+                onChunks(response.chunks || []);
+                if (response.done) {
+                    onDone(response.result);
+                } else {
+                    self.pollOutput(id, onChunks, onDone);
+                }
+            },
+            error:function(response) {
+                onDone(null);
+            }});
+};
+
+/** evalAll - evaluate all input cells of the notebook, in order, in one
+ * engine call; stops at the first cell that raises.
+ */
+Notebook.Async.evalAll = function() {
+    var self = Notebook.Async;
+    var cells = [];
+    $('div.cell:not(.group)').each(function() {
+            if (this.evaluatable) {
+                this.evaluating = 2;
+                this.highlightBracket();
+                cells.push([this.id, this.content()]);
+            }
+            });
+    if (cells.length > 0) {
+        self.evalCells(cells, true);
+    }
+};
+
+/** evalCells - evaluate cells, a list of [cellid, input], in one engine
+ * call, showing the result of each cell as soon as it is done.
+ */
+Notebook.Async.evalCells = function(cells, stopOnError) {
+    var self = Notebook.Async;
+    var path = INTERPRETER_URL;
+    self.batchCount += 1;
+    var batchid = 'batch' + self.batchCount + '-' + new Date().getTime();
+    var pending = {};
+    for (var i = 0; i < cells.length; i++) {
+        pending[cells[i][0]] = true;
+    }
+    var show = function(item) {
+        delete pending[item.cellid];
+        item.result.cellid = item.cellid;
+        self.showResult(item.result);
+    };
+    var onChunks = function(chunks) {
+        for (var i = 0; i < chunks.length; i++) {
+            if (chunks[i][0] == 'result') {
+                show(chunks[i][1]);
+            }
+        }
+    };
+    var onDone = function(result) {
+        if (result != null && typeof(result) == 'object') {
+            var results = result.results || [];
+            for (var i = 0; i < results.length; i++) {
+                show(results[i]);
+            }
+        }
+        // not evaluated: the batch stopped early or failed
+        for (var cellid in pending) {
+            self.evalError(cellid);
+        }
+        Notebook.Save._save(self.evalSaveSuccess, self.evalSaveError);
+    };
+    var input = {'cells':cells, 'stop_on_error':stopOnError};
+    var data = JSON.stringify({method:'evaluate_batch', 'cellid':batchid, 'input':input});
+    $.ajax({
+            url:path,
+            type:'POST',
+            data:data,
+            dataType:'json',
+            success:function(response) {
+                self.pollOutput(batchid, onChunks, onDone);
+            },
+            error:function(response) {
+                onDone(null);
+            }});
+};
+
+Notebook.Async.batchCount = 0;
+
 Notebook.Async.evalSuccess = function(response) {
     var self = Notebook.Async;
+    self.showResult(response);
+    Notebook.Save._save(self.evalSaveSuccess, self.evalSaveError);
+};
+
+/** showResult - put the result of an evaluation into the notebook */
+Notebook.Async.showResult = function(response) {
     var t = Notebook.TreeBranch;
     var cellid = response.cellid;
-    var incount = 'In[' + response.input_count + ']:';
-    var outcount = 'Out[' + response.input_count + ']:';
+    var count = response.input_count == null ? ' ' : response.input_count;
+    var incount = 'In[' + count + ']:';
+    var outcount = 'Out[' + count + ']:';
     //$('#'+cellid)[0].saved = true; //not evaluating
     //This is where numbering of cells could go.
     $('#'+cellid)[0].numberLabel(incount);
@@ -103,10 +244,10 @@ Notebook.Async.evalSuccess = function(response) {
     var content = response.out + response.err;
     t.spawnOutputCellNode(cellid, cellstyle, content, outcount);
     $('#'+cellid)[0].evalResult();
-    Notebook.Save._save(self.evalSaveSuccess, self.evalSaveError);
 };
 
-Notebook.Async.evalError = function(response) {
+Notebook.Async.evalError = function(cellid) {
+    $('#'+cellid)[0].evalResult();
 };
 
 Notebook.Async.evalSaveSuccess = function(response) {
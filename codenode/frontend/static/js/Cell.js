@@ -537,7 +537,10 @@ Notebook.Cell.prototype.content = function(newcontent) {
                 case 'outputtext':
                     return this.contentNode().childNodes[0].value;
                 case 'outputimage':
-                    return $(this.contentNode()).find('img.outputimage')[0].name;
+                    // the names of the images, one per line
+                    return $.map($(this.contentNode()).find('img.outputimage'), function(n, i) {
+                            return n.name;
+                            }).join('\n');
             }
         }
         if (this.celltype == 'group') {
@@ -566,8 +569,16 @@ Notebook.Cell.prototype.content = function(newcontent) {
                     //this.contentNode().childNodes[0].src = newcontent;
                     //$(this.contentNode().firstChild).ready(console.info(this.contentNode().firstChild.firstChild.height));
                     // parameterize image path
-                    $(this.contentNode()).find('img.outputimage')[0].src = '/data/'+newcontent;
-                    $(this.contentNode()).find('img.outputimage')[0].name = newcontent;
+                    // one image per line of newcontent
+                    var names = newcontent.split('\n');
+                    $(this.contentNode()).find('a.outputimage:gt(0)').remove();
+                    for (var i = 1; i < names.length; i++) {
+                        $(this.contentNode()).append(Notebook.dom._imageoutput());
+                    }
+                    $(this.contentNode()).find('img.outputimage').each(function(i) {
+                            this.src = '/data/'+names[i];
+                            this.name = names[i];
+                            });
                     break;
             }
         }
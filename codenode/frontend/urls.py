@@ -18,6 +18,7 @@ urlpatterns = patterns("",
     (r'^admin/(.*)', admin.site.root),
     # XXX: 'notebook is a part of the old API, will be removed soon
     (r'^notebook/', include('codenode.frontend.notebook.urls')),
+    (r'^search', include('codenode.frontend.search.urls')),
 )
 
 if settings.DEBUG:
@@ -180,8 +180,10 @@ class ReST(Base):
             #content = content.decode('string escape')
             #xxx Uh, might not, uh, what 
             basepath = self.env_path
-            fullpath = basepath + content[7:] 
-            s = '.. image:: ' + fullpath + '\n\n'
+            s = ''
+            for name in content.splitlines():
+                fullpath = basepath + name[7:] 
+                s += '.. image:: ' + fullpath + '\n\n'
         else:
             #content = content.decode('string escape')
             c = content.splitlines()
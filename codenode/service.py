@@ -17,9 +17,9 @@ from zope.interface import implements
 
 from twisted.web import server, resource, wsgi, static
 from twisted.cred import portal, checkers, credentials
-from twisted.internet import reactor, defer
+from twisted.internet import reactor, defer, threads
 from twisted.application import internet, service
-from twisted.python import usage
+from twisted.python import usage, log
 from twisted.runner import procmon
 
 from codenode.frontend.async import backend
@@ -62,6 +62,27 @@ class FrontendOptions(usage.Options):
         print 'codenode WebApp version: %s' % VERSION
         sys.exit(0)
 
+class ImmutableFile(static.File):
+    """Static files that never change once written (content addressed
+    plot images), so clients may cache them for good.
+    """
+
+    cache_control = 'public, max-age=31536000'
+
+    def render(self, request):
+        if not self.isdir():
+            request.setHeader('cache-control', self.cache_control)
+        return static.File.render(self, request)
+
+def collectImages():
+    """Garbage collect the plot image store (in a thread, it queries the
+    database).
+    """
+    from codenode.frontend.notebook.images import image_store
+    d = threads.deferToThread(image_store.collect)
+    d.addErrback(log.err)
+    return d
+
 def webResourceFactory(staticfiles, datafiles):
     """This factory function creates an instance of the front end web
     resource tree containing both the django wsgi and the async
@@ -93,7 +114,7 @@ def webResourceFactory(staticfiles, datafiles):
     resource_root = Root(django_wsgi_resource)
 
     static_resource = static.File(staticfiles)
-    data_resource = static.File(datafiles)
+    data_resource = ImmutableFile(datafiles)
 
     backend_bus = backend.BackendBus()
 
@@ -134,6 +155,11 @@ class FrontendServiceMaker(object):
                                     interface=options['host'])
         frontend_server.setServiceParent(web_app_service)
 
+        gc_interval = getattr(settings, 'PLOT_IMAGES_GC_INTERVAL', 0)
+        if gc_interval:
+            image_gc = internet.TimerService(gc_interval, collectImages)
+            image_gc.setServiceParent(web_app_service)
+
         if options['devel_mode']:
             from twisted.conch.manhole import ColoredManhole
             from twisted.conch.insults import insults
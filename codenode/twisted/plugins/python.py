@@ -3,12 +3,12 @@ import os
 
 from codenode.backend.engine import EngineConfigurationBase
 
-boot = """from codenode.engine.server import EngineRPCServer
+boot = """from codenode.engine.server import EngineFrameServer
 from codenode.engine.interpreter import Interpreter
 from codenode.engine import runtime
 namespace = runtime.build_namespace
 port = runtime.find_port()
-server = EngineRPCServer(('localhost', port), Interpreter, namespace)
+server = EngineFrameServer(('localhost', port), Interpreter, namespace)
 runtime.ready_notification(port)
 server.serve_forever()
 """
@@ -19,6 +19,7 @@ class Python(EngineConfigurationBase):
     args = ['-c', boot]
     env = os.environ
     path = os.path.expanduser('~')
+    transport = 'frame'
 
 
 python = Python()